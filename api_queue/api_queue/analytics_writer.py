@@ -0,0 +1,85 @@
+import asyncio
+import collections
+from pathlib import Path
+
+import ujson as json
+from sanic.log import logger as log
+
+
+class AnalyticsWriter:
+    """
+    Append analytics events to a json-lines file in batches.
+
+    * `log()` only appends to an in-memory ring buffer of `maxsize` events.
+      If the buffer is full, the oldest event is dropped (and counted in `dropped`)
+    * A background task (`start()`) writes the buffer to `path` when it holds `batch_size` events,
+      or every `flush_interval` seconds - one open/write per batch, in a thread
+    * `close()` flushes the remaining events (e.g. on shutdown)
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        maxsize: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 5.0,
+    ) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: collections.deque[str] = collections.deque(maxlen=maxsize)
+        self._batch_ready = asyncio.Event()
+        self._worker: asyncio.Task[None] | None = None
+        self.logged = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    @property
+    def buffer_depth(self) -> int:
+        return len(self._buffer)
+
+    def start(self) -> None:
+        if not self._worker:
+            self._worker = asyncio.create_task(self._run())
+
+    def log(self, data: dict) -> None:
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                log.warning(f"[analytics] buffer full - {self.dropped} events dropped")
+        self._buffer.append(json.dumps(data) + "\n")
+        self.logged += 1
+        if len(self._buffer) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> None:
+        self._batch_ready.clear()
+        lines = [self._buffer.popleft() for _ in range(len(self._buffer))]
+        if not lines:
+            return
+        try:
+            await asyncio.to_thread(self._write, "".join(lines))
+        except Exception:
+            self.errors += 1
+            log.exception(f"[analytics] failed to write {len(lines)} events to {self.path}")
+            return
+        self.written += len(lines)
+
+    def _write(self, data: str) -> None:
+        with self.path.open("a", encoding="utf8") as filehandle:
+            filehandle.write(data)
+
+    async def close(self) -> None:
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+        await self.flush()
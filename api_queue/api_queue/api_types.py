@@ -3,27 +3,52 @@ import aiomqtt
 import sanic
 from pathlib import Path
 
-from .login_manager import LoginManager
+from .login_manager import LoginManager, User
 from .track_manager import TrackManager
 from .queue_manager import QueueManager
 from .settings_manager import SettingsManager
+from .mqtt_publisher import MqttPublisher
+from .leader_lock import LeaderLock
+from .analytics_writer import AnalyticsWriter
+from .static_files import CompressedCache
+from .metrics import Metrics
 
 
 class Ctx(types.SimpleNamespace):
     mqtt: aiomqtt.Client
+    mqtt_publisher: MqttPublisher
+    analytics_writer: AnalyticsWriter
     path_queue: Path
     session_id: str | None
+    user: User | None
+    request_started: float
     login_manager: LoginManager
     track_manager: TrackManager
+    tracks_updated_leader: LeaderLock
     settings_manager: SettingsManager
     queue_manager: QueueManager
+    compressed_cache: CompressedCache
+    metrics: Metrics
 
 
 class Config(sanic.Config):
     PATH_TRACKS: str
     PATH_QUEUE: str
+    PATH_ANALYTICS: str
+    ANALYTICS_BUFFER_SIZE: int
+    ANALYTICS_BATCH_SIZE: int
+    ANALYTICS_FLUSH_INTERVAL: float
+    QUEUE_JOURNAL: bool
+    QUEUE_JOURNAL_COMPACT_THRESHOLD: int
+    QUEUE_FILE_LOCK: bool
+    QUEUE_HISTORY: int | None
+    QUEUE_ARCHIVE_HOURS: float | None
+    STATIC_SNAPSHOTS: bool
     BACKGROUND_TASK_TRACK_UPDATE_ENABLED: bool
+    BACKGROUND_TASK_QUEUE_COMPACT_ENABLED: bool
     MQTT: str | None
+    MQTT_DEBOUNCE: float
+    MQTT_QUEUE_SIZE: int
 
 
 class App(sanic.Sanic[Config, Ctx]):
@@ -13,8 +13,13 @@ async def _background_tracks_update_event(app: App) -> None:
     if not app.ctx.track_manager.has_tracks_updated:
         return
 
+    # Every worker holds its own copy of the tracks
     log.info("`tracks.json` reload")
-    app.ctx.track_manager.reload_tracks()
+    await asyncio.to_thread(app.ctx.track_manager.reload_tracks)
+
+    # ... but only one worker needs to tell the clients
+    if not app.ctx.tracks_updated_leader.is_leader:
+        return
 
     tracks_json_mtime = app.ctx.track_manager.mtime
 
@@ -26,20 +31,46 @@ async def _background_tracks_update_event(app: App) -> None:
     )
 
 
-tracks_update_semaphore = asyncio.Semaphore(1)
+async def background_tracks_update_event(app: App) -> None:
+    """
+    A background task is created for each sanic worker (each is a separate process).
+    `wait_for_change` wakes on inotify events for `tracks.json`, with a poll every 60 seconds as a fallback.
+    """
+    log.info("background_tracks_update_event started")
+    while app.config.BACKGROUND_TASK_TRACK_UPDATE_ENABLED:
+        await _background_tracks_update_event(app)
+        await app.ctx.track_manager.wait_for_change(timeout=60)
+
 
+async def _background_queue_compact(app: App) -> None:
+    # A room that fails (e.g. a full disk) is retried next time - it must not stop the other rooms, or the task
+    try:
+        rooms_to_archive = app.ctx.queue_manager.rooms_to_archive
+    except Exception:
+        log.exception("background_queue_compact: failed to list rooms to archive")
+        rooms_to_archive = ()
+    for name in rooms_to_archive:
+        try:
+            await app.ctx.queue_manager.async_archive(name)
+        except Exception:
+            log.exception(f"background_queue_compact: failed to archive {name}")
+    try:
+        rooms_to_compact = app.ctx.queue_manager.rooms_to_compact
+    except Exception:
+        log.exception("background_queue_compact: failed to list rooms to compact")
+        rooms_to_compact = ()
+    for name in rooms_to_compact:
+        try:
+            await app.ctx.queue_manager.async_compact(name)
+        except Exception:
+            log.exception(f"background_queue_compact: failed to compact {name}")
 
-async def background_tracks_update_event(
+
+async def background_queue_compact(
     app: App,
     _asyncio_sleep: Callable[[int], Awaitable[None]] = asyncio.sleep,
 ) -> None:
-    # A background task is created for each sanic worker - Only allow one background process by aborting if another task has the semaphore
-    # WARNING?! I don't think this works. Workers are NOT async tasks, they are threads, so the asyncio.semaphore does nothing
-    if tracks_update_semaphore.locked():
-        log.debug("`tracks.json` background_tracks_update_event already active - cancel task")
-        return
-    async with tracks_update_semaphore:
-        log.info("background_tracks_update_event started")
-        while app.config.BACKGROUND_TASK_TRACK_UPDATE_ENABLED:
-            await _background_tracks_update_event(app)
-            await _asyncio_sleep(60)
+    log.info("background_queue_compact started")
+    while app.config.BACKGROUND_TASK_QUEUE_COMPACT_ENABLED:
+        await _asyncio_sleep(60)
+        await _background_queue_compact(app)
@@ -0,0 +1,44 @@
+import fcntl
+import os
+from pathlib import Path
+
+
+class LeaderLock:
+    """
+    Elect one process, of the sanic workers sharing `path`, to do work that should only happen once
+    (e.g. publishing `global/tracks-updated`).
+
+    The first process to `flock` the file is the leader and holds the lock until it exits.
+    The OS releases the lock if the leader dies, and another process takes over on its next `is_leader` check.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as path:
+    ...     lock1, lock2 = LeaderLock(Path(path, "test.lock")), LeaderLock(Path(path, "test.lock"))
+    ...     (lock1.is_leader, lock2.is_leader, lock1.is_leader)
+    ...     lock1.release()
+    ...     lock2.is_leader
+    ...     lock2.release()
+    (True, False, True)
+    True
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._fd: int | None = None
+
+    @property
+    def is_leader(self) -> bool:
+        if self._fd is None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)  # closing the file releases the flock
+            self._fd = None
@@ -28,8 +28,33 @@ class User(pydantic.BaseModel):
 
 
 class LoginManager:
+    """
+    The admin sessions for each room are cached in memory.
+    The cache is refreshed when `<room>_accounts.json` is written by `login`,
+    or its mtime/size changes (written by another process).
+    """
+
     def __init__(self, path: Path) -> None:
         self.path = path
+        self._admin_sessions: dict[str, tuple[tuple[int, int] | None, frozenset[str]]] = {}
+
+    def _path_accounts(self, room_name: str) -> Path:
+        return self.path / f"{room_name}_accounts.json"
+
+    def admin_sessions(self, room_name: str) -> frozenset[str]:
+        path = self._path_accounts(room_name)
+        try:
+            stat = path.stat()
+            version: tuple[int, int] | None = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            version = None
+        cached = self._admin_sessions.get(room_name)
+        if cached and cached[0] == version:
+            return cached[1]
+        accounts = RoomAccounts.model_validate_json(path.read_text()) if version else RoomAccounts()
+        admin_sessions = frozenset(accounts.admin_sessions)
+        self._admin_sessions[room_name] = (version, admin_sessions)
+        return admin_sessions
 
     def login(
         self,
@@ -37,15 +62,18 @@ class LoginManager:
         session_id: str,
         password: str,
     ) -> User:
-        with load_obj(self.path / f"{room_name}_accounts.json", RoomAccounts) as accounts:
-            if password == room_name:
-                if session_id not in accounts.admin_sessions:
-                    accounts.admin_sessions.add(session_id)
-                return User(is_admin=True)
-            else:
-                if session_id in accounts.admin_sessions:
-                    accounts.admin_sessions.remove(session_id)
-                return User(is_admin=False)
+        try:
+            with load_obj(self._path_accounts(room_name), RoomAccounts) as accounts:
+                if password == room_name:
+                    if session_id not in accounts.admin_sessions:
+                        accounts.admin_sessions.add(session_id)
+                    return User(is_admin=True)
+                else:
+                    if session_id in accounts.admin_sessions:
+                        accounts.admin_sessions.remove(session_id)
+                    return User(is_admin=False)
+        finally:
+            self._admin_sessions.pop(room_name, None)
 
     def load(
         self,
@@ -54,5 +82,4 @@ class LoginManager:
     ) -> User:
         if session_id is None:
             return User(is_admin=False)
-        with load_obj(self.path / f"{room_name}_accounts.json", RoomAccounts) as accounts:
-            return User(is_admin=session_id in accounts.admin_sessions)
+        return User(is_admin=session_id in self.admin_sessions(room_name))
@@ -0,0 +1,171 @@
+import collections.abc as ct
+import contextlib
+import math
+import threading
+import time
+from bisect import bisect_left
+
+# Seconds - from a cached `queue.json` (~1ms) to a lock held by a slow disk (~10s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (name, type, help, value) - a counter/gauge read from a component's own counters at render time
+type Sample = tuple[str, str, str, float]
+
+
+def _format_value(value: float) -> str:
+    """
+    >>> [_format_value(v) for v in (3, 0.25, math.inf)]
+    ['3', '0.25', '+Inf']
+    """
+    if value == math.inf:
+        return "+Inf"
+    return str(value)
+
+
+def _format_labels(labels: ct.Iterable[tuple[str, str]]) -> str:
+    """
+    >>> _format_labels([("room", "test"), ("route", 'a"b')])
+    '{room="test",route="a\\\\"b"}'
+    >>> _format_labels([])
+    ''
+    """
+    escaped = [(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}" if escaped else ""
+
+
+class Histogram:
+    """
+    A Prometheus histogram, with one series per combination of `labelnames`.
+    Observations can come from threads (e.g. storage in `asyncio.to_thread`).
+
+    >>> h = Histogram("test_seconds", "Test", ("room",), buckets=(0.1, 1.0))
+    >>> h.observe(0.05, room="a"); h.observe(0.5, room="a"); h.observe(5, room="a")
+    >>> print("\\n".join(h.render()))
+    # HELP test_seconds Test
+    # TYPE test_seconds histogram
+    test_seconds_bucket{room="a",le="0.1"} 1
+    test_seconds_bucket{room="a",le="1.0"} 2
+    test_seconds_bucket{room="a",le="+Inf"} 3
+    test_seconds_sum{room="a"} 5.55
+    test_seconds_count{room="a"} 3
+    """
+
+    def __init__(
+        self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> count per bucket (the last is +Inf) / sum of observations
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            if (counts := self._counts.get(key)) is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> ct.Generator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def remove(self, label: str, keep: ct.Container[str]) -> None:
+        """
+        Drop the series whose `label` value is not in `keep` (e.g. rooms that are no longer active)
+        """
+        if label not in self.labelnames:
+            return
+        index = self.labelnames.index(label)
+        with self._lock:
+            for key in [key for key in self._counts if key[index] not in keep]:
+                del self._counts[key], self._sums[key]
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        for key, counts, total in series:
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels((*labels, ('le', _format_value(bound))))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """
+    Timings for finding where a slow request spends its time, exposed in Prometheus text format.
+
+    * `request_seconds`: every request, by route
+    * `lock_wait_seconds`: waiting for a room lock (`QueueManager.async_queue_modify_context`)
+    * `storage_seconds`: reading/writing a room's files (`op`: load, save, journal, archive, static)
+    * `serialize_seconds`: building a room's `queue.json` payload
+    * `mqtt_publish_seconds`: sending a message to the broker (by topic type - `queue`, `settings`, ...)
+
+    Per-room series are only rendered (and kept) for active rooms, so the number of series does not
+    grow with every room name that is requested.
+    Counters that components already keep (`QueueManager.lock_waits`, `MqttPublisher.dropped`, ...)
+    are not duplicated - they are passed to `render` as `Sample`s.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.request_seconds = Histogram(
+            "api_queue_request_seconds", "Request latency", ("route", "method", "status"), buckets
+        )
+        self.lock_wait_seconds = Histogram(
+            "api_queue_lock_wait_seconds", "Time waiting for a room lock", ("room",), buckets
+        )
+        self.storage_seconds = Histogram(
+            "api_queue_storage_seconds", "Time reading/writing a room's files", ("room", "op"), buckets
+        )
+        self.serialize_seconds = Histogram(
+            "api_queue_serialize_seconds", "Time building a room's queue payload", ("room",), buckets
+        )
+        self.mqtt_publish_seconds = Histogram(
+            "api_queue_mqtt_publish_seconds", "Time sending a message to the mqtt broker", ("room", "topic"), buckets
+        )
+
+    @property
+    def histograms(self) -> tuple[Histogram, ...]:
+        return (
+            self.request_seconds,
+            self.lock_wait_seconds,
+            self.storage_seconds,
+            self.serialize_seconds,
+            self.mqtt_publish_seconds,
+        )
+
+    def render(self, rooms: ct.Collection[str], samples: ct.Iterable[Sample] = ()) -> str:
+        """
+        >>> metrics = Metrics(buckets=(1.0,))
+        >>> metrics.lock_wait_seconds.observe(0.5, room="active")
+        >>> metrics.lock_wait_seconds.observe(0.5, room="gone")
+        >>> text = metrics.render(rooms={"active"}, samples=[("api_queue_lock_waits_total", "counter", "Waits", 2)])
+        >>> [line for line in text.splitlines() if "lock_wait" in line and not line.startswith("#")]
+        ['api_queue_lock_wait_seconds_bucket{room="active",le="1.0"} 1', 'api_queue_lock_wait_seconds_bucket{room="active",le="+Inf"} 1', 'api_queue_lock_wait_seconds_sum{room="active"} 0.5', 'api_queue_lock_wait_seconds_count{room="active"} 1', 'api_queue_lock_waits_total 2']
+        """
+        # Rooms can be discarded from memory - drop their series rather than keeping every room seen
+        keep = {*rooms, ""}
+        lines: list[str] = []
+        for histogram in self.histograms:
+            histogram.remove("room", keep)
+            lines += histogram.render()
+        for name, type, help, value in samples:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {type}", f"{name} {_format_value(value)}"]
+        return "\n".join(lines) + "\n"
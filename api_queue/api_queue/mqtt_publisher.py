@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import time
+from collections.abc import Awaitable, Callable
+
+import aiomqtt
+from sanic.log import logger as log
+
+from .metrics import Metrics
+
+type Topic = str
+type Payload = str | bytes
+
+
+def _digest(payload: Payload) -> str:
+    return hashlib.sha256(payload.encode("utf8") if isinstance(payload, str) else payload).hexdigest()
+
+
+def _topic_labels(topic: Topic) -> dict[str, str]:
+    """
+    >>> _topic_labels("room/test/queue-patch")
+    {'room': 'test', 'topic': 'queue-patch'}
+    >>> _topic_labels("global/tracks-updated")
+    {'room': '', 'topic': 'global/tracks-updated'}
+    """
+    match topic.split("/"):
+        case ["room", room, kind]:
+            return {"room": room, "topic": kind}
+    return {"room": "", "topic": topic}
+
+
+class MqttPublisher:
+    """
+    Publish retained room state (`room/<name>/queue`, `room/<name>/settings`) to mqtt.
+
+    * `publish()` does not wait for the broker - topics are put on a bounded outbound queue
+      that a background task (`start()`) publishes from. Requests return as soon as their state is saved.
+    * Publishes to the same topic within `debounce` seconds, or while the topic is still waiting in the
+      outbound queue, are coalesced - only the latest payload is sent
+    * Payloads identical to the last payload published to a topic are dropped
+    * Non-retained payloads (`retain=False`) are events, not state - each one is published, in order,
+      and they are never coalesced or dropped as unchanged
+    * If the outbound queue is full, `publish()` waits up to `put_timeout` seconds for space (backpressure)
+      before dropping the update
+    * Failed publishes are retried (with backoff) after calling `reconnect`
+    * The time each broker publish takes is recorded in `metrics`
+    """
+
+    def __init__(
+        self,
+        mqtt: aiomqtt.Client,
+        debounce: float = 0.0,
+        maxsize: int = 1000,
+        put_timeout: float = 1.0,
+        reconnect: Callable[[], Awaitable[None]] | None = None,
+        retry_delay_max: float = 30.0,
+        metrics: Metrics | None = None,
+    ) -> None:
+        self.mqtt = mqtt
+        self.debounce = debounce
+        self.put_timeout = put_timeout
+        self.reconnect = reconnect
+        self.retry_delay_max = retry_delay_max
+        self.metrics = metrics or Metrics()
+        # Outbound messages are keyed by topic (retained - so later payloads replace earlier ones), or by a unique key (events)
+        self._outbound: asyncio.Queue[str] = asyncio.Queue(maxsize=maxsize)
+        self._pending: dict[str, tuple[Topic, Payload, str, float, bool]] = {}
+        self._pending_coalesced: dict[Topic, int] = {}
+        self._queued: set[str] = set()
+        self._events = 0
+        self._timers: dict[Topic, asyncio.Task[None]] = {}
+        self._published_digests: dict[Topic, str] = {}
+        self._worker: asyncio.Task[None] | None = None
+        self.published = 0
+        self.coalesced = 0
+        self.unchanged = 0
+        self.dropped = 0
+        self.errors = 0
+        self.publish_seconds_total = 0.0
+        self.publish_seconds_max = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._outbound.qsize()
+
+    def start(self) -> None:
+        if not self._worker:
+            self._worker = asyncio.create_task(self._run())
+
+    async def publish(self, topic: Topic, payload: Payload, digest: str | None = None, retain: bool = True) -> None:
+        """
+        `digest` can be provided if the caller already has a hash of `payload`
+        """
+        if not retain:
+            self._events += 1
+            key = f"{topic}#{self._events}"
+            self._pending[key] = (topic, payload, "", time.perf_counter(), False)
+            await self._enqueue(key)
+            return
+        if topic in self._pending:
+            self.coalesced += 1
+            self._pending_coalesced[topic] = self._pending_coalesced.get(topic, 0) + 1
+        self._pending[topic] = (topic, payload, digest or _digest(payload), time.perf_counter(), True)
+        if self.debounce <= 0:
+            await self._enqueue(topic)
+        elif topic not in self._timers and topic not in self._queued:
+            self._timers[topic] = asyncio.create_task(self._enqueue_later(topic))
+
+    async def _enqueue_later(self, topic: Topic) -> None:
+        try:
+            await asyncio.sleep(self.debounce)
+            await self._enqueue(topic)
+        finally:
+            self._timers.pop(topic, None)
+
+    async def _enqueue(self, key: str) -> None:
+        if key in self._queued:
+            return  # already waiting to be published - the worker will pick up the latest payload
+        try:
+            await asyncio.wait_for(self._outbound.put(key), timeout=self.put_timeout)
+        except TimeoutError:
+            self.dropped += 1
+            self._pending.pop(key, None)
+            log.warning(f"[mqtt] outbound queue full - dropped {key}")
+            return
+        self._queued.add(key)
+
+    async def _run(self) -> None:
+        while True:
+            key = await self._outbound.get()
+            try:
+                await self._publish(key)
+            finally:
+                self._outbound.task_done()
+
+    async def _publish(self, key: str) -> None:
+        retry_delay = 0.5
+        while True:
+            # the payload is taken at the last moment, so updates that arrive while retrying are coalesced
+            self._queued.discard(key)
+            if key not in self._pending:
+                return
+            topic, payload, digest, enqueued, retain = self._pending.pop(key)
+            coalesced = self._pending_coalesced.pop(topic, 0) if retain else 0
+            if retain and self._published_digests.get(topic) == digest:
+                self.unchanged += 1
+                log.debug(f"[mqtt] {topic} unchanged - not published")
+                return
+            try:
+                with self.metrics.mqtt_publish_seconds.time(**_topic_labels(topic)):
+                    await self.mqtt.publish(topic, payload, retain=retain)
+            except Exception:
+                self.errors += 1
+                log.exception(f"[mqtt] failed to publish {topic} - retrying in {retry_delay}s")
+                self._pending.setdefault(key, (topic, payload, digest, enqueued, retain))
+                self._queued.add(key)
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, self.retry_delay_max)
+                await self._reconnect()
+                continue
+            seconds = time.perf_counter() - enqueued
+            self.publish_seconds_total += seconds
+            self.publish_seconds_max = max(self.publish_seconds_max, seconds)
+            if retain:
+                self._published_digests[topic] = digest
+            self.published += 1
+            log.info(f"[mqtt] publish {topic} ({coalesced} coalesced, {seconds:.3f}s)")
+            return
+
+    async def _reconnect(self) -> None:
+        if not self.reconnect:
+            return
+        try:
+            await self.reconnect()
+        except Exception:
+            log.exception("[mqtt] reconnect failed")
+
+    async def flush(self, timeout: float = 5.0) -> None:
+        """
+        Publish everything pending immediately and wait for the outbound queue to drain (e.g. on shutdown)
+        """
+        for timer in tuple(self._timers.values()):
+            timer.cancel()
+        self._timers.clear()
+        for key in tuple(self._pending):
+            await self._enqueue(key)
+        self.start()
+        try:
+            await asyncio.wait_for(self._outbound.join(), timeout=timeout)
+        except TimeoutError:
+            log.warning(f"[mqtt] {self.queue_depth} publishes still outstanding after {timeout}s")
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
@@ -1,60 +1,639 @@
 import contextlib
 import csv
-from pathlib import Path
+import datetime
+import fcntl
+import hashlib
 import io
+import os
+import tempfile
+import time
+from pathlib import Path
 import asyncio
 from collections import defaultdict
 import typing as t
 
+import ujson as json
+from sanic.log import logger as log
+
+from .metrics import Metrics
 from .settings_manager import SettingsManager
-from .queue_model import Queue, QueueItem
+from .queue_model import Queue, QueueEntry, QueueItem, QueueChange
+from .queue_updated_actions import RANK_PERFORMER_HOURS
+from .static_files import write_precompressed
 
 type QueueName = str
+type DiskVersion = tuple[tuple[int, int, int] | None, ...]
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    """
+    Write to temp file then rename, so a crash mid-write never leaves a torn file.
+    The temp file is unique, so concurrent writers (other workers) never write into each other's file.
+    """
+    fd, path_tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as filehandle:
+            os.fchmod(filehandle.fileno(), 0o644)  # `mkstemp` creates files only readable by the owner
+            filehandle.write(data)
+            filehandle.flush()
+            os.fsync(filehandle.fileno())
+        os.replace(path_tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path_tmp)
+        raise
+
+
+class QueuePayload(t.NamedTuple):
+    """
+    A room's queue serialized for clients, shared by mqtt, `queue.json` and its ETag.
+    `seq` is the room's change sequence number (see `QueueManager`)
+    """
+
+    data: bytes
+    etag: str
+    seq: int
+    items: list[dict[str, t.Any]]
+
+    @classmethod
+    def from_json(cls, items: list[dict[str, t.Any]], seq: int = 0) -> t.Self:
+        data = json.dumps(items).encode("utf8")
+        return cls(data, f'"{_digest(data)[:32]}"', seq, items)
+
+
+EMPTY_QUEUE_PAYLOAD = QueuePayload.from_json([])
+
+
+def queue_patch(old: QueuePayload, new: QueuePayload) -> dict[str, t.Any] | None:
+    """
+    The difference between two consecutive payloads, for clients that already hold `old`:
+    * `removed`: ids to remove
+    * `added`: items to append (new, or changed other than their start_time)
+    * `start_times`: `[id, start_time]` for items whose start_time changed
+    * `order`: all the ids in their new order - only present if the order is not
+      the old order without `removed`, followed by `added`
+    Returns None if `new` does not directly follow `old`.
+
+    >>> item = lambda id, start_time=None: {"id": id, "track_id": f"Track{id}", "start_time": start_time}
+    >>> old = QueuePayload.from_json([item(1, 100.0), item(2, 200.0), item(3, 300.0)], seq=1)
+    >>> patch = queue_patch(old, QueuePayload.from_json([item(1, 100.0), item(3, 200.0), item(4, 300.0)], seq=2))
+    >>> {key: value for key, value in patch.items() if "etag" not in key}
+    {'seq': 2, 'removed': [2], 'added': [{'id': 4, 'track_id': 'Track4', 'start_time': 300.0}], 'start_times': [[3, 200.0]]}
+    >>> patch["prev_etag"] == old.etag
+    True
+    >>> queue_patch(old, QueuePayload.from_json([item(2, 100.0), item(1, 200.0), item(3, 300.0)], seq=2))["order"]
+    [2, 1, 3]
+    >>> queue_patch(old, QueuePayload.from_json([], seq=3)) is None
+    True
+    """
+    if new.seq != old.seq + 1:
+        return None
+    old_items = {item["id"]: item for item in old.items}
+    new_ids = {item["id"] for item in new.items}
+    removed = [id for id in old_items if id not in new_ids]
+    added: list[dict[str, t.Any]] = []
+    start_times: list[list[t.Any]] = []
+    for item in new.items:
+        old_item = old_items.get(item["id"])
+        if old_item is None or old_item | {"start_time": item["start_time"]} != item:
+            if old_item is not None:
+                removed.append(item["id"])
+            added.append(item)
+        elif old_item["start_time"] != item["start_time"]:
+            start_times.append([item["id"], item["start_time"]])
+    patch: dict[str, t.Any] = {
+        "seq": new.seq,
+        "etag": new.etag,
+        "prev_etag": old.etag,
+        "removed": removed,
+        "added": added,
+        "start_times": start_times,
+    }
+    removed_ids = set(removed)
+    order = [item["id"] for item in new.items]
+    if order != [id for id in old_items if id not in removed_ids] + [item["id"] for item in added]:
+        patch["order"] = order
+    return patch
 
 
 class QueueManager:
-    def __init__(self, path: Path, settings: SettingsManager):
+    """
+    The in-memory `Queue` for each room is the source of truth.
+    It is loaded from disk on first access and only written back to disk after a change.
+
+    Storage modes:
+    * csv: `<room>.csv` is rewritten in full after every change
+    * journal: each change is appended to `<room>.journal` as a single json line.
+      On load, the journal is replayed on top of the `<room>.csv` snapshot.
+      `compact()` folds the journal back into a new snapshot.
+      The first line of the journal is a header with the digest of the snapshot it applies to.
+      If a crash happens after the snapshot is replaced but before the journal is reset,
+      the digest will not match, and the (already applied) journal is ignored.
+      Loading never writes: a torn or mismatched journal is replaced by the room's next snapshot.
+      Unreadable records are skipped, and replay stops at a record that no longer applies - the room
+      loads as of the last good record, and its next change (or compaction) writes a fresh snapshot.
+
+    Each change to a room increments its sequence number (`seqs`), which clients can use to spot missed
+    updates. In journal mode it is stored in the journal header and records, so it carries on across restarts
+    and is shared by workers. In csv mode it is only held in memory (per process), and restarts from 0.
+
+    With `history`, the payload published to clients (`for_json`/`payload`) only holds the last `history`
+    played items, so it does not grow all event. Every item is still available from `history_json`.
+
+    With `archive_after`, items that finished longer ago than `archive_after` (and the duplicate validation
+    windows and `RANK_PERFORMER_HOURS`, which look back at played items) are moved out of the active queue
+    to the append-only `<room>.archive` (json lines), so loading and saving a room does not cost more as
+    the event goes on. A crash between appending to the archive and saving the snapshot can leave an item
+    in both - readers of the archive drop items that are still in the queue.
+
+    With `static_path`, each change also writes the payload to `<static_path>/<room>/queue.json`
+    (with precompressed `.br`/`.gz`), so a static file server can answer `queue.json` without the api.
+
+    With `file_lock`, several processes (sanic workers) can share `path`:
+    * `async_queue_modify_context` and `async_compact` hold an `flock` on `<room>.lock`,
+      so only one process modifies a room at a time. Loading a room holds a shared lock.
+    * If a room's files on disk are not the ones this process last read/wrote, another
+      process has changed the room, and the in-memory queue is reloaded
+    * Time spent waiting for locks is recorded in `lock_wait_*`
+
+    Lock waits, storage reads/writes and payload serialization are also timed (per room) in `metrics`.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        settings: SettingsManager,
+        journal: bool = False,
+        journal_compact_threshold: int = 100,
+        file_lock: bool = False,
+        history: int | None = None,
+        archive_after: datetime.timedelta | None = None,
+        static_path: Path | None = None,
+        metrics: Metrics | None = None,
+    ):
         assert path.is_dir()
         self.path = path
         self.settings = settings
+        self.journal = journal
+        self.journal_compact_threshold = journal_compact_threshold
+        self.file_lock = file_lock
+        self.history = history
+        self.archive_after = archive_after
+        self.static_path = static_path
+        self.metrics = metrics or Metrics()
+        self.journal_lengths: dict[QueueName, int] = {}
+        self.disk_versions: dict[QueueName, DiskVersion] = {}
+        self.lock_waits = 0
+        self.lock_wait_seconds_total = 0.0
+        self.lock_wait_seconds_max = 0.0
         self.queue_async_locks: defaultdict[QueueName, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.queues: dict[QueueName, Queue] = {}
+        self.payloads: dict[QueueName, QueuePayload] = {}
+        self.seqs: dict[QueueName, int] = {}
+        self._locked: set[QueueName] = set()
+        # Rooms whose journal could not be fully replayed - the next write must be a snapshot, not an append
+        self._needs_snapshot: set[QueueName] = set()
+        # Digest of the snapshot each room was loaded from - the header for a journal that does not exist yet
+        self._snapshot_digests: dict[QueueName, str] = {}
 
     def path_csv(self, name: QueueName) -> Path:
         return self.path.joinpath(f"{name}.csv")
 
-    def for_json(self, name: QueueName) -> list[dict[str, t.Any]]:
-        file_context = (
-            self.path_csv(name).open("r", encoding="utf8") if self.path_csv(name).is_file() else io.StringIO("")
+    def path_journal(self, name: QueueName) -> Path:
+        return self.path.joinpath(f"{name}.journal")
+
+    def path_lock(self, name: QueueName) -> Path:
+        return self.path.joinpath(f"{name}.lock")
+
+    def path_archive(self, name: QueueName) -> Path:
+        return self.path.joinpath(f"{name}.archive")
+
+    def path_static(self, name: QueueName) -> Path | None:
+        return self.static_path.joinpath(name, "queue.json") if self.static_path else None
+
+    def _exists(self, name: QueueName) -> bool:
+        return self.path_csv(name).is_file() or (self.journal and self.path_journal(name).is_file())
+
+    # Storage ------------------------------------------------------------------
+
+    def _load(self, name: QueueName) -> Queue:
+        # Don't read a room while another process is part way through writing it.
+        # Loading only reads - a journal that needs repair is replaced by the next (exclusively locked) write.
+        with (
+            contextlib.nullcontext() if name in self._locked else self._room_file_lock(name, shared=True),
+            self.metrics.storage_seconds.time(room=name, op="load"),
+        ):
+            path_csv = self.path_csv(name)
+            data = path_csv.read_bytes() if path_csv.is_file() else b""
+            queue = self._snapshot_queue(name, data)
+            if self.journal:
+                self._needs_snapshot.discard(name)
+                self._snapshot_digests[name] = _digest(data)
+                changes = self._read_journal(name, self._snapshot_digests[name])
+                applied = self._replay(name, queue, changes)
+                if applied < len(changes):
+                    # The failed change may have partly modified the queue - rebuild it up to the last good record
+                    queue = self._snapshot_queue(name, data)
+                    self._replay(name, queue, changes[:applied])
+                    self._needs_snapshot.add(name)
+                self.journal_lengths[name] = applied
+            self.disk_versions[name] = self._disk_version(name)
+        return queue
+
+    def _snapshot_queue(self, name: QueueName, data: bytes) -> Queue:
+        return Queue(
+            [QueueEntry.from_row(row) for row in csv.DictReader(io.StringIO(data.decode("utf8")))],
+            self.settings.get(name),
         )
-        with file_context as filehandle:
-            outs: list[dict[str, t.Any]] = []
-            for row in csv.DictReader(filehandle):
-                item = QueueItem.model_validate(row).model_dump(mode="json", exclude={"added_time", "debug_str"})
-                item["session_id"] = item["session_id"].split("-")[0]
-                outs.append(item)
-            return outs
 
-    @contextlib.contextmanager
-    def queue_modify_context(self, name: QueueName):
-        path_csv = self.path_csv(name)
-        path_csv.touch()
-        with path_csv.open("r+", encoding="utf8") as filehandle:
-            queue = Queue(
-                [QueueItem.model_validate(row) for row in csv.DictReader(filehandle)],
-                self.settings.get(name),
-            )
-            yield queue
-            if queue.modified:
-                filehandle.seek(0)
-                filehandle.truncate(0)
-                fields = QueueItem.model_json_schema()["properties"].keys()
+    def _read_journal(self, name: QueueName, snapshot_digest: str) -> list[QueueChange]:
+        path_journal = self.path_journal(name)
+        changes: list[QueueChange] = []
+        try:
+            filehandle = path_journal.open("rb")
+        except FileNotFoundError:
+            return changes  # the header is written with the first append
+        with filehandle:
+            header: dict[str, t.Any] | None = None
+            offset = 0
+            for line in filehandle:
+                if not line.endswith(b"\n"):
+                    # A crash mid-append can leave a torn final line - appending after it would corrupt the next record
+                    log.warning(f"[queue_manager] {path_journal} torn record at {offset=} - ignored")
+                    self._needs_snapshot.add(name)
+                    break
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    log.error(f"[queue_manager] {path_journal} unreadable record at {offset=} - skipped")
+                    self._needs_snapshot.add(name)
+                    continue
+                if header is None:
+                    header = record
+                else:
+                    changes.append(record)
+        if not header or header.get("snapshot") != snapshot_digest:
+            log.warning(f"[queue_manager] {path_journal} does not match snapshot - ignoring journal")
+            self._needs_snapshot.add(name)
+            return []
+        self.seqs[name] = header.get("seq", 0)
+        return changes
+
+    def _replay(self, name: QueueName, queue: Queue, changes: t.Sequence[QueueChange]) -> int:
+        """
+        Apply `changes` in order, up to the first that fails. Returns the number applied.
+        """
+        for index, change in enumerate(changes):
+            try:
+                queue.apply_change(change)
+            except Exception:
+                log.exception(
+                    f"[queue_manager] {name} journal record {index} ({change.get('op')}) failed to replay - "
+                    f"dropping it and the {len(changes) - index - 1} records after it"
+                )
+                return index
+            self.seqs[name] = change.get("seq", self.seqs.get(name, 0))
+        return len(changes)
+
+    def _reset_journal(self, name: QueueName, snapshot_digest: str, seq: int | None = None) -> None:
+        header = {"snapshot": snapshot_digest, "seq": self.seqs.get(name, 0) if seq is None else seq}
+        _write_atomic(self.path_journal(name), json.dumps(header).encode("utf8") + b"\n")
+        self.journal_lengths[name] = 0
+
+    def _append_journal(self, name: QueueName, changes: t.Iterable[QueueChange], seq: int) -> None:
+        lines = [json.dumps(change | {"seq": seq}) + "\n" for change in changes]
+        if not self.path_journal(name).is_file():
+            self._reset_journal(name, self._snapshot_digests[name])
+        with (
+            self.metrics.storage_seconds.time(room=name, op="journal"),
+            self.path_journal(name).open("ab") as filehandle,
+        ):
+            filehandle.write("".join(lines).encode("utf8"))
+            filehandle.flush()
+            os.fsync(filehandle.fileno())
+        self.journal_lengths[name] += len(lines)
+        self.disk_versions[name] = self._disk_version(name)
+
+    def _save(self, name: QueueName, queue: Queue, seq: int | None = None) -> None:
+        with self.metrics.storage_seconds.time(room=name, op="save"):
+            with io.StringIO() as filehandle:
+                fields = QueueItem.model_fields.keys()
                 writer = csv.DictWriter(filehandle, fields)
                 writer.writeheader()
                 for i in queue.items:
-                    writer.writerow(i.model_dump(mode="json"))
+                    writer.writerow(i.to_row())
+                data = filehandle.getvalue().encode("utf8")
+            _write_atomic(self.path_csv(name), data)
+            if self.journal:
+                self._reset_journal(name, _digest(data), seq)
+                self._needs_snapshot.discard(name)
+        self.disk_versions[name] = self._disk_version(name)
+
+    def _disk_version(self, name: QueueName) -> DiskVersion:
+        def _stat(path: Path) -> tuple[int, int, int] | None:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                return None
+            return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        return (_stat(self.path_csv(name)), _stat(self.path_journal(name)) if self.journal else None)
+
+    def _discard_if_stale(self, name: QueueName) -> None:
+        if self.file_lock and name in self.queues and self.disk_versions.get(name) != self._disk_version(name):
+            log.info(f"[queue_manager] {name} changed by another process - reloading")
+            del self.queues[name]
+            self.payloads.pop(name, None)
+
+    @contextlib.contextmanager
+    def _room_file_lock(self, name: QueueName, shared: bool = False):
+        if not self.file_lock:
+            yield
+            return
+        fd = os.open(self.path_lock(name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # closing the file releases the flock
 
     @contextlib.asynccontextmanager
-    async def async_queue_modify_context(self, name: QueueName):
+    async def _async_room_file_lock(self, name: QueueName):
+        if not self.file_lock:
+            yield
+            return
+        fd = os.open(self.path_lock(name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Don't block the event loop waiting for another process - poll with backoff
+            retry_delay = 0.001
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, 0.05)
+            yield
+        finally:
+            os.close(fd)  # closing the file releases the flock
+
+    @contextlib.asynccontextmanager
+    async def _room_lock(self, name: QueueName):
+        started = time.perf_counter()
+        async with self.queue_async_locks[name], self._async_room_file_lock(name):
+            seconds = time.perf_counter() - started
+            self.metrics.lock_wait_seconds.observe(seconds, room=name)
+            self.lock_waits += 1
+            self.lock_wait_seconds_total += seconds
+            self.lock_wait_seconds_max = max(self.lock_wait_seconds_max, seconds)
+            if seconds > 1:
+                log.warning(f"[queue_manager] waited {seconds:.3f}s for {name} lock")
+            self._locked.add(name)
+            try:
+                yield
+            finally:
+                self._locked.discard(name)
+
+    def compact(self, name: QueueName) -> None:
+        """
+        Fold the journal into a new `<room>.csv` snapshot
+        """
+        if not self.journal or not self.path_journal(name).is_file():
+            return
+        queue = self.get(name)
+        if self.journal_lengths.get(name) or name in self._needs_snapshot:
+            log.info(f"[queue_manager] compact {name} ({self.journal_lengths[name]} journal records)")
+            self._save(name, queue)
+
+    @property
+    def rooms_to_compact(self) -> t.Sequence[QueueName]:
+        # Snapshot the dict first - rooms loaded by request threads (`asyncio.to_thread`) add to it at any time
+        return tuple(
+            name
+            for name, length in tuple(self.journal_lengths.items())
+            if length >= self.journal_compact_threshold or name in self._needs_snapshot
+        )
+
+    async def async_compact(self, name: QueueName) -> None:
+        async with self._room_lock(name):
+            await asyncio.to_thread(self.compact, name)
+
+    def _archive_before(self, queue: Queue) -> datetime.datetime | None:
+        if self.archive_after is None:
+            return None
+        return queue.now - max(
+            self.archive_after,
+            datetime.timedelta(hours=RANK_PERFORMER_HOURS),
+            queue.settings.validation_duplicate_performer_timedelta or datetime.timedelta(),
+            queue.settings.validation_duplicate_track_timedelta or datetime.timedelta(),
+        )
+
+    @property
+    def rooms_to_archive(self) -> t.Sequence[QueueName]:
+        if self.archive_after is None:
+            return ()
+
+        def _archivable(queue: Queue) -> bool:
+            before = self._archive_before(queue)
+            end = queue.items[0].end if queue.items else None
+            return bool(before and end is not None and end < before.timestamp())
+
+        # Snapshot the dict first, as in `rooms_to_compact`
+        return tuple(name for name, queue in tuple(self.queues.items()) if _archivable(queue))
+
+    def archive(self, name: QueueName) -> int:
+        """
+        Move finished items out of the active queue to `<room>.archive`
+        """
+        if self.archive_after is None or (name not in self.queues and not self._exists(name)):
+            return 0
+        queue = self.get(name)
+        queue.settings = self.settings.get(name)
+        before = self._archive_before(queue)
+        items = queue.remove_finished(before) if before else []
+        if not items:
+            return 0
+        log.info(f"[queue_manager] archive {name} ({len(items)} items)")
+        try:
+            with (
+                self.metrics.storage_seconds.time(room=name, op="archive"),
+                self.path_archive(name).open("ab") as filehandle,
+            ):
+                filehandle.write("".join(json.dumps(i.to_row()) + "\n" for i in items).encode("utf8"))
+                filehandle.flush()
+                os.fsync(filehandle.fileno())
+            seq = self.seqs.get(name, 0) + 1
+            self._save(name, queue, seq)
+            self.seqs[name] = seq
+            self.payloads.pop(name, None)
+        except Exception:
+            self._modify_discard(name)
+            raise
+        self._write_static(name)
+        return len(items)
+
+    async def async_archive(self, name: QueueName) -> int:
+        async with self._room_lock(name):
+            return await asyncio.to_thread(self.archive, name)
+
+    def _read_archive(self, name: QueueName, exclude: t.Container[int]) -> list[dict[str, t.Any]]:
+        try:
+            with self.path_archive(name).open("rb") as filehandle:
+                # A torn last line (crash mid-append) was never removed from the queue - skip it
+                rows = [json.loads(line) for line in filehandle if line.endswith(b"\n")]
+        except FileNotFoundError:
+            return []
+        return list({row["id"]: row for row in rows if row["id"] not in exclude}.values())
+
+    # Queue --------------------------------------------------------------------
+
+    def get(self, name: QueueName) -> Queue:
+        self._discard_if_stale(name)
+        if name not in self.queues:
+            self.queues[name] = self._load(name)
+        return self.queues[name]
+
+    @staticmethod
+    def _item_json(row: dict[str, t.Any]) -> dict[str, t.Any]:
+        """
+        A `QueueItem.model_dump(mode="json")` row, without the fields clients should not see
+        """
+        item = {k: v for k, v in row.items() if k not in ("added_time", "debug_str")}
+        item["session_id"] = item["session_id"].split("-")[0]
+        return item
+
+    def for_json(self, name: QueueName) -> list[dict[str, t.Any]]:
+        """
+        The items clients need - only the last `history` played items (if set), and everything current and future
+        """
+        # Don't hold an empty queue in memory for every room name that is polled
+        if name not in self.queues and not self._exists(name):
+            return []
+        queue = self.get(name)
+        items = queue.items if self.history is None else queue.recent(self.history)
+        return [self._item_json(i.to_row()) for i in items]
+
+    def history_json(self, name: QueueName, offset: int = 0, limit: int = 100) -> tuple[int, list[dict[str, t.Any]]]:
+        """
+        A page of every item in the room (archived, played or not) and the total number of items
+        """
+        self._discard_if_stale(name)
+        if name not in self.queues and not self._exists(name):
+            return 0, []
+        items = self.get(name).items
+        archived = self._read_archive(name, exclude={i.id for i in items})
+        start, stop = max(0, offset - len(archived)), max(0, offset + limit - len(archived))
+        page = archived[offset : offset + limit] + [i.to_row() for i in items[start:stop]]
+        return len(archived) + len(items), [self._item_json(row) for row in page]
+
+    def payload(self, name: QueueName) -> QueuePayload:
+        """
+        `for_json` serialized once per change
+        """
+        self._discard_if_stale(name)
+        if name not in self.payloads:
+            if name not in self.queues and not self._exists(name):
+                return EMPTY_QUEUE_PAYLOAD
+            self.get(name)  # loading from disk is timed as storage, not serialization
+            with self.metrics.serialize_seconds.time(room=name):
+                self.payloads[name] = QueuePayload.from_json(self.for_json(name), self.seqs.get(name, 0))
+        return self.payloads[name]
+
+    async def async_payload(self, name: QueueName) -> QueuePayload:
+        """
+        `payload`, loading the room from disk in a thread if needed
+        """
+        if not self.file_lock and name in self.payloads:
+            return self.payloads[name]
+        # The room lock stops this room being modified while the thread uses it
+        async with self.queue_async_locks[name]:
+            return await asyncio.to_thread(self.payload, name)
+
+    async def async_history_json(
+        self, name: QueueName, offset: int = 0, limit: int = 100
+    ) -> tuple[int, list[dict[str, t.Any]]]:
         async with self.queue_async_locks[name]:
-            with self.queue_modify_context(name) as queue:
-                yield queue
+            return await asyncio.to_thread(self.history_json, name, offset, limit)
+
+    def _modify_begin(self, name: QueueName) -> Queue:
+        queue = self.get(name)
+        queue.settings = self.settings.get(name)
+        queue.modified = False
+        queue.changes.clear()
+        return queue
+
+    def _modify_discard(self, name: QueueName) -> None:
+        # The queue may have been partially modified in memory - discard it and reload from disk next time
+        self.queues.pop(name, None)
+        self.payloads.pop(name, None)
+
+    def _modify_commit(self, name: QueueName, queue: Queue) -> None:
+        if queue.modified:
+            seq = self.seqs.get(name, 0) + 1
+            try:
+                if self.journal and queue.changes and name not in self._needs_snapshot:
+                    self._append_journal(name, queue.changes, seq)
+                else:
+                    self._save(name, queue, seq)
+            except BaseException:
+                # The in-memory queue holds a change that is not on disk - reload it from disk next time
+                self._modify_discard(name)
+                raise
+            self.seqs[name] = seq
+            self.payloads.pop(name, None)
+            self._write_static(name)
+        queue.changes.clear()
+
+    def _write_static(self, name: QueueName) -> None:
+        if not (path := self.path_static(name)):
+            return
+        # The change is already saved - a failure here only leaves the static copy behind
+        try:
+            data = self.payload(name).data
+            with self.metrics.storage_seconds.time(room=name, op="static"):
+                write_precompressed(path, data)
+        except Exception:
+            log.exception(f"[queue_manager] failed to write {path}")
+
+    @contextlib.contextmanager
+    def queue_modify_context(self, name: QueueName):
+        with self._room_file_lock(name):
+            self._locked.add(name)
+            try:
+                queue = self._modify_begin(name)
+                try:
+                    with queue.frozen_now():
+                        yield queue
+                except BaseException:
+                    self._modify_discard(name)
+                    raise
+                self._modify_commit(name, queue)
+            finally:
+                self._locked.discard(name)
+
+    @contextlib.asynccontextmanager
+    async def async_queue_modify_context(self, name: QueueName, payloads: list[QueuePayload] | None = None):
+        """
+        As `queue_modify_context`, with the room's disk reads/writes run in a thread,
+        so a slow disk doesn't stall other requests.
+        If given, `payloads` gets the room's payload from before and after the change - both taken under the
+        room lock, so they are consecutive even when other requests/workers modify the room at the same time.
+        """
+        async with self._room_lock(name):
+            if payloads is not None:
+                payloads.append(await asyncio.to_thread(self.payload, name))
+            queue = await asyncio.to_thread(self._modify_begin, name)
+            try:
+                with queue.frozen_now():
+                    yield queue
+            except BaseException:
+                self._modify_discard(name)
+                raise
+            await asyncio.to_thread(self._modify_commit, name, queue)
+            if payloads is not None:
+                payloads.append(await asyncio.to_thread(self.payload, name))
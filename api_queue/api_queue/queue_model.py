@@ -1,12 +1,15 @@
 import datetime
 import collections.abc as ct
+import contextlib
 import random
-from functools import reduce
-from itertools import pairwise
+import typing as t
+from functools import reduce, wraps
 import pydantic
 
 from .settings_manager import QueueSettings, TimeDelta
 
+_UTC = datetime.timezone.utc
+
 
 class QueueItem(pydantic.BaseModel):
     """
@@ -81,6 +84,30 @@ class QueueItem(pydantic.BaseModel):
     video_variant: str
     subtitle_variant: str
 
+    def to_row(self) -> dict[str, t.Any]:
+        """
+        `model_dump(mode="json")`, without pydantic's serializers - for rows that are persisted
+
+        >>> queue_item = QueueItem(track_id='Track1', track_duration=60.25, session_id='Session1', performer_name='test_name', start_time=123456789.5, video_variant='Default', subtitle_variant='Default')
+        >>> queue_item.to_row() == queue_item.model_dump(mode="json")
+        True
+        >>> tuple(queue_item.to_row()) == tuple(QueueItem.model_fields)
+        True
+        """
+        start_time = self.start_time
+        return {
+            "track_id": self.track_id,
+            "track_duration": self.track_duration.total_seconds(),
+            "session_id": self.session_id,
+            "performer_name": self.performer_name,
+            "start_time": start_time.timestamp() if start_time else None,
+            "id": self.id,
+            "added_time": self.added_time.timestamp(),
+            "debug_str": self.debug_str,
+            "video_variant": self.video_variant,
+            "subtitle_variant": self.subtitle_variant,
+        }
+
     @property
     def end_time(self) -> datetime.datetime | None:
         if self.start_time:
@@ -92,12 +119,237 @@ class QueueItem(pydantic.BaseModel):
         return self._now() - self.added_time
 
 
+class QueueEntry:
+    """
+    The in-memory form of a `QueueItem`, as held in `Queue.items`.
+
+    Times are epoch seconds and durations are seconds (floats), so the scheduling and ranking loops are
+    float arithmetic rather than datetime/timedelta objects, and `__slots__` keeps each entry small.
+    Convert only at the edges - `from_item`/`to_item` for the api, `from_row`/`to_row` for persistence.
+    The datetime properties (`start_time`, `end_time`, ...) are for those edges, not for loops over the queue.
+
+    >>> queue_item = QueueItem(track_id='Track1', track_duration=60.25, session_id='Session1', performer_name='test_name', start_time=123456789.5, id=1, added_time=111111111.25, video_variant='Default', subtitle_variant='Default')
+    >>> entry = QueueEntry.from_item(queue_item)
+    >>> (entry.start, entry.duration, entry.end)
+    (123456789.5, 60.25, 123456849.75)
+    >>> entry.to_item() == queue_item
+    True
+    >>> entry.to_row() == queue_item.model_dump(mode="json")
+    True
+    >>> QueueEntry.from_row({k: "" if v is None else str(v) for k, v in entry.to_row().items()}).to_row() == entry.to_row()
+    True
+    """
+
+    __slots__ = (
+        "track_id",
+        "duration",
+        "session_id",
+        "performer_name",
+        "start",
+        "id",
+        "added",
+        "debug_str",
+        "video_variant",
+        "subtitle_variant",
+    )
+
+    def __init__(
+        self,
+        track_id: str,
+        duration: float,
+        session_id: str,
+        performer_name: str,
+        start: float | None,
+        id: int,
+        added: float,
+        debug_str: str | None,
+        video_variant: str,
+        subtitle_variant: str,
+    ) -> None:
+        self.track_id = track_id
+        self.duration = duration
+        self.session_id = session_id
+        self.performer_name = performer_name
+        self.start = start
+        self.id = id
+        self.added = added
+        self.debug_str = debug_str
+        self.video_variant = video_variant
+        self.subtitle_variant = subtitle_variant
+
+    def __repr__(self) -> str:
+        return f"QueueEntry(id={self.id!r}, track_id={self.track_id!r}, performer_name={self.performer_name!r}, start={self.start!r})"
+
+    @classmethod
+    def from_item(cls, item: QueueItem) -> t.Self:
+        start_time = item.start_time
+        return cls(
+            item.track_id,
+            item.track_duration.total_seconds(),
+            item.session_id,
+            item.performer_name,
+            start_time.timestamp() if start_time else None,
+            item.id,
+            item.added_time.timestamp(),
+            item.debug_str,
+            item.video_variant,
+            item.subtitle_variant,
+        )
+
+    def to_item(self) -> QueueItem:
+        # The values came from a validated `QueueItem` or a persisted row - no need to validate them again
+        return QueueItem.model_construct(
+            track_id=self.track_id,
+            track_duration=datetime.timedelta(seconds=self.duration),
+            session_id=self.session_id,
+            performer_name=self.performer_name,
+            start_time=self.start_time,
+            id=self.id,
+            added_time=self.added_time,
+            debug_str=self.debug_str,
+            video_variant=self.video_variant,
+            subtitle_variant=self.subtitle_variant,
+        )
+
+    @classmethod
+    def from_row(cls, row: ct.Mapping[str, t.Any]) -> t.Self:
+        """
+        Decode a row that this server persisted (`to_row`, as csv strings or json) without full validation.
+        Timestamps and durations are plain numbers, so they skip the general purpose parsers.
+        Anything else (e.g. a hand edited csv) falls back to `QueueItem.model_validate`.
+
+        >>> row = {'track_id': 'Track1', 'track_duration': '60.25', 'session_id': 'Session1', 'performer_name': 'test_name', 'start_time': '', 'id': '123456789', 'added_time': '111111111.111111', 'debug_str': '', 'video_variant': 'Default', 'subtitle_variant': 'Default'}
+        >>> QueueEntry.from_row(row).to_item() == QueueItem.model_validate(row)
+        True
+        >>> QueueEntry.from_row(row | {'start_time': '123456789.5'}).start
+        123456789.5
+        >>> QueueEntry.from_row(row | {'start_time': '1973-11-29 21:33:09.123457+00:00'}).start
+        123456789.123457
+        """
+        try:
+            start_time = row["start_time"]
+            return cls(
+                row["track_id"],
+                float(row["track_duration"]),
+                row["session_id"],
+                row["performer_name"],
+                float(start_time) if start_time else None,
+                int(row["id"]),
+                float(row["added_time"]),
+                row["debug_str"] or None,
+                row["video_variant"],
+                row["subtitle_variant"],
+            )
+        except (KeyError, TypeError, ValueError):
+            return cls.from_item(QueueItem.model_validate(row))
+
+    def to_row(self) -> dict[str, t.Any]:
+        """
+        The same as `QueueItem.to_row` (`model_dump(mode="json")`)
+        """
+        return {
+            "track_id": self.track_id,
+            "track_duration": self.duration,
+            "session_id": self.session_id,
+            "performer_name": self.performer_name,
+            "start_time": self.start,
+            "id": self.id,
+            "added_time": self.added,
+            "debug_str": self.debug_str,
+            "video_variant": self.video_variant,
+            "subtitle_variant": self.subtitle_variant,
+        }
+
+    @property
+    def end(self) -> float | None:
+        start = self.start
+        return start + self.duration if start is not None else None
+
+    @property
+    def start_time(self) -> datetime.datetime | None:
+        start = self.start
+        return datetime.datetime.fromtimestamp(start, tz=_UTC) if start is not None else None
+
+    @start_time.setter
+    def start_time(self, start_time: datetime.datetime | None) -> None:
+        self.start = start_time.timestamp() if start_time else None
+
+    @property
+    def end_time(self) -> datetime.datetime | None:
+        end = self.end
+        return datetime.datetime.fromtimestamp(end, tz=_UTC) if end is not None else None
+
+    @property
+    def track_duration(self) -> datetime.timedelta:
+        return datetime.timedelta(seconds=self.duration)
+
+    @property
+    def added_time(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.added, tz=_UTC)
+
+
+type QueueChange = dict[str, t.Any]
+
+
+def _change[**P, R](method: ct.Callable[t.Concatenate["Queue", P], R]) -> ct.Callable[t.Concatenate["Queue", P], R]:
+    """
+    Record a mutating `Queue` method call in `Queue.changes` so that it can be journaled and replayed.
+    `now` is frozen for the duration of the outermost call, so replaying the change is deterministic.
+    """
+
+    @wraps(method)
+    def wrapper(self: "Queue", *args: P.args, **kwargs: P.kwargs) -> R:
+        if self._changing:  # nested call (e.g. `skip` -> `delete` -> `stop`) is part of the outer change
+            return method(self, *args, **kwargs)
+        self._changing = True
+        try:
+            with self.frozen_now():
+                now = self.now
+                result = method(self, *args, **kwargs)
+        finally:
+            self._changing = False
+        self.changes.append(
+            {
+                "op": method.__name__,
+                "args": [a.to_row() if isinstance(a, (QueueItem, QueueEntry)) else a for a in args],
+                "kwargs": kwargs,
+                "now": now.timestamp(),
+                "track_space": self.track_space.total_seconds(),
+            }
+        )
+        self.modified = True
+        return result
+
+    return wrapper
+
+
 class Queue:
-    def __init__(self, items: list[QueueItem], settings: QueueSettings):
+    """
+    `items` are held in play order: finished items, then the current (playing or next) item, then future items.
+    Mutate `items` through the `Queue` methods, so the id index and current cursor stay valid.
+    Items are `QueueEntry` records - `add` accepts a `QueueItem` from the api and converts it.
+
+    * `_index` maps `QueueEntry.id` -> index in `items` (rebuilt lazily after items are removed or rearranged)
+    * `_cursor` is the index of the first item that has not finished. Items before it never change,
+      and time only moves forwards, so it is only ever advanced (unless `now` goes backwards)
+    * `_by_performer` / `_by_track` map `performer_name` / `track_id` -> the items with that value, in play
+      order - so also in `start` order, with unscheduled items last (built lazily, kept up to date by `add` and
+      `delete`, rebuilt after `move`/`reorder`) - for validation that bisects to a time window
+    """
+
+    def __init__(self, items: list[QueueEntry], settings: QueueSettings):
         self.items = items
         self.settings = settings
         self.modified = False
+        self.changes: list[QueueChange] = []
         self._now: datetime.datetime | None = None
+        self._frozen_now: datetime.datetime | None = None
+        self._changing = False
+        self._index: dict[int, int] | None = None
+        self._cursor = 0
+        self._cursor_now: float | None = None
+        self._by_performer: dict[str, list[QueueEntry]] | None = None
+        self._by_track: dict[str, list[QueueEntry]] | None = None
 
     @property
     def track_space(self) -> datetime.timedelta:
@@ -105,24 +357,75 @@ class Queue:
 
     @property
     def now(self) -> datetime.datetime:
-        return self._now or datetime.datetime.now(tz=datetime.timezone.utc)
+        return self._now or self._frozen_now or datetime.datetime.now(tz=datetime.timezone.utc)
+
+    @property
+    def now_timestamp(self) -> float:
+        """
+        `now` as epoch seconds - to compare with `QueueEntry` times
+        """
+        return self.now.timestamp()
+
+    @contextlib.contextmanager
+    def frozen_now(self, now: datetime.datetime | None = None) -> ct.Generator[None]:
+        """
+        Use a single value of `now` for every property access within an operation
+        """
+        if self._frozen_now:
+            yield
+            return
+        self._frozen_now = now or self.now
+        try:
+            yield
+        finally:
+            self._frozen_now = None
+
+    def _current_index(self) -> int:
+        now = self.now_timestamp
+        if self._cursor_now is None or now < self._cursor_now or self._cursor > len(self.items):
+            self._cursor = 0
+        self._cursor_now = now
+        items = self.items
+        index = self._cursor
+        while index < len(items):
+            start = items[index].start
+            if start is None or start >= now or start + items[index].duration > now:
+                break
+            index += 1
+        self._cursor = index
+        return index
+
+    def _group_indexes(self) -> tuple[dict[str, list[QueueEntry]], dict[str, list[QueueEntry]]]:
+        if self._by_performer is None or self._by_track is None:
+            self._by_performer, self._by_track = {}, {}
+            for queue_item in self.items:
+                self._by_performer.setdefault(queue_item.performer_name, []).append(queue_item)
+                self._by_track.setdefault(queue_item.track_id, []).append(queue_item)
+        return self._by_performer, self._by_track
+
+    def items_by_performer(self, performer_name: str) -> ct.Sequence[QueueEntry]:
+        return self._group_indexes()[0].get(performer_name, ())
+
+    def items_by_track(self, track_id: str) -> ct.Sequence[QueueEntry]:
+        return self._group_indexes()[1].get(track_id, ())
 
     @property
-    def past(self) -> ct.Iterable[QueueItem]:
-        now = self.now
-        return (i for i in self.items if i.end_time and i.end_time < now)
+    def past(self) -> ct.Iterable[QueueEntry]:
+        now = self.now_timestamp
+        return (i for i in self.items if (end := i.end) is not None and end < now)
 
     @property
-    def future(self) -> ct.Iterable[QueueItem]:
-        now = self.now
-        return (i for i in self.items if not i.start_time or i.start_time >= now)
+    def future(self) -> ct.Iterable[QueueEntry]:
+        now = self.now_timestamp
+        return (i for i in self.items[self._current_index() :] if i.start is None or i.start >= now)
 
     @property
-    def current(self) -> QueueItem | None:
-        return self.playing or next(iter(self.future), None)
+    def current(self) -> QueueEntry | None:
+        index = self._current_index()
+        return self.items[index] if index < len(self.items) else None
 
     @property
-    def current_future(self) -> ct.Iterable[QueueItem]:
+    def current_future(self) -> ct.Iterable[QueueEntry]:
         # fugly mess - you can do this in less lines
         current = self.current
         future = list(self.future)
@@ -130,128 +433,236 @@ class Queue:
             future.insert(0, current)
         return future
 
+    def recent(self, history: int) -> ct.Sequence[QueueEntry]:
+        """
+        The last `history` played items, and everything current and future
+        """
+        return self.items[max(0, self._current_index() - history) :]
+
+    def remove_finished(self, before: datetime.datetime) -> list[QueueEntry]:
+        """
+        Remove (and return) the items that finished before `before` - e.g. to archive them.
+        This is not a recorded change - the caller must persist the queue without them.
+        """
+        items = self.items
+        before_timestamp = before.timestamp()
+        index = 0
+        while index < len(items) and (end := items[index].end) is not None and end < before_timestamp:
+            index += 1
+        removed = items[:index]
+        if removed:
+            del items[:index]
+            self._index = None
+            self._cursor = max(0, self._cursor - index)
+            self._by_performer = self._by_track = None
+        return removed
+
     @property
-    def last(self) -> QueueItem | None:
+    def last(self) -> QueueEntry | None:
         return self.items[-1] if self.items else None
 
     @property
-    def playing(self) -> QueueItem | None:
-        now = self.now
-        return next(
-            (i for i in self.items if i.start_time and i.start_time <= now and i.end_time and i.end_time > now),
-            None,
-        )
+    def playing(self) -> QueueEntry | None:
+        # Only the current item can be playing - everything after it starts later
+        now = self.now_timestamp
+        i = self.current
+        if i and i.start is not None and i.start <= now and i.start + i.duration > now:
+            return i
+        return None
 
     @property
     def is_playing(self) -> bool:
-        return bool(self.current and self.current.start_time)
+        return bool(self.current and self.current.start is not None)
 
     @property
     def end_time(self) -> datetime.datetime:
-        if self.last and self.last.end_time:
-            return self.last.end_time
+        if self.last and (end := self.last.end) is not None:
+            return datetime.datetime.fromtimestamp(end, tz=_UTC)
 
-        def track_duration_reducer(end_time: datetime.datetime, i: QueueItem) -> datetime.datetime:
-            end_time += i.track_duration + self.track_space
-            return end_time
+        track_space = self.track_space.total_seconds()
 
-        return reduce(track_duration_reducer, self.future, self.now)
+        def track_duration_reducer(end: float, i: QueueEntry) -> float:
+            end += i.duration + track_space
+            return end
 
+        return datetime.datetime.fromtimestamp(reduce(track_duration_reducer, self.future, self.now_timestamp), tz=_UTC)
+
+    @_change
     def play(self, continuous: bool = True, immediate: bool = False) -> None:
-        if self.current:
+        if current := self.current:
             if immediate:
-                self.current.start_time = self.now
+                current.start = self.now_timestamp
             else:
                 # Set the current track to start playing slightly in
                 # the future, to give all the clients a chance to get
                 # the message
-                self.current.start_time = self.now + datetime.timedelta(seconds=1)
+                current.start = self.now_timestamp + 1
         if continuous:
             self._recalculate_start_times()
 
+    @_change
     def stop(self) -> None:
         if current := self.current:
-            current.start_time = None
+            current.start = None
             self._recalculate_start_times()
 
-    def add(self, queue_item: QueueItem) -> None:
-        self.items.append(queue_item)
-        self._recalculate_start_times()
-
+    @_change
+    def add(self, queue_item: QueueItem | QueueEntry) -> QueueEntry:
+        entry = queue_item if isinstance(queue_item, QueueEntry) else QueueEntry.from_item(queue_item)
+        self.items.append(entry)
+        if self._index is not None:
+            self._index[entry.id] = len(self.items) - 1
+        if self._by_performer is not None and self._by_track is not None:
+            self._by_performer.setdefault(entry.performer_name, []).append(entry)
+            self._by_track.setdefault(entry.track_id, []).append(entry)
+        self._recalculate_start_times(from_index=len(self.items) - 1)
+        return entry
+
+    @_change
     def move(self, id1: int, id2: int) -> None:
-        assert {id1, id2} < {i.id for i in self.current_future} | {
-            -1,
-        }, "move track_ids are not in future track list"
+        # id's are positive. `-1` is a special sentinel value for end of list
+        current_index = self._current_index()
         index1, queue_item = self.get(id1)
-        assert index1 is not None
+        index2, _ = self.get(id2) if id2 != -1 else (len(self.items), None)
+        assert (
+            index1 is not None and index1 >= current_index and index2 is not None and index2 >= current_index
+        ), "move track_ids are not in future track list"
         assert queue_item is not None
+        playing = self.playing
         del self.items[index1]
-        # id's are positive. `-1` is a special sentinel value for end of list
+        self._index = None
         index2, _ = self.get(id2) if id2 != -1 else (len(self.items), None)
         assert index2 is not None
-        queue_item.start_time = None
+        if playing is not None and playing is not queue_item:
+            # The playing item stays where it is - moving onto it queues the item to play next
+            index2 = max(index2, current_index + 1)
+        queue_item.start = None
         self.items.insert(index2, queue_item)
-        self._recalculate_start_times()
-
-    def get(self, id: int) -> tuple[int, QueueItem] | tuple[None, None]:
-        return next(
-            ((index, queue_item) for index, queue_item in enumerate(self.items) if queue_item.id == id),
-            (None, None),
-        )
-
+        self._index = None
+        self._by_performer = self._by_track = None
+        self._recalculate_start_times(from_index=min(index1, index2))
+
+    def get(self, id: int) -> tuple[int, QueueEntry] | tuple[None, None]:
+        if self._index is None:
+            self._index = {queue_item.id: index for index, queue_item in enumerate(self.items)}
+        index = self._index.get(id)
+        if index is None:
+            return (None, None)
+        return (index, self.items[index])
+
+    @_change
     def delete(self, id: int) -> None:
         if current := self.current:
             # If deleting current item and current item is queued for future playback
-            if current.id == id and current.start_time:
+            if current.id == id and current.start is not None:
                 self.stop()
-        now = self.now
-        self.items[:] = [i for i in self.items if (i.start_time and i.start_time < now) or i.id != id]
-        self._recalculate_start_times()
-
+        index, queue_item = self.get(id)
+        # Items that have started in the past can't be deleted
+        if (
+            index is not None
+            and queue_item
+            and not (queue_item.start is not None and queue_item.start < self.now_timestamp)
+        ):
+            del self.items[index]
+            self._index = None
+            if self._by_performer is not None and self._by_track is not None:
+                for group in (self._by_performer[queue_item.performer_name], self._by_track[queue_item.track_id]):
+                    group[:] = [i for i in group if i is not queue_item]
+            self._recalculate_start_times(from_index=index)
+
+    @_change
     def seek_forwards(self, seconds: float = 20) -> None:
-        if not self.current or not self.current.start_time or not self.current.end_time:
+        current = self.current
+        if not current or current.start is None:
             return
-        delta = datetime.timedelta(seconds=seconds)
+        now = self.now_timestamp
         # if we're in a gap, seek stops at the end of the gap
-        if self.current.start_time > self.now:
-            if self.now + delta > self.current.start_time:
-                self.current.start_time = self.now
+        if current.start > now:
+            if now + seconds > current.start:
+                current.start = now
             else:
-                self.current.start_time -= delta
+                current.start -= seconds
         # if we're in a track, seek stops at the end of the track
         else:
-            if self.now + delta > self.current.end_time:
-                self.current.start_time = self.now - self.current.track_duration
+            if now + seconds > current.start + current.duration:
+                current.start = now - current.duration
                 # also adjust the new "current"
-                if self.current:
-                    self.current.start_time = self.now + self.track_space
+                if (following := self.current) and following is not current:
+                    following.start = now + self.track_space.total_seconds()
             else:
-                self.current.start_time -= delta
+                current.start -= seconds
         self._recalculate_start_times()
 
+    @_change
     def seek_backwards(self, seconds: float = 20) -> None:
-        if not self.current or not self.current.start_time or not self.current.end_time:
+        current = self.current
+        if not current or current.start is None:
             return
-        delta = datetime.timedelta(seconds=seconds)
+        now = self.now_timestamp
+        track_space = self.track_space.total_seconds()
         # if we're in a gap, seek stops at the start of the gap
-        if self.current.start_time > self.now:
-            if self.now - delta < self.current.start_time - self.track_space:
-                self.current.start_time = self.now + self.track_space
+        if current.start > now:
+            if now - seconds < current.start - track_space:
+                current.start = now + track_space
             else:
-                self.current.start_time += delta
+                current.start += seconds
         # if we're in a track, seek stops at the start of the track
         else:
-            if self.now - delta < self.current.start_time:
-                self.current.start_time = self.now
+            if now - seconds < current.start:
+                current.start = now
             else:
-                self.current.start_time += delta
+                current.start += seconds
         self._recalculate_start_times()
 
+    @_change
     def skip(self) -> None:
         if self.current:
             self.delete(self.current.id)
 
-    def _recalculate_start_times(self) -> None:
-        for i_prev, i_next in pairwise(self.current_future):
-            i_next.start_time = i_prev.end_time + self.track_space if i_prev and i_prev.end_time else None
+    @_change
+    def reorder(self, ids: ct.Sequence[int]) -> None:
+        """
+        Rearrange the items with `ids` into the given order, within the positions they already occupy
+        """
+        indexes = sorted(index for index, _ in map(self.get, ids) if index is not None)
+        assert len(set(indexes)) == len(ids), "reorder ids must be unique and in the queue"
+        by_id = {self.items[index].id: self.items[index] for index in indexes}
+        for index, id in zip(indexes, ids):
+            self.items[index] = by_id[id]
+        self._index = None
+        self._by_performer = self._by_track = None
+        if indexes:
+            self._recalculate_start_times(from_index=indexes[0])
+
+    def apply_change(self, change: QueueChange) -> None:
+        """
+        Replay a change previously recorded in `Queue.changes`
+        """
+        args = list(change["args"])
+        if change["op"] == "add":
+            args[0] = QueueEntry.from_row(args[0])
+        settings = self.settings
+        self.settings = settings.model_copy(update={"track_space": datetime.timedelta(seconds=change["track_space"])})
+        self._changing = True  # don't record the replayed change again
+        try:
+            with self.frozen_now(datetime.datetime.fromtimestamp(change["now"], tz=datetime.timezone.utc)):
+                getattr(self, change["op"])(*args, **change["kwargs"])
+        finally:
+            self._changing = False
+            self.settings = settings
+
+    def _recalculate_start_times(self, from_index: int = 0) -> None:
+        """
+        Chain the start of each current/future item from the end of the item before it.
+
+        Changes only affect the schedule from the changed position onwards, so callers pass the index of
+        the first changed item, and only the items from there are recalculated.
+        `from_index=0` recalculates everything from the current item.
+        """
+        items = self.items
+        track_space = self.track_space.total_seconds()
+        for index in range(max(self._current_index(), from_index - 1), len(items) - 1):
+            i_prev = items[index]
+            start = i_prev.start
+            items[index + 1].start = start + i_prev.duration + track_space if start is not None else None
         self.modified = True
@@ -1,8 +1,11 @@
 import collections.abc as ct
+import math
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
 from functools import partial
-import datetime
+from itertools import accumulate
 
-from .queue_model import Queue, QueueItem
+from .queue_model import Queue, QueueEntry
 
 
 class QueueValidationError(Exception):
@@ -36,38 +39,59 @@ def validate_queue(queue: Queue):
     if not queue_last:
         return  # No tracks to validate - no need to proceed with further validation
 
-    if _performer_timedelta := None:  # queue.settings.validation_duplicate_performer_timedelta
-        raise NotImplementedError("TODO: finish this feature")
-        epoch = queue.now - _performer_timedelta
+    if _performer_timedelta := queue.settings.validation_duplicate_performer_timedelta:
+        _epoch = (queue.now - _performer_timedelta).timestamp()
+        if _recent(queue.items_by_performer(queue_last.performer_name), queue_last, _epoch):
+            raise QueueValidationError(f"Duplicated performer {queue_last.performer_name} within {_performer_timedelta}")
 
-        def _filter(queue_item: QueueItem) -> bool:
-            assert queue_item is not None
-            return (
-                queue_item.performer_name == queue_last.performer_name
-                and queue_item.start_time > epoch
-                and queue_item != queue_last
-            )
+    if _track_timedelta := queue.settings.validation_duplicate_track_timedelta:
+        _epoch = (queue.now - _track_timedelta).timestamp()
+        if _recent(queue.items_by_track(queue_last.track_id), queue_last, _epoch):
+            raise QueueValidationError(f"Duplicated track {queue_last.track_id} within {_track_timedelta}")
 
-        if tuple(filter(_filter, queue.items)):
-            return f"Duplicated performer {queue_last.performer_name} within {_performer_timedelta}"
 
-    if _track_timedelta := None:  # queue.settings.validation_duplicate_track_timedelta:
-        raise NotImplementedError("TODO: finish this feature")
-        epoch = queue.now - _track_timedelta
+def _start_key(i: QueueEntry) -> float:
+    return math.inf if i.start is None else i.start
 
-        def _filter(queue_item: QueueItem) -> bool:
-            assert queue_item is not None
-            return (
-                queue_item.track_id == queue_last.track_id
-                and queue_item.start_time > epoch
-                and queue_item != queue_last
-            )
 
-        if tuple(filter(_filter, queue.items)):
-            return f"Duplicated track {queue_last.performer_name} within {_track_timedelta}"
+def _recent(queue_items: ct.Sequence[QueueEntry], queue_item: QueueEntry, epoch: float) -> bool:
+    """
+    Is there another item (other than `queue_item`) that started after `epoch`, or has not started yet.
+    `queue_items` are in `start` order (unscheduled last, see `Queue.items_by_performer`), so this bisects to
+    the window edge and looks at no more than two items.
+
+    >>> item = lambda start: QueueEntry("Track1", 60, "Session1", "test_name", start, 1, 0, None, "Default", "Default")
+    >>> sung, queued = item(100.0), item(None)
+    >>> _recent([sung, queued], queued, epoch=50.0), _recent([sung, queued], queued, epoch=150.0)
+    (True, False)
+    """
+    index = bisect_right(queue_items, epoch, key=_start_key)
+    return any(i is not queue_item for i in queue_items[index : index + 2])
+
+
+# Items queued by a performer within this many hours count towards their rank
+RANK_PERFORMER_HOURS = 3
+
+
+def _minutes(seconds: float) -> float:
+    return seconds / 60
 
 
-def _rank(queue: Queue, queue_item: QueueItem) -> float:
+def _sang_ago_score(now: float, i: QueueEntry) -> float:
+    if i.start is not None:
+        # the start_time could be hypothetical (e.g: it has not been sung, but is scheduled/estimated to be start_time)
+        sang_hours_ago = _minutes(now - i.start) / 60
+        # if you sang a single 4 minute song 1 hour ago
+        # added_minutes_ago will rise linearly with time while this rank decays with time
+        # for a 20min since the last sang track = ((1/0.35) * 4min * 5) = 57 is equivalent to 60min in the queue
+        return (1 / sang_hours_ago) * _minutes(i.duration) * 5
+    # need thought - it's in the queue, but has no start_time, so the queue is currently paused
+    # the queue could be reordered, so we apply a static penalty
+    # I don't even know if this is needed
+    return _minutes(i.duration) * 2
+
+
+def _rank(queue: Queue, queue_item: QueueEntry) -> float:
     """
     negative == sooner
     positive == later
@@ -75,50 +99,73 @@ def _rank(queue: Queue, queue_item: QueueItem) -> float:
     Time since queued
     Time since last song
     Duration of sung songs (decayed with time ago)
-    """
-
-    def _minutes(t: datetime.timedelta) -> float:
-        return t.total_seconds() / 60
-
-    def _minutes_ago(d: datetime.datetime) -> float:
-        return _minutes(queue.now - d)
 
-    def _hours_ago(d: datetime.datetime) -> float:
-        return _minutes_ago(d) / 60
-
-    added_minutes_ago = _minutes_ago(queue_item.added_time)
+    This is O(n) per item (it considers every item in the queue) - see `_rank_key` for the implementation used by `reorder`
+    """
+    now = queue.now_timestamp
+    added_minutes_ago = _minutes(now - queue_item.added)
 
-    queued_by_this_performer: ct.Sequence[QueueItem] = tuple(
+    queued_by_this_performer: ct.Sequence[QueueEntry] = tuple(
         filter(
             lambda i: i.performer_name == queue_item.performer_name
-            and i.added_time < queue_item.added_time
-            and _hours_ago(i.added_time) < 3,
+            and i.added < queue_item.added
+            and _minutes(now - i.added) / 60 < RANK_PERFORMER_HOURS,
             queue.items,
         )
     )
 
-    def _sang_ago_score(i: QueueItem) -> float:
-        if i.start_time:
-            # the start_time could be hypothetical (e.g: it has not been sung, but is scheduled/estimated to be start_time)
-            sang_hours_ago = _hours_ago(i.start_time)
-            # if you sang a single 4 minute song 1 hour ago
-            # added_minutes_ago will rise linearly with time while this rank decays with time
-            # for a 20min since the last sang track = ((1/0.35) * 4min * 5) = 57 is equivalent to 60min in the queue
-            return (1 / sang_hours_ago) * _minutes(i.track_duration) * 5
-        # need thought - it's in the queue, but has no start_time, so the queue is currently paused
-        # the queue could be reordered, so we apply a static penalty
-        # I don't even know if this is needed
-        return _minutes(i.track_duration) * 2
-
-    sang_ago_penalty = sum(map(_sang_ago_score, queued_by_this_performer))
+    sang_ago_penalty = sum(map(partial(_sang_ago_score, now), queued_by_this_performer))
 
     # print(f'{queue_item.track_id=}: {sang_ago_penalty=} - {added_minutes_ago=}')
     return sang_ago_penalty - added_minutes_ago
 
 
+def _rank_key(queue: Queue) -> ct.Callable[[QueueEntry], float]:
+    """
+    Equivalent to `partial(_rank, queue)`, without a pass over the whole queue for every item.
+
+    Items are grouped by performer once. Each performer's items are sorted by `added` time with a
+    prefix sum of their `_sang_ago_score`, so an item's `sang_ago_penalty` (the scores of everything
+    that performer queued before it) is a dict lookup + bisect.
+    As with `_rank`, only items queued before another are scored - a performer's newest items never are
+    (one could be starting right now, which `_sang_ago_score` can't score).
+    """
+    now = queue.now_timestamp
+    by_performer: defaultdict[str, list[QueueEntry]] = defaultdict(list)
+    for i in queue.items:
+        if _minutes(now - i.added) / 60 < RANK_PERFORMER_HOURS:
+            by_performer[i.performer_name].append(i)
+
+    penalties: dict[str, tuple[list[float], list[float]]] = {}
+    for performer_name, items in by_performer.items():
+        items.sort(key=lambda i: i.added)
+        added_times = [i.added for i in items]
+        # `bisect_left` never reaches past the first of the newest items - don't score them
+        queued_before = items[: bisect_left(added_times, added_times[-1])]
+        penalties[performer_name] = (
+            added_times,
+            list(accumulate((_sang_ago_score(now, i) for i in queued_before), initial=0.0)),
+        )
+
+    def _key(queue_item: QueueEntry) -> float:
+        sang_ago_penalty = 0.0
+        if performer_penalties := penalties.get(queue_item.performer_name):
+            added_times, prefix_sums = performer_penalties
+            sang_ago_penalty = prefix_sums[bisect_left(added_times, queue_item.added)]
+        return sang_ago_penalty - _minutes(now - queue_item.added)
+
+    return _key
+
+
 def reorder(queue: Queue):
-    if not (queue_item_current := queue.current):
-        return  # TODO: if not 'playing', no reordering? Check this
-    # Only reorder tracks out of view of users (>coming_soon_track_count) - leave the rest of the queue alone
-    reorder_from_index = queue.items.index(queue_item_current) + queue.settings.coming_soon_track_count
-    queue.items[reorder_from_index:] = sorted(queue.items[reorder_from_index:], key=partial(_rank, queue))
+    with queue.frozen_now():
+        if not (queue_item_current := queue.current):
+            return  # TODO: if not 'playing', no reordering? Check this
+        # Only reorder tracks out of view of users (>coming_soon_track_count) - leave the rest of the queue alone
+        current_index, _ = queue.get(queue_item_current.id)
+        assert current_index is not None
+        reorder_from_index = current_index + queue.settings.coming_soon_track_count
+        ids = [i.id for i in queue.items[reorder_from_index:]]
+        ids_reordered = [i.id for i in sorted(queue.items[reorder_from_index:], key=_rank_key(queue))]
+        if ids_reordered != ids:
+            queue.reorder(ids_reordered)
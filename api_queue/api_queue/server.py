@@ -1,9 +1,13 @@
+import asyncio
 import enum
+import hashlib
+import typing as t
 import contextlib
 import uuid
 from datetime import datetime, timedelta
 from pathlib import Path
 from textwrap import dedent
+from time import perf_counter
 from collections.abc import AsyncGenerator
 
 import aiomqtt
@@ -18,13 +22,18 @@ import sanic.handlers
 import sanic.response
 import sanic.exceptions
 
-from .queue_model import QueueItem
+from .queue_model import Queue, QueueItem
 from .queue_updated_actions import QueueValidationError, queue_updated_actions
 from .track_manager import TrackManager
-from .queue_manager import QueueManager
+from .leader_lock import LeaderLock
+from .queue_manager import QueueManager, QueuePayload, queue_patch
 from .settings_manager import QueueSettings, SettingsManager
 from .login_manager import LoginManager, User
-from .background_tasks import background_tracks_update_event
+from .mqtt_publisher import MqttPublisher
+from .analytics_writer import AnalyticsWriter
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics, Sample
+from .static_files import CompressedCache, PRECOMPRESSED_SUFFIXES, negotiate_encoding
+from .background_tasks import background_tracks_update_event, background_queue_compact
 from .api_types import App, Request
 
 # The test client from sanic_testing considers itself to be insecure, so
@@ -38,9 +47,22 @@ app.config.update(
         k: v
         for k, v in {
             "MQTT": None,
+            "MQTT_DEBOUNCE": 0.1,
+            "MQTT_QUEUE_SIZE": 1000,
             "PATH_TRACKS": "tracks.json",
             "PATH_QUEUE": "_data",
+            "PATH_ANALYTICS": "/logs/analytics.json",
+            "ANALYTICS_BUFFER_SIZE": 10000,
+            "ANALYTICS_BATCH_SIZE": 100,
+            "ANALYTICS_FLUSH_INTERVAL": 5.0,
+            "QUEUE_JOURNAL": True,
+            "QUEUE_JOURNAL_COMPACT_THRESHOLD": 100,
+            "QUEUE_FILE_LOCK": True,
+            "QUEUE_HISTORY": None,
+            "QUEUE_ARCHIVE_HOURS": None,
+            "STATIC_SNAPSHOTS": True,
             "BACKGROUND_TASK_TRACK_UPDATE_ENABLED": True,
+            "BACKGROUND_TASK_QUEUE_COMPACT_ENABLED": True,
         }.items()
         if k not in app.config.keys()
     }
@@ -58,6 +80,7 @@ app.config.FALLBACK_ERROR_FORMAT = "json"
 @app.listener("before_server_start")
 async def tracks_load(app: App, _loop):
     app.ctx.track_manager = TrackManager(Path(app.config.PATH_TRACKS))
+    app.ctx.tracks_updated_leader = LeaderLock(Path(app.config.PATH_QUEUE).joinpath("tracks_updated.lock"))
 
 
 @app.listener("before_server_start")
@@ -65,21 +88,76 @@ async def queue_manager(app: App, _loop):
     path_queue = Path(app.config.PATH_QUEUE)
     log.info(f"[queue_manager] - {path_queue=}")
     app.ctx.path_queue = path_queue
+    app.ctx.metrics = Metrics()
     app.ctx.login_manager = LoginManager(path=path_queue)
-    app.ctx.settings_manager = SettingsManager(path=path_queue)
-    app.ctx.queue_manager = QueueManager(path=path_queue, settings=app.ctx.settings_manager)
+    # Snapshots of each room's `queue.json`/`settings.json` for the frontend's static file server
+    path_static = path_queue.joinpath("static") if app.config.STATIC_SNAPSHOTS else None
+    app.ctx.settings_manager = SettingsManager(path=path_queue, static_path=path_static)
+    archive_hours = app.config.QUEUE_ARCHIVE_HOURS
+    app.ctx.queue_manager = QueueManager(
+        path=path_queue,
+        settings=app.ctx.settings_manager,
+        journal=app.config.QUEUE_JOURNAL,
+        journal_compact_threshold=app.config.QUEUE_JOURNAL_COMPACT_THRESHOLD,
+        file_lock=app.config.QUEUE_FILE_LOCK,
+        history=app.config.QUEUE_HISTORY,
+        archive_after=timedelta(hours=archive_hours) if archive_hours is not None else None,
+        static_path=path_static,
+        metrics=app.ctx.metrics,
+    )
+    app.ctx.compressed_cache = CompressedCache()
 
 
 @app.listener("before_server_start")
 async def aio_mqtt_configure(app: App, _loop):
     mqtt = app.config.MQTT
+    reconnect = None
     if isinstance(mqtt, str):
         log.info("[mqtt] connecting")
         app.ctx.mqtt = aiomqtt.Client(mqtt)
         await app.ctx.mqtt.__aenter__()
+
+        async def reconnect():
+            log.info("[mqtt] reconnecting")
+            with contextlib.suppress(aiomqtt.MqttError):
+                await app.ctx.mqtt.__aexit__(None, None, None)
+            await app.ctx.mqtt.__aenter__()
+
     elif mqtt:  # normally pass-through for mock mqtt object
         log.info("[mqtt] bypassed")
         app.ctx.mqtt = mqtt
+    if mqtt:
+        app.ctx.mqtt_publisher = MqttPublisher(
+            app.ctx.mqtt,
+            debounce=app.config.MQTT_DEBOUNCE,
+            maxsize=app.config.MQTT_QUEUE_SIZE,
+            reconnect=reconnect,
+            metrics=app.ctx.metrics,
+        )
+        app.ctx.mqtt_publisher.start()
+
+
+@app.listener("before_server_start")
+async def analytics_writer(app: App, _loop):
+    app.ctx.analytics_writer = AnalyticsWriter(
+        Path(app.config.PATH_ANALYTICS),
+        maxsize=app.config.ANALYTICS_BUFFER_SIZE,
+        batch_size=app.config.ANALYTICS_BATCH_SIZE,
+        flush_interval=app.config.ANALYTICS_FLUSH_INTERVAL,
+    )
+    app.ctx.analytics_writer.start()
+
+
+@app.listener("before_server_stop")
+async def analytics_flush(app: App, _loop):
+    if hasattr(app.ctx, "analytics_writer"):
+        await app.ctx.analytics_writer.close()
+
+
+@app.listener("before_server_stop")
+async def aio_mqtt_flush(app: App, _loop):
+    if hasattr(app.ctx, "mqtt_publisher"):
+        await app.ctx.mqtt_publisher.close()
 
 
 @app.listener("after_server_stop")
@@ -121,30 +199,90 @@ app.error_handler = CustomErrorHandler()
 @app.on_request
 async def attach_session_id_request(request: Request):
     request.ctx.session_id = request.cookies.get("kksid")
+    request.ctx.user = None
+    request.ctx.request_started = perf_counter()
+
+
+@app.on_response
+async def observe_request_seconds(request: Request, response):
+    if not hasattr(request.ctx, "request_started") or not hasattr(request.app.ctx, "metrics"):
+        return
+    request.app.ctx.metrics.request_seconds.observe(
+        perf_counter() - request.ctx.request_started,
+        route=request.route.name if request.route else "unmatched",
+        method=request.method,
+        status=str(response.status),
+    )
 
 
 @contextlib.asynccontextmanager
-async def push_queue_to_mqtt(app: App, room_name: str) -> AsyncGenerator[None]:
-    yield
-    if hasattr(app.ctx, "mqtt"):
-        log.info(f"push_queue_to_mqtt {room_name}")
-        await app.ctx.mqtt.publish(
-            f"room/{room_name}/queue",
-            json.dumps(app.ctx.queue_manager.for_json(room_name)),
-            retain=True,
-        )
+async def push_queue_to_mqtt(app: App, room_name: str) -> AsyncGenerator[Queue]:
+    """
+    Modify the room's queue (`QueueManager.async_queue_modify_context`), then publish
+    * `room/<name>/queue-patch`: (not retained) what changed, for clients holding the previous `seq`
+    * `room/<name>/queue`: (retained) the whole queue, for new clients and clients that missed a patch
+    """
+    payloads: list[QueuePayload] | None = [] if hasattr(app.ctx, "mqtt_publisher") else None
+    async with app.ctx.queue_manager.async_queue_modify_context(room_name, payloads=payloads) as queue:
+        yield queue
+    if not payloads:
+        return
+    log.info(f"push_queue_to_mqtt {room_name}")
+    previous, payload = payloads
+    if payload.etag != previous.etag and (patch := queue_patch(previous, payload)):
+        await app.ctx.mqtt_publisher.publish(f"room/{room_name}/queue-patch", json.dumps(patch), retain=False)
+    await app.ctx.mqtt_publisher.publish(f"room/{room_name}/queue", payload.data, digest=payload.etag)
 
 
 @contextlib.asynccontextmanager
 async def push_settings_to_mqtt(app: App, room_name: str) -> AsyncGenerator[None]:
     yield
-    if hasattr(app.ctx, "mqtt"):
+    if hasattr(app.ctx, "mqtt_publisher"):
         log.info(f"push_settings_to_mqtt {room_name}")
-        await app.ctx.mqtt.publish(
-            f"room/{room_name}/settings",
-            app.ctx.queue_manager.settings.get(room_name).model_dump_json(),
-            retain=True,
-        )
+        settings = await asyncio.to_thread(app.ctx.queue_manager.settings.get, room_name)
+        await app.ctx.mqtt_publisher.publish(f"room/{room_name}/settings", settings.model_dump_json())
+
+
+# Responses --------------------------------------------------------------------
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 256
+
+
+def encoded_etag(etag: str, encoding: str | None) -> str:
+    """
+    A strong ETag for each content-coding - the compressed bodies are different bytes
+
+    >>> encoded_etag('"abc"', "br")
+    '"abc-br"'
+    >>> encoded_etag('"abc"', None)
+    '"abc"'
+    """
+    return f"{etag[:-1]}-{encoding}\"" if encoding else etag
+
+
+def json_response(
+    request: Request, data: bytes, key: str, headers: dict[str, str] | None = None, etag: str | None = None
+):
+    """
+    A json body, compressed if the client accepts it.
+    The compressed variant is cached by `key`, which must change whenever `data` does.
+    With `etag` (of the uncompressed `data`), responds `304 Not Modified` if the client already has this body.
+    """
+    headers = {"content-type": "application/json", "vary": "accept-encoding", **(headers or {})}
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    if not encoding or len(data) < COMPRESS_MIN_SIZE:
+        encoding = None
+    if etag:
+        headers["etag"] = encoded_etag(etag, encoding)
+        if_none_match = request.headers.get("if-none-match", "")
+        if headers["etag"] in (e.strip() for e in if_none_match.split(",")) or if_none_match.strip() == "*":
+            del headers["content-type"]
+            return sanic.response.empty(status=304, headers=headers)
+    if encoding:
+        data = request.app.ctx.compressed_cache.get(key, data, encoding)
+        headers["content-encoding"] = encoding
+    return sanic.response.raw(data, headers=headers)
 
 
 # Routes -----------------------------------------------------------------------
@@ -161,36 +299,95 @@ async def time(request: Request):
     return sanic.response.json(datetime.now().timestamp())
 
 
-async def write_analytics_log(request: Request, data: dict) -> bool:
+def write_analytics_log(request: Request, data: dict) -> bool:
     try:
-        with open("/logs/analytics.json", "a", encoding="utf8") as f:
-            data["remote_addr"] = request.remote_addr
-            data["time"] = datetime.now().isoformat()
-            data["user_agent"] = request.headers.get("user-agent")
-            data["session"] = request.ctx.session_id
-            f.write(json.dumps(data) + "\n")
-            return True
+        data["remote_addr"] = request.remote_addr
+        data["time"] = datetime.now().isoformat()
+        data["user_agent"] = request.headers.get("user-agent")
+        data["session"] = request.ctx.session_id
+        request.app.ctx.analytics_writer.log(data)
+        return True
     except Exception:
         log.exception("failed to write analytics")
     return False
 
 
+def metric_samples(app: App) -> t.Iterator[Sample]:
+    """
+    The counters that components keep themselves
+    """
+    queue_manager = app.ctx.queue_manager
+    yield ("api_queue_rooms", "gauge", "Rooms held in memory", len(queue_manager.queues))
+    yield ("api_queue_lock_waits_total", "counter", "Room locks acquired", queue_manager.lock_waits)
+    yield ("api_queue_lock_wait_seconds_max", "gauge", "Longest room lock wait", queue_manager.lock_wait_seconds_max)
+    settings_manager = app.ctx.settings_manager
+    yield ("api_queue_settings_cache_hits_total", "counter", "Settings read from memory", settings_manager.hits)
+    yield ("api_queue_settings_cache_misses_total", "counter", "Settings read from disk", settings_manager.misses)
+    compressed_cache = app.ctx.compressed_cache
+    yield ("api_queue_compressed_cache_hits_total", "counter", "Compressed responses reused", compressed_cache.hits)
+    yield ("api_queue_compressed_cache_misses_total", "counter", "Responses compressed", compressed_cache.misses)
+    if hasattr(app.ctx, "analytics_writer"):
+        analytics_writer = app.ctx.analytics_writer
+        yield ("api_queue_analytics_logged_total", "counter", "Analytics events logged", analytics_writer.logged)
+        yield ("api_queue_analytics_written_total", "counter", "Analytics events written", analytics_writer.written)
+        yield ("api_queue_analytics_dropped_total", "counter", "Analytics events dropped", analytics_writer.dropped)
+        yield ("api_queue_analytics_errors_total", "counter", "Analytics write failures", analytics_writer.errors)
+        yield ("api_queue_analytics_buffer_depth", "gauge", "Analytics events waiting", analytics_writer.buffer_depth)
+    if hasattr(app.ctx, "mqtt_publisher"):
+        mqtt_publisher = app.ctx.mqtt_publisher
+        yield ("api_queue_mqtt_published_total", "counter", "Mqtt messages published", mqtt_publisher.published)
+        yield ("api_queue_mqtt_coalesced_total", "counter", "Mqtt messages replaced", mqtt_publisher.coalesced)
+        yield ("api_queue_mqtt_unchanged_total", "counter", "Mqtt messages unchanged", mqtt_publisher.unchanged)
+        yield ("api_queue_mqtt_dropped_total", "counter", "Mqtt messages dropped", mqtt_publisher.dropped)
+        yield ("api_queue_mqtt_errors_total", "counter", "Mqtt publish failures", mqtt_publisher.errors)
+        yield ("api_queue_mqtt_queue_depth", "gauge", "Mqtt messages waiting", mqtt_publisher.queue_depth)
+        yield ("api_queue_mqtt_delay_seconds_max", "gauge", "Longest publish delay", mqtt_publisher.publish_seconds_max)
+
+
+@misc_blueprint.get("/metrics")
+@openapi.definition(
+    response=openapi.definitions.Response({METRICS_CONTENT_TYPE: str}),
+    description=dedent(
+        """
+        Prometheus metrics - request latency by route, room lock waits, storage,
+        serialization and mqtt publish timings, and component counters.
+        Per-room series are only listed for rooms held in memory.
+    """
+    ),
+)
+async def metrics(request: Request):
+    rooms = tuple(request.app.ctx.queue_manager.queues)
+    text = request.app.ctx.metrics.render(rooms=rooms, samples=metric_samples(request.app))
+    return sanic.response.text(text, content_type=METRICS_CONTENT_TYPE)
+
+
 @misc_blueprint.post("/analytics.json")
 @openapi.definition(
     response=openapi.definitions.Response({"application/json": bool}),
 )
 async def analytics(request: Request):
-    logged = await write_analytics_log(request, request.json)
+    logged = write_analytics_log(request, request.json)
     return sanic.response.json(logged)
 
 
+async def request_user(request: Request, room_name: str) -> User:
+    """
+    The `User` for this request's session - looked up once per request, and shared by handlers and decorators
+    """
+    if request.ctx.user is None:
+        request.ctx.user = await asyncio.to_thread(
+            request.app.ctx.login_manager.load, room_name, request.ctx.session_id
+        )
+    return request.ctx.user
+
+
 def log_user_action(fields: list[str] | None = None):
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
             request = args[0]
             room_name = kwargs.get("room_name", "None")
-            user = request.app.ctx.login_manager.load(room_name, request.ctx.session_id)
+            user = await request_user(request, room_name)
             data = {
                 "event": func.__name__,
                 "app": "api_queue",
@@ -204,12 +401,12 @@ def log_user_action(fields: list[str] | None = None):
                         data[field] = kwargs[field]
             try:
                 result = await func(*args, **kwargs)
-                await write_analytics_log(request, data)
+                write_analytics_log(request, data)
                 return result
             except Exception as ex:
                 data["ok"] = False
                 data["err"] = str(ex)
-                await write_analytics_log(request, data)
+                write_analytics_log(request, data)
                 raise ex
         return wrapper
     return decorator
@@ -252,14 +449,17 @@ class LoginRequest(pydantic.BaseModel):
     ],
 )
 async def login(request: Request, room_name: str, body: LoginRequest):
-    if not request.app.ctx.settings_manager.room_exists(room_name):
+    if not await asyncio.to_thread(request.app.ctx.settings_manager.room_exists, room_name):
         if not body.create:
             raise sanic.exceptions.NotFound(message=f"Room '{room_name}' not found")
-        request.app.ctx.settings_manager.set(room_name, QueueSettings())
+        await asyncio.to_thread(request.app.ctx.settings_manager.set, room_name, QueueSettings())
 
     if not request.ctx.session_id:
         request.ctx.session_id = str(uuid.uuid4())
-    user = request.app.ctx.login_manager.login(room_name, request.ctx.session_id, body.password)
+    user = await asyncio.to_thread(
+        request.app.ctx.login_manager.login, room_name, request.ctx.session_id, body.password
+    )
+    request.ctx.user = user
     resp = sanic.response.json(user.model_dump(mode="json"))
     next_year = datetime.now() + timedelta(days=400)
     resp.cookies.add_cookie(
@@ -287,8 +487,18 @@ async def login(request: Request, room_name: str, body: LoginRequest):
     ),
 )
 async def tracks(request: Request, room_name: str):
-    filename: str = request.app.config.PATH_TRACKS
-    return await sanic.response.file(filename)
+    path = Path(request.app.config.PATH_TRACKS)
+    # `processmedia` exports precompressed `tracks.json.br`/`.gz` after `tracks.json` - use them unless they are older
+    if encoding := negotiate_encoding(request.headers.get("accept-encoding", "")):
+        path_compressed = path.with_name(f"{path.name}{PRECOMPRESSED_SUFFIXES[encoding]}")
+        with contextlib.suppress(FileNotFoundError):
+            if path_compressed.stat().st_mtime >= path.stat().st_mtime:
+                return await sanic.response.file(
+                    path_compressed,
+                    mime_type="application/json",
+                    headers={"content-encoding": encoding, "vary": "accept-encoding"},
+                )
+    return await sanic.response.file(path, headers={"vary": "accept-encoding"})
 
 
 # Queue / Settings ------------------------------------------------------------
@@ -306,10 +516,9 @@ async def tracks(request: Request, room_name: str):
     ),
 )
 async def get_settings(request: Request, room_name: str):
-    return sanic.response.raw(
-        request.app.ctx.settings_manager.get(room_name).model_dump_json(),
-        headers={"content-type": "application/json"},
-    )
+    settings = await asyncio.to_thread(request.app.ctx.settings_manager.get, room_name)
+    data = settings.model_dump_json().encode("utf8")
+    return json_response(request, data, key=hashlib.sha256(data).hexdigest())
 
 
 @room_blueprint.put("/settings.json")
@@ -320,11 +529,11 @@ async def get_settings(request: Request, room_name: str):
 )
 @log_user_action()
 async def update_settings(request: Request, room_name: str, body: QueueSettings):
-    user = request.app.ctx.login_manager.load(room_name, request.ctx.session_id)
+    user = await request_user(request, room_name)
     if not user.is_admin:
         raise sanic.exceptions.Forbidden(message="Only admins can update settings")
     async with push_settings_to_mqtt(request.app, room_name):
-        request.app.ctx.settings_manager.set(room_name, body)
+        await asyncio.to_thread(request.app.ctx.settings_manager.set, room_name, body)
         log.info(f"Updated settings for {room_name} with {request.json}")
         return sanic.response.json({})
 
@@ -344,10 +553,12 @@ async def update_settings(request: Request, room_name: str, body: QueueSettings)
         Not used by production clients.
         queue received by mqtt event.
         Useful for debugging to see raw datastore on disk.
+        Any journaled changes are compacted into the csv first.
     """
     ),
 )
 async def queue_csv(request: Request, room_name: str):
+    await request.app.ctx.queue_manager.async_compact(room_name)
     path_csv = request.app.ctx.queue_manager.path_csv(room_name)
     if not path_csv.is_file():
         raise sanic.exceptions.NotFound()
@@ -366,7 +577,36 @@ async def queue_csv(request: Request, room_name: str):
     ),
 )
 async def queue_json(request: Request, room_name: str):
-    return sanic.response.json(request.app.ctx.queue_manager.for_json(room_name))
+    payload = await request.app.ctx.queue_manager.async_payload(room_name)
+    headers = {"x-queue-seq": str(payload.seq)}
+    return json_response(request, payload.data, key=payload.etag, headers=headers, etag=payload.etag)
+
+
+class QueueHistoryQuery(pydantic.BaseModel):
+    offset: int = pydantic.Field(default=0, ge=0)
+    limit: int = pydantic.Field(default=100, ge=1, le=1000)
+
+
+class QueueHistoryJson:
+    total: int
+    offset: int
+    items: list[QueueItemJson]
+
+
+@room_blueprint.get("/queue/history.json")
+@validate(query=QueueHistoryQuery)
+@openapi.definition(
+    response=openapi.definitions.Response({"application/json": QueueHistoryJson}),
+    description=dedent(
+        """
+        Every item in the queue, including archived items, and played items older than the `QUEUE_HISTORY`
+        window (if set) that `queue.json` and mqtt are limited to. Paginated with `offset` and `limit`.
+    """
+    ),
+)
+async def queue_history_json(request: Request, room_name: str, query: QueueHistoryQuery):
+    total, items = await request.app.ctx.queue_manager.async_history_json(room_name, query.offset, query.limit)
+    return sanic.response.json({"total": total, "offset": query.offset, "items": items})
 
 
 class QueueItemAdd(pydantic.BaseModel):
@@ -388,7 +628,7 @@ class QueueItemAdd(pydantic.BaseModel):
 )
 @log_user_action(fields=["body"])
 async def add_queue_item(request: Request, room_name: str, body: QueueItemAdd):
-    user = request.app.ctx.login_manager.load(room_name, request.ctx.session_id)
+    user = await request_user(request, room_name)
     track_durations = request.app.ctx.track_manager.track_durations
     # Validation
     if request.ctx.session_id is None:
@@ -398,30 +638,29 @@ async def add_queue_item(request: Request, room_name: str, body: QueueItemAdd):
     if body.performer_name.strip() == "":
         raise sanic.exceptions.InvalidUsage(message="Performer name cannot be empty")
     # Queue update
-    async with push_queue_to_mqtt(request.app, room_name):
-        async with request.app.ctx.queue_manager.async_queue_modify_context(room_name) as queue:
-            queue_item = QueueItem(
-                track_id=body.track_id,
-                track_duration=track_durations[body.track_id],
-                session_id=request.ctx.session_id,
-                performer_name=body.performer_name,
-                video_variant=body.video_variant,
-                subtitle_variant=body.subtitle_variant,
-            )
-            queue.add(queue_item)
-
-            if not user.is_admin:
-                try:
-                    queue_updated_actions(queue)
-                except QueueValidationError as ex:
-                    log.info(f"add failed {ex=}")
-                    # NOTE: the client has special behavior for the specific
-                    # hard-coded string "queue validation failed". In the long
-                    # term we should add a more structured error format, but
-                    # for now, we require this exact string.
-                    raise sanic.exceptions.InvalidUsage(message="queue validation failed", context={"exc": str(ex)})
-                    # TODO: validation error properly!
-            return sanic.response.json(queue_item.model_dump(mode="json"))
+    async with push_queue_to_mqtt(request.app, room_name) as queue:
+        queue_item = QueueItem(
+            track_id=body.track_id,
+            track_duration=track_durations[body.track_id],
+            session_id=request.ctx.session_id,
+            performer_name=body.performer_name,
+            video_variant=body.video_variant,
+            subtitle_variant=body.subtitle_variant,
+        )
+        queue_entry = queue.add(queue_item)
+
+        if not user.is_admin:
+            try:
+                queue_updated_actions(queue)
+            except QueueValidationError as ex:
+                log.info(f"add failed {ex=}")
+                # NOTE: the client has special behavior for the specific
+                # hard-coded string "queue validation failed". In the long
+                # term we should add a more structured error format, but
+                # for now, we require this exact string.
+                raise sanic.exceptions.InvalidUsage(message="queue validation failed", context={"exc": str(ex)})
+                # TODO: validation error properly!
+        return sanic.response.json(queue_entry.to_row())
 
 
 @room_blueprint.delete(r"/queue/<queue_item_id_str:(\d+).json>")
@@ -430,17 +669,16 @@ async def add_queue_item(request: Request, room_name: str, body: QueueItemAdd):
 )
 @log_user_action(fields=["queue_item_id_str"])
 async def delete_queue_item(request: Request, room_name: str, queue_item_id_str: str):
-    user = request.app.ctx.login_manager.load(room_name, request.ctx.session_id)
+    user = await request_user(request, room_name)
     queue_item_id = int(queue_item_id_str)
-    async with push_queue_to_mqtt(request.app, room_name):
-        async with request.app.ctx.queue_manager.async_queue_modify_context(room_name) as queue:
-            _, queue_item = queue.get(queue_item_id)
-            if not queue_item:
-                raise sanic.exceptions.NotFound()
-            if queue_item.session_id != request.ctx.session_id and not user.is_admin:
-                raise sanic.exceptions.Forbidden(message="queue_item.session_id does not match session_id")
-            queue.delete(queue_item_id)
-            return sanic.response.json(queue_item.model_dump(mode="json"))
+    async with push_queue_to_mqtt(request.app, room_name) as queue:
+        _, queue_item = queue.get(queue_item_id)
+        if not queue_item:
+            raise sanic.exceptions.NotFound()
+        if queue_item.session_id != request.ctx.session_id and not user.is_admin:
+            raise sanic.exceptions.Forbidden(message="queue_item.session_id does not match session_id")
+        queue.delete(queue_item_id)
+        return sanic.response.json(queue_item.to_row())
 
 
 class QueueItemMove(pydantic.BaseModel):
@@ -456,13 +694,96 @@ class QueueItemMove(pydantic.BaseModel):
 )
 @log_user_action(fields=["body"])
 async def move_queue_item(request: Request, room_name: str, body: QueueItemMove):
-    user = request.app.ctx.login_manager.load(room_name, request.ctx.session_id)
+    user = await request_user(request, room_name)
+    if not user.is_admin:
+        raise sanic.exceptions.Forbidden(message="queue updates are for admin only")
+    async with push_queue_to_mqtt(request.app, room_name) as queue:
+        queue.move(body.source, body.target)
+        return sanic.response.json({}, status=201)
+
+
+class QueueBatchAdd(QueueItemAdd):
+    op: t.Literal["add"]
+
+
+class QueueBatchMove(QueueItemMove):
+    op: t.Literal["move"]
+
+
+class QueueBatchDelete(pydantic.BaseModel):
+    op: t.Literal["delete"]
+    id: int
+
+
+class QueueBatch(pydantic.BaseModel):
+    operations: list[t.Annotated[QueueBatchAdd | QueueBatchMove | QueueBatchDelete, pydantic.Field(discriminator="op")]]
+
+
+def _apply_batch_operation(
+    request: Request, queue: Queue, operation: QueueBatchAdd | QueueBatchMove | QueueBatchDelete
+) -> dict[str, t.Any]:
+    match operation:
+        case QueueBatchAdd():
+            track_durations = request.app.ctx.track_manager.track_durations
+            if operation.track_id not in track_durations:
+                raise ValueError(f"track_id invalid: {operation.track_id}")
+            if operation.performer_name.strip() == "":
+                raise ValueError("Performer name cannot be empty")
+            if request.ctx.session_id is None:
+                raise ValueError("session_id missing")
+            queue_item = QueueItem(
+                track_id=operation.track_id,
+                track_duration=track_durations[operation.track_id],
+                session_id=request.ctx.session_id,
+                performer_name=operation.performer_name,
+                video_variant=operation.video_variant,
+                subtitle_variant=operation.subtitle_variant,
+            )
+            return queue.add(queue_item).to_row()
+        case QueueBatchMove():
+            queue.move(operation.source, operation.target)
+            return {}
+        case QueueBatchDelete():
+            _, deleted = queue.get(operation.id)
+            if not deleted:
+                raise ValueError(f"queue item {operation.id} not found")
+            queue.delete(operation.id)
+            return deleted.to_row()
+
+
+@room_blueprint.post("/queue/batch.json")
+@validate(json=QueueBatch)
+@openapi.definition(
+    body={"application/json": QueueBatch},
+    response=[
+        openapi.definitions.Response({"application/json": NullObjectJson}, status=200),
+        openapi.definitions.Response("an operation failed - nothing was changed", status=400),
+        openapi.definitions.Response("admin required", status=403),
+    ],
+    description=dedent(
+        """
+        Apply a list of add/move/delete operations in order, as one change to the queue
+        (one save and one mqtt publish).
+        If any operation fails, none of them are applied.
+        Responds with the result of each operation.
+    """
+    ),
+)
+@log_user_action()
+async def batch_queue_items(request: Request, room_name: str, body: QueueBatch):
+    user = await request_user(request, room_name)
     if not user.is_admin:
         raise sanic.exceptions.Forbidden(message="queue updates are for admin only")
-    async with push_queue_to_mqtt(request.app, room_name):
-        async with request.app.ctx.queue_manager.async_queue_modify_context(room_name) as queue:
-            queue.move(body.source, body.target)
-            return sanic.response.json({}, status=201)
+    results: list[dict[str, t.Any]] = []
+    async with push_queue_to_mqtt(request.app, room_name) as queue:
+        for operation in body.operations:
+            try:
+                results.append({"ok": True, "result": _apply_batch_operation(request, queue, operation)})
+            except (ValueError, AssertionError) as ex:
+                results.append({"ok": False, "error": str(ex)})
+                # Raising inside the modify context discards every change made by this batch
+                raise sanic.exceptions.InvalidUsage(message="batch operation failed", context={"results": results})
+        return sanic.response.json({"results": results})
 
 
 # Queue / Commands ------------------------------------------------------------
@@ -496,20 +817,20 @@ class CommandReturn:
 )
 @log_user_action(fields=["command"])
 async def queue_command(request: Request, room_name: str, command: str):
-    user = request.app.ctx.login_manager.load(room_name, request.ctx.session_id)
+    user = await request_user(request, room_name)
     if not user.is_admin:
         raise sanic.exceptions.Forbidden(message="commands are for admin only")
     if command not in Commands:
         raise sanic.exceptions.NotFound(message="invalid command")
-    async with push_queue_to_mqtt(request.app, room_name):
-        async with request.app.ctx.queue_manager.async_queue_modify_context(room_name) as queue:
-            getattr(queue, command)()
-            return sanic.response.json({"is_playing": bool(queue.is_playing)})
+    async with push_queue_to_mqtt(request.app, room_name) as queue:
+        getattr(queue, command)()
+        return sanic.response.json({"is_playing": bool(queue.is_playing)})
 
 
 # Background Tasks -------------------------------------------------------------
 
 app.add_task(background_tracks_update_event(app))
+app.add_task(background_queue_compact(app))
 
 
 # Main -------------------------------------------------------------------------
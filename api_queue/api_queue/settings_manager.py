@@ -5,7 +5,9 @@ from pathlib import Path
 
 import annotated_types
 import pydantic
+from sanic.log import logger as log
 
+from .static_files import write_precompressed
 from .type_parsers import parse_datetime, parse_timedelta
 
 type Tag = str
@@ -39,27 +41,74 @@ class QueueSettings(pydantic.BaseModel):
     coming_soon_track_count: t.Annotated[int, annotated_types.Gt(0), annotated_types.Lt(10)] = 5
     validation_event_start_datetime: OptionalDatetime = None
     validation_event_end_datetime: OptionalDatetime = None
-    # validation_duplicate_performer_timedelta: Timedelta | None = None  # Not implemented
-    # validation_duplicate_track_timedelta: Timedelta | None = None  # Not implemented
+    validation_duplicate_performer_timedelta: TimeDelta | None = None
+    validation_duplicate_track_timedelta: TimeDelta | None = None
     auto_reorder_queue: bool = False
 
 
 class SettingsManager:
-    def __init__(self, path: Path):
+    """
+    Parsed settings are cached per room.
+    `set` writes through to the cache. A cache entry is used while the file's mtime/size are unchanged,
+    so edits from outside this process (another worker, or by hand) are picked up.
+    Callers get a copy, so changing it doesn't change the cache.
+
+    With `static_path`, settings are also written to `<static_path>/<room>/settings.json` (with precompressed
+    `.br`/`.gz`) when they are set, for a static file server. Reads only write it when it is missing
+    (rooms saved before snapshots were enabled) - edits made outside of `set` are not copied.
+    """
+
+    def __init__(self, path: Path, static_path: Path | None = None):
         path.mkdir(parents=True, exist_ok=True)  # is this safe?
         assert path.is_dir()
         self.path = path
+        self.static_path = static_path
+        self._cache: dict[str, tuple[tuple[int, int] | None, QueueSettings]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, name: str) -> Path:
+        return self.path.joinpath(f"{name}_settings.json")
+
+    def _version(self, path: Path) -> tuple[int, int] | None:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
 
     def room_exists(self, name: str) -> bool:
-        return self.path.joinpath(f"{name}_settings.json").is_file()
+        return self._path(name).is_file()
 
     def set(self, name: str, settings: QueueSettings) -> None:
-        path = self.path.joinpath(f"{name}_settings.json")
+        path = self._path(name)
         json_str = settings.model_dump_json()
         path.write_text(json_str)
+        self._cache[name] = (self._version(path), settings.model_copy())
+        self._write_static(name, json_str)
 
     def get(self, name: str) -> QueueSettings:
-        path = self.path.joinpath(f"{name}_settings.json")
-        if path.is_file():
-            return QueueSettings.model_validate_json(path.read_text())
-        return QueueSettings()
+        path = self._path(name)
+        version = self._version(path)
+        cached = self._cache.get(name)
+        if cached and cached[0] == version:
+            self.hits += 1
+            return cached[1].model_copy()
+        self.misses += 1
+        settings = QueueSettings.model_validate_json(path.read_text()) if version else QueueSettings()
+        self._cache[name] = (version, settings)
+        if version and (static := self.path_static(name)) and not static.is_file():
+            self._write_static(name, settings.model_dump_json())
+        return settings.model_copy()
+
+    def path_static(self, name: str) -> Path | None:
+        return self.static_path.joinpath(name, "settings.json") if self.static_path else None
+
+    def _write_static(self, name: str, json_str: str) -> None:
+        if not (path := self.path_static(name)):
+            return
+        # The settings are already saved - a failure here only leaves the static copy behind
+        try:
+            write_precompressed(path, json_str.encode("utf8"))
+        except Exception:
+            log.exception(f"[settings_manager] failed to write {path}")
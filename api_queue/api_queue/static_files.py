@@ -0,0 +1,123 @@
+import contextlib
+import gzip
+import os
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+
+import brotli
+
+# Written on every change, so favour speed over the last few percent of size
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# `Content-Encoding` -> file suffix (as expected by Caddy's `file_server { precompressed }`)
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """
+    >>> gzip.decompress(compress(b"[]", "gzip"))
+    b'[]'
+    >>> brotli.decompress(compress(b"[]", "br"))
+    b'[]'
+    """
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    raise ValueError(f"unsupported encoding {encoding}")
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+    """
+    The preferred encoding (`br`, then `gzip`) that the client accepts
+
+    >>> negotiate_encoding("gzip, deflate, br")
+    'br'
+    >>> negotiate_encoding("gzip, br;q=0")
+    'gzip'
+    >>> negotiate_encoding("*")
+    'br'
+    >>> negotiate_encoding("identity") is None
+    True
+    """
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        encoding, _, params = part.strip().partition(";")
+        q = 1.0
+        if (param := params.strip()).startswith("q="):
+            try:
+                q = float(param[2:])
+            except ValueError:
+                q = 0.0
+        accepted[encoding.strip()] = q
+    for encoding in PRECOMPRESSED_SUFFIXES:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class CompressedCache:
+    """
+    Compressed variants of response bodies, so each distinct body is compressed once per encoding.
+    `key` must change whenever the body does (e.g. a payload's etag/digest).
+    The least recently used `maxsize` entries are kept.
+
+    >>> cache = CompressedCache(maxsize=1)
+    >>> gzip.decompress(cache.get("v1", b"[1]", "gzip"))
+    b'[1]'
+    >>> _ = cache.get("v1", b"[1]", "gzip"); _ = cache.get("v2", b"[2]", "gzip"); _ = cache.get("v1", b"[1]", "gzip")
+    >>> (cache.hits, cache.misses)
+    (1, 3)
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self._cache: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, data: bytes, encoding: str) -> bytes:
+        cache_key = (key, encoding)
+        if (compressed := self._cache.get(cache_key)) is not None:
+            self.hits += 1
+            self._cache.move_to_end(cache_key)
+            return compressed
+        self.misses += 1
+        compressed = self._cache[cache_key] = compress(data, encoding)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return compressed
+
+
+def _replace(path: Path, data: bytes) -> None:
+    # A unique temp file - every worker writes the same snapshot files
+    fd, path_tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as filehandle:
+            os.fchmod(filehandle.fileno(), 0o644)  # readable by the static file server
+            filehandle.write(data)
+        os.replace(path_tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path_tmp)
+        raise
+
+
+def write_precompressed(path: Path, data: bytes) -> None:
+    """
+    Write `path` for a static file server, with `.br`/`.gz` siblings.
+    Each file is renamed into place, so a reader never sees a partly written file.
+    The compressed files are written first - `path` existing is what makes the server use them.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     write_precompressed(Path(tmp, "room", "queue.json"), b"[]")
+    ...     sorted(p.name for p in Path(tmp, "room").iterdir())
+    ['queue.json', 'queue.json.br', 'queue.json.gz']
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+        _replace(path.with_name(f"{path.name}{suffix}"), compress(data, encoding))
+    _replace(path, data)
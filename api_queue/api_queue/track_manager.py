@@ -1,10 +1,19 @@
 from pathlib import Path
+import asyncio
 import logging
 import json
+import time
 import collections.abc as ct
+import typing as t
 from types import MappingProxyType
 import datetime
 
+try:
+    import inotify.adapters
+    import inotify.constants
+except ImportError:  # inotify is linux only - fall back to polling `tracks.json` mtime
+    inotify = None  # type: ignore[assignment]
+
 log = logging.getLogger(__name__)
 
 
@@ -17,6 +26,7 @@ class TrackManager:
         self.path = path
         self.mtime: float = 0
         self.track_durations: TrackDurations = MappingProxyType({})
+        self._inotify: inotify.adapters.Inotify | None = None
         if not path.is_file():
             log.error(
                 "No `tracks.json` file present or provided. api_queue WILL NOT FUNCTION IN PRODUCTION. `processmedia` should output `tracks.json` when encoding is complete"
@@ -27,15 +37,127 @@ class TrackManager:
     def has_tracks_updated(self) -> bool:
         return self.path.is_file() and self.mtime != self.path.stat().st_mtime
 
+    @property
+    def path_durations(self) -> Path:
+        return self.path.with_name("tracks_durations.json")
+
     def reload_tracks(self) -> None:
         if not self.path.is_file():
             log.error("`tracks.json` does not exist - unable to reload_tracks")
             return
-        with self.path.open() as filehandle:
-            self.track_durations = MappingProxyType(
-                {
-                    track_id: datetime.timedelta(seconds=track_payload["duration"])
-                    for track_id, track_payload in json.load(filehandle).items()
-                }
-            )
-        self.mtime = self.path.stat().st_mtime
+        stat = self.path.stat()
+        durations = self._load_durations(stat.st_mtime_ns)
+        if durations is None:
+            log.info(f"{self.path_durations} missing or stale - parsing `tracks.json`")
+            with self.path.open() as filehandle:
+                durations = dict(_stream_durations(filehandle))
+        self.track_durations = MappingProxyType(
+            {track_id: datetime.timedelta(seconds=duration) for track_id, duration in durations.items()}
+        )
+        self.mtime = stat.st_mtime
+
+    def _load_durations(self, tracks_json_mtime_ns: int) -> dict[TrackID, float] | None:
+        """
+        `processmedia` exports `tracks_durations.json` (`{track_id: duration}`) alongside `tracks.json`
+        """
+        try:
+            with self.path_durations.open() as filehandle:
+                index = json.load(filehandle)
+        except (FileNotFoundError, ValueError):
+            return None
+        if index.get("tracks_json_mtime_ns") != tracks_json_mtime_ns:
+            return None
+        return index["durations"]
+
+    async def wait_for_change(self, timeout: float) -> None:
+        """
+        Return as soon as `tracks.json` is written or replaced (inotify), or after `timeout` seconds.
+        Without inotify, this just waits `timeout` seconds, and callers fall back to polling `has_tracks_updated`.
+        """
+        if not self._watch():
+            await asyncio.sleep(timeout)
+            return
+        deadline = time.monotonic() + timeout
+        # Read events in short blocking slices, so the thread never holds up shutdown for long
+        while (remaining := deadline - time.monotonic()) > 0:
+            if await asyncio.to_thread(self._inotify_event, min(remaining, 1.0)):
+                return
+
+    def _watch(self) -> bool:
+        if self._inotify:
+            return True
+        if not inotify or not self.path.parent.is_dir():
+            return False
+        # Watch the directory, not the file - `processmedia` replaces `tracks.json` by renaming a temp file over it
+        self._inotify = inotify.adapters.Inotify()
+        self._inotify.add_watch(
+            str(self.path.parent),
+            mask=inotify.constants.IN_CLOSE_WRITE | inotify.constants.IN_MOVED_TO,
+        )
+        return True
+
+    def _inotify_event(self, timeout: float) -> bool:
+        assert self._inotify
+        for _, _, _, filename in self._inotify.event_gen(yield_nones=False, timeout_s=timeout):
+            if filename == self.path.name:
+                log.debug(f"inotify event for {self.path}")
+                return True
+        return False
+
+
+def _stream_durations(filehandle: t.TextIO, chunk_size: int = 64 * 1024) -> ct.Iterator[tuple[TrackID, float]]:
+    """
+    Parse `duration` from `tracks.json` one track at a time, reading it in chunks.
+    Only the track being parsed (and the unparsed rest of the last chunk) is held in memory,
+    not the whole file or every track's tags/attachments/sources.
+
+    >>> import io
+    >>> tracks = '{"Track1": {"duration": 60.5, "tags": {"a": ["}"]}}, "Track2": {"duration": 30}}'
+    >>> dict(_stream_durations(io.StringIO(tracks), chunk_size=7))
+    {'Track1': 60.5, 'Track2': 30}
+    >>> dict(_stream_durations(io.StringIO(' { } ')))
+    {}
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    index = 0
+
+    def _read() -> bool:
+        nonlocal buffer, index
+        chunk = filehandle.read(chunk_size)
+        buffer = buffer[index:] + chunk
+        index = 0
+        return bool(chunk)
+
+    def _skip(chars: str) -> str:
+        """
+        Skip past `chars`, returning the next character (`""` at the end of the file)
+        """
+        nonlocal index
+        while True:
+            while index < len(buffer) and buffer[index] in chars:
+                index += 1
+            if index < len(buffer):
+                return buffer[index]
+            if not _read():
+                return ""
+
+    def _decode() -> t.Any:
+        # Only strings and objects are decoded - neither can parse successfully when cut short by the chunk end
+        nonlocal index
+        while True:
+            try:
+                value, index = decoder.raw_decode(buffer, index)
+                return value
+            except ValueError:
+                if not _read():
+                    raise
+
+    if _skip(" \t\r\n") != "{":
+        raise ValueError("`tracks.json` is not a json object")
+    index += 1
+    while _skip(" \t\r\n,") not in ("}", ""):
+        track_id = _decode()
+        _skip(" \t\r\n:")
+        track = _decode()
+        yield track_id, track["duration"]
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import random
+import timeit
+import tracemalloc
+import typing as t
+from functools import partial
+
+from api_queue.queue_model import Queue, QueueEntry, QueueItem
+from api_queue.queue_updated_actions import _rank, _rank_key
+from api_queue.settings_manager import QueueSettings
+
+
+SIZES = (50, 500, 5000)
+NOW = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def queue_item(n: int) -> QueueItem:
+    return QueueItem(
+        track_id=f"Track{n}",
+        track_duration=datetime.timedelta(seconds=random.randint(60, 300)),
+        session_id=f"Session{n % 50}",
+        performer_name=f"performer{n % 50}",
+        added_time=NOW - datetime.timedelta(minutes=n),
+        video_variant="Default",
+        subtitle_variant="Default",
+    )
+
+
+def queue(size: int) -> Queue:
+    qu = Queue([], QueueSettings())
+    qu._now = NOW
+    for n in range(size):
+        qu.add(queue_item(n))
+    qu.play()
+    return qu
+
+
+def _report(name: str, size: int, **timings: float) -> None:
+    print(f"{name:30s} {size:6d} " + " ".join(f"{k}={v * 1000:9.3f}ms" for k, v in timings.items()))
+
+
+def bench_recalculate_start_times(sizes: t.Sequence[int], number: int) -> None:
+    """
+    Full recalculation of start_times (everything from the current item) vs
+    incremental recalculation (from the last item, as done by `Queue.add`)
+    """
+    for size in sizes:
+        qu = queue(size)
+        _report(
+            "recalculate_start_times",
+            size,
+            full=timeit.timeit(lambda: qu._recalculate_start_times(), number=number) / number,
+            incremental=timeit.timeit(lambda: qu._recalculate_start_times(len(qu.items) - 1), number=number) / number,
+        )
+
+
+def bench_reorder(sizes: t.Sequence[int], number: int) -> None:
+    """
+    `auto_reorder_queue` sort key: `_rank` (a pass over the whole queue per item) vs `_rank_key` (grouped by performer)
+    """
+    for size in sizes:
+        qu = queue(size)
+        _number = max(1, number // 10) if size > 1000 else number
+        _report(
+            "reorder",
+            size,
+            rank=timeit.timeit(lambda: sorted(qu.items, key=partial(_rank, qu)), number=_number) / _number,
+            rank_key=timeit.timeit(lambda: sorted(qu.items, key=_rank_key(qu)), number=_number) / _number,
+        )
+
+
+def _rows(size: int) -> list[dict[str, str]]:
+    """
+    Persisted rows, as read from csv
+    """
+    return [{k: "" if v is None else str(v) for k, v in i.to_row().items()} for i in queue(size).items]
+
+
+def bench_codec(sizes: t.Sequence[int], number: int) -> None:
+    """
+    Persisted rows: `model_validate`/`model_dump` vs `QueueItem.to_row`
+    vs the `QueueEntry` record that `Queue` holds
+    """
+    for size in sizes:
+        rows = _rows(size)
+        queue_items = [QueueItem.model_validate(row) for row in rows]
+        entries = [QueueEntry.from_row(row) for row in rows]
+        _report(
+            "decode",
+            size,
+            model_validate=timeit.timeit(lambda: [QueueItem.model_validate(row) for row in rows], number=number) / number,
+            entry=timeit.timeit(lambda: [QueueEntry.from_row(row) for row in rows], number=number) / number,
+        )
+        _report(
+            "encode",
+            size,
+            model_dump=timeit.timeit(lambda: [i.model_dump(mode="json") for i in queue_items], number=number) / number,
+            to_row=timeit.timeit(lambda: [i.to_row() for i in queue_items], number=number) / number,
+            entry=timeit.timeit(lambda: [i.to_row() for i in entries], number=number) / number,
+        )
+
+
+def _bytes_per_item(decode: t.Callable[[dict[str, str]], object], rows: list[dict[str, str]]) -> float:
+    tracemalloc.start()
+    try:
+        items = [decode(row) for row in rows]
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(items) == len(rows)
+    return allocated / len(rows)
+
+
+def bench_memory(sizes: t.Sequence[int], number: int) -> None:
+    """
+    Memory held per queue item (decoded from persisted rows): `QueueItem` vs `QueueEntry`
+    """
+    for size in sizes:
+        rows = _rows(size)
+        print(
+            f"{'memory':30s} {size:6d} "
+            f"queue_item={_bytes_per_item(QueueItem.model_validate, rows):7.0f}B "
+            f"entry={_bytes_per_item(QueueEntry.from_row, rows):7.0f}B"
+        )
+
+
+BENCHMARKS: dict[str, t.Callable[[t.Sequence[int], int], None]] = {
+    "recalculate_start_times": bench_recalculate_start_times,
+    "reorder": bench_reorder,
+    "codec": bench_codec,
+    "memory": bench_memory,
+}
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Micro-benchmarks for api_queue hot paths")
+    p.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run (default all): {', '.join(BENCHMARKS)}")
+    p.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Number of items in the queue")
+    p.add_argument("--number", type=int, default=20, help="Repetitions per timing")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name](args.sizes, args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -29,8 +29,10 @@ async def app(tmp_path: Path, mock_mqtt) -> ct.AsyncGenerator[App]:
         {
             "PATH_TRACKS": temp_path_tracks,
             "PATH_QUEUE": tmp_path,
+            "PATH_ANALYTICS": tmp_path.joinpath("analytics.json"),
             "MQTT": mock_mqtt,
             "BACKGROUND_TASK_TRACK_UPDATE_ENABLED": False,
+            "BACKGROUND_TASK_QUEUE_COMPACT_ENABLED": False,
         }
     )
     yield app
@@ -42,8 +44,8 @@ def qu() -> Queue:
         track_space=datetime.timedelta(seconds=10),
         validation_event_start_datetime=datetime.datetime(2022, 1, 1, 9, 50, tzinfo=datetime.timezone.utc),
         validation_event_end_datetime=datetime.datetime(2022, 1, 1, 10, 10, tzinfo=datetime.timezone.utc),
-        # validation_duplicate_performer_timedelta = datetime.timedelta(minutes=4),
-        # validation_duplicate_track_timedelta = datetime.timedelta(minutes=4),
+        validation_duplicate_performer_timedelta=datetime.timedelta(minutes=4),
+        validation_duplicate_track_timedelta=datetime.timedelta(minutes=4),
         coming_soon_track_count=3,
     )
     qu = Queue([], settings=settings)
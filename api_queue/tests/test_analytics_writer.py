@@ -0,0 +1,68 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from api_queue.analytics_writer import AnalyticsWriter
+
+
+def read(path: Path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.is_file() else []
+
+
+@pytest.mark.asyncio
+async def test_analytics_writer_batch_size(tmp_path: Path):
+    path = tmp_path.joinpath("analytics.json")
+    writer = AnalyticsWriter(path, batch_size=3, flush_interval=60)
+    writer.start()
+    writer.log({"event": 1})
+    writer.log({"event": 2})
+    await asyncio.sleep(0.05)
+    assert read(path) == [], "events are buffered until a batch is ready"
+    writer.log({"event": 3})
+    await asyncio.sleep(0.05)
+    assert read(path) == [{"event": 1}, {"event": 2}, {"event": 3}]
+    assert writer.written == 3
+    await writer.close()
+
+
+@pytest.mark.asyncio
+async def test_analytics_writer_flush_interval(tmp_path: Path):
+    path = tmp_path.joinpath("analytics.json")
+    writer = AnalyticsWriter(path, batch_size=100, flush_interval=0.05)
+    writer.start()
+    writer.log({"event": 1})
+    await asyncio.sleep(0.1)
+    assert read(path) == [{"event": 1}]
+    await writer.close()
+
+
+@pytest.mark.asyncio
+async def test_analytics_writer_close(tmp_path: Path):
+    path = tmp_path.joinpath("analytics.json")
+    writer = AnalyticsWriter(path, flush_interval=60)
+    writer.start()
+    writer.log({"event": 1})
+    await writer.close()
+    assert read(path) == [{"event": 1}]
+
+
+@pytest.mark.asyncio
+async def test_analytics_writer_dropped(tmp_path: Path):
+    path = tmp_path.joinpath("analytics.json")
+    writer = AnalyticsWriter(path, maxsize=2, batch_size=100)
+    for i in range(5):
+        writer.log({"event": i})
+    assert writer.dropped == 3
+    assert writer.buffer_depth == 2
+    await writer.close()
+    assert read(path) == [{"event": 3}, {"event": 4}], "the oldest events are dropped"
+
+
+@pytest.mark.asyncio
+async def test_analytics_writer_error(tmp_path: Path):
+    writer = AnalyticsWriter(tmp_path.joinpath("missing", "analytics.json"))
+    writer.log({"event": 1})
+    await writer.close()
+    assert writer.errors == 1
@@ -1,12 +1,18 @@
 import pytest
+import asyncio
 import collections.abc
 import datetime
+import gzip
+import os
+import threading
 import typing as t
 import collections.abc as ct
+from pathlib import Path
 
 import ujson as json
 from sanic_testing.testing import TestingResponse as Response
 from api_queue.api_types import App
+from api_queue.queue_manager import QueueManager
 
 
 class APIQueue:
@@ -67,11 +73,21 @@ class APIQueue:
         request, response = await self.app.asgi_client.put(f"/api/room/{self._queue}/queue.json", data=json.dumps(kwargs))
         return response
 
+    async def batch(self, *operations: ct.Mapping[str, t.Any]) -> Response:
+        request, response = await self.app.asgi_client.post(
+            f"/api/room/{self._queue}/queue/batch.json", data=json.dumps({"operations": operations})
+        )
+        return response
+
     async def command(self, command: str) -> Response:
         request, response = await self.app.asgi_client.get(f"/api/room/{self._queue}/command/{command}.json")
         return response
 
 
+def published(mock_mqtt, topic: str) -> list[t.Any]:
+    return [call.args[1] for call in mock_mqtt.publish.await_args_list if call.args[0] == topic]
+
+
 @pytest.fixture
 async def api_queue(app: App):
     import api_queue.server
@@ -97,6 +113,49 @@ async def test_tracks(api_queue: APIQueue):
     assert "KAT_TUN_Your_side_Instrumental" in (await api_queue.tracks).keys()
 
 
+@pytest.mark.asyncio
+async def test_tracks_compressed(api_queue: APIQueue):
+    url = f"/api/room/{api_queue._queue}/tracks.json"
+    path = Path(api_queue.app.config.PATH_TRACKS)
+    path.with_name("tracks.json.gz").write_bytes(gzip.compress(path.read_bytes()))
+
+    request, response = await api_queue.app.asgi_client.get(url, headers={"accept-encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "KAT_TUN_Your_side_Instrumental" in response.json
+
+    # `tracks.json` replaced, but the compressed copy not yet
+    mtime = path.stat().st_mtime + 10
+    os.utime(path, times=(mtime, mtime))
+    request, response = await api_queue.app.asgi_client.get(url, headers={"accept-encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert "KAT_TUN_Your_side_Instrumental" in response.json
+
+
+@pytest.mark.asyncio
+async def test_queue_json_compressed(api_queue: APIQueue):
+    url = f"/api/room/{api_queue._queue}/queue.json"
+    request, response = await api_queue.app.asgi_client.get(url, headers={"accept-encoding": "br"})
+    assert "content-encoding" not in response.headers, "small responses are not compressed"
+
+    await api_queue.login()
+    await api_queue.post(track_id="KAT_TUN_Your_side_Instrumental", performer_name="test1")
+    await api_queue.post(track_id="Animaniacs_OP", performer_name="test2")
+    for encoding in ("br", "gzip"):
+        request, response = await api_queue.app.asgi_client.get(url, headers={"accept-encoding": encoding})
+        assert response.headers["content-encoding"] == encoding
+        assert response.headers["vary"] == "accept-encoding"
+        assert len(response.json) == 2
+    request, response = await api_queue.app.asgi_client.get(url, headers={"accept-encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert len(response.json) == 2
+
+    request, response = await api_queue.app.asgi_client.get(
+        f"/api/room/{api_queue._queue}/settings.json", headers={"accept-encoding": "gzip"}
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json["title"] == "KaraKara"
+
+
 @pytest.mark.asyncio
 async def test_queue_null(api_queue: APIQueue):
     assert isinstance(await api_queue.queue, collections.abc.Sequence)
@@ -172,15 +231,128 @@ async def test_queue_add(api_queue: APIQueue, mock_mqtt):
     # add track
     response = await api_queue.post(track_id="KAT_TUN_Your_side_Instrumental", performer_name="test")
     assert response.status == 200
-    mock_mqtt.publish.assert_awaited_once()
+    assert len(published(mock_mqtt, "room/test/queue")) == 1
     # check track now in queue
     queue = await api_queue.queue
     assert len(queue) == 1
     assert {"track_id": "KAT_TUN_Your_side_Instrumental", "performer_name": "test"}.items() <= queue[0].items()
-    assert mock_mqtt.publish.await_args.args == ("room/test/queue", json.dumps(queue))
+    assert mock_mqtt.publish.await_args.args == ("room/test/queue", json.dumps(queue).encode("utf8"))
     assert mock_mqtt.publish.await_args.kwargs == dict(retain=True)
 
 
+@pytest.mark.asyncio
+async def test_queue_etag(api_queue: APIQueue):
+    url = f"/api/room/{api_queue._queue}/queue.json"
+    request, response = await api_queue.app.asgi_client.get(url)
+    etag_empty = response.headers["etag"]
+
+    await api_queue.post(track_id="KAT_TUN_Your_side_Instrumental", performer_name="test")
+    request, response = await api_queue.app.asgi_client.get(url, headers={"if-none-match": etag_empty})
+    assert response.status == 200, "queue has changed"
+    etag = response.headers["etag"]
+    assert etag != etag_empty
+
+    request, response = await api_queue.app.asgi_client.get(url, headers={"if-none-match": etag})
+    assert response.status == 304
+    assert response.headers["etag"] == etag
+    assert response.headers["vary"] == "accept-encoding"
+    assert not response.body
+
+    # Each encoding is a different body, so has its own etag
+    await api_queue.post(track_id="Animaniacs_OP", performer_name="test2")  # big enough to be compressed
+    etags = {}
+    for encoding in ("identity", "gzip", "br"):
+        request, response = await api_queue.app.asgi_client.get(url, headers={"accept-encoding": encoding})
+        etags[encoding] = response.headers["etag"]
+    assert len(set(etags.values())) == 3
+    request, response = await api_queue.app.asgi_client.get(
+        url, headers={"accept-encoding": "gzip", "if-none-match": etags["br"]}
+    )
+    assert response.status == 200, "the client holds the brotli body, not the gzip one"
+
+
+@pytest.mark.asyncio
+async def test_queue_history(api_queue: APIQueue):
+    url = f"/api/room/{api_queue._queue}/queue/history.json"
+    await api_queue.post(track_id="KAT_TUN_Your_side_Instrumental", performer_name="test1")
+    await api_queue.post(track_id="Animaniacs_OP", performer_name="test2")
+
+    request, response = await api_queue.app.asgi_client.get(url, params={"offset": 1, "limit": 1})
+    assert response.status == 200
+    assert response.json["total"] == 2
+    assert [i["track_id"] for i in response.json["items"]] == ["Animaniacs_OP"]
+
+    request, response = await api_queue.app.asgi_client.get(url, params={"limit": 0})
+    assert response.status == 400
+
+
+@pytest.mark.asyncio
+async def test_queue_patch(api_queue: APIQueue, mock_mqtt):
+    await api_queue.post(track_id="KAT_TUN_Your_side_Instrumental", performer_name="test1")
+    await api_queue.post(track_id="Animaniacs_OP", performer_name="test2")
+    queue = await api_queue.queue
+    patches = [json.loads(patch) for patch in published(mock_mqtt, "room/test/queue-patch")]
+    assert [patch["seq"] for patch in patches] == [1, 2]
+    assert [[item["track_id"] for item in patch["added"]] for patch in patches] == [
+        ["KAT_TUN_Your_side_Instrumental"],
+        ["Animaniacs_OP"],
+    ]
+    assert patches[1]["prev_etag"] == patches[0]["etag"]
+    assert all(call.kwargs == dict(retain=False) for call in mock_mqtt.publish.await_args_list if call.args[0] == "room/test/queue-patch")
+
+    request, response = await api_queue.app.asgi_client.get(
+        f"/api/room/{api_queue._queue}/queue.json", headers={"accept-encoding": "identity"}
+    )
+    assert response.headers["x-queue-seq"] == "2"
+    assert response.headers["etag"] == patches[1]["etag"]
+
+    mock_mqtt.publish.reset_mock()
+    await api_queue.login()
+    await api_queue.command("play")
+    (patch,) = [json.loads(patch) for patch in published(mock_mqtt, "room/test/queue-patch")]
+    assert patch["seq"] == 3
+    assert not patch["removed"] and not patch["added"]
+    assert [item_id for item_id, _ in patch["start_times"]] == [item["id"] for item in queue]
+
+
+@pytest.mark.asyncio
+async def test_queue_slow_storage(app: App, api_queue: APIQueue, monkeypatch: pytest.MonkeyPatch):
+    """
+    A room with slow storage should not stall requests for other rooms
+    """
+    api_queue_slow = APIQueue(app, "slow")
+    await api_queue.login()
+    await api_queue_slow.login()
+
+    # The slow room's save blocks (in its worker thread) until released
+    saving = threading.Event()
+    release = threading.Event()
+
+    def slow(method):
+        def _slow(self, name, *args):
+            if name == "slow":
+                saving.set()
+                assert release.wait(timeout=5)
+            return method(self, name, *args)
+
+        return _slow
+
+    monkeypatch.setattr(QueueManager, "_save", slow(QueueManager._save))
+    monkeypatch.setattr(QueueManager, "_append_journal", slow(QueueManager._append_journal))
+
+    add_slow = asyncio.create_task(api_queue_slow.post(track_id="KAT_TUN_Your_side_Instrumental", performer_name="test"))
+    assert await asyncio.to_thread(saving.wait, 5)
+    # Another room's change and read are served while the slow save is still blocked
+    response = await api_queue.post(track_id="KAT_TUN_Your_side_Instrumental", performer_name="test")
+    assert response.status == 200
+    assert len(await api_queue.queue) == 1
+    assert not add_slow.done()
+
+    release.set()
+    assert (await add_slow).status == 200
+    assert len(await api_queue_slow.queue) == 1
+
+
 @pytest.mark.asyncio
 async def test_queue_add_csv(api_queue: APIQueue):
     await api_queue.post(track_id="KAT_TUN_Your_side_Instrumental", performer_name="test1")
@@ -207,7 +379,7 @@ async def test_queue_delete(api_queue: APIQueue, mock_mqtt):
     # user can delete own tracks
     response = await api_queue.delete(queue_item_id=queue[0]["id"])
     assert response.status == 200
-    mock_mqtt.publish.assert_awaited_once()
+    assert len(published(mock_mqtt, "room/test/queue")) == 1
     queue = await api_queue.queue
     assert len(queue) == 1
     assert queue[0]["track_id"] == "Animaniacs_OP"
@@ -248,7 +420,7 @@ async def test_queue_move(api_queue: APIQueue, mock_mqtt):
     # move
     response = await api_queue.put(source=queue[0]["id"], target=queue[2]["id"])
     assert response.status == 201
-    mock_mqtt.publish.assert_awaited_once()
+    assert len(published(mock_mqtt, "room/test/queue")) == 1
     queue = await api_queue.queue
     assert [i["track_id"] for i in queue] == [
         "Animaniacs_OP",
@@ -265,6 +437,50 @@ async def test_queue_move(api_queue: APIQueue, mock_mqtt):
     ]
 
 
+@pytest.mark.asyncio
+async def test_queue_batch(api_queue: APIQueue, mock_mqtt):
+    await api_queue.login()
+    await api_queue.logout()
+    await api_queue.post(track_id="KAT_TUN_Your_side_Instrumental", performer_name="test1")
+    await api_queue.post(track_id="Animaniacs_OP", performer_name="test2")
+    queue = await api_queue.queue
+    add = {"op": "add", "video_variant": "Default", "subtitle_variant": "Default"}
+
+    response = await api_queue.batch({"op": "delete", "id": queue[0]["id"]})
+    assert response.status == 403
+    await api_queue.login()
+
+    mock_mqtt.publish.reset_mock()
+    response = await api_queue.batch(
+        add | {"track_id": "Macross_Dynamite7_OP_Dynamite_Explosion", "performer_name": "test3"},
+        {"op": "move", "source": queue[1]["id"], "target": queue[0]["id"]},
+        {"op": "delete", "id": queue[0]["id"]},
+    )
+    assert response.status == 200
+    results = response.json["results"]
+    assert [r["ok"] for r in results] == [True, True, True]
+    assert results[0]["result"]["track_id"] == "Macross_Dynamite7_OP_Dynamite_Explosion"
+    assert results[2]["result"]["id"] == queue[0]["id"]
+    assert len(published(mock_mqtt, "room/test/queue")) == 1
+    queue = await api_queue.queue
+    assert [i["track_id"] for i in queue] == ["Animaniacs_OP", "Macross_Dynamite7_OP_Dynamite_Explosion"]
+
+    # a failed operation discards the whole batch
+    mock_mqtt.publish.reset_mock()
+    response = await api_queue.batch(
+        {"op": "delete", "id": queue[0]["id"]},
+        add | {"track_id": "NotRealTrackId", "performer_name": "test3"},
+        {"op": "delete", "id": queue[1]["id"]},
+    )
+    assert response.status == 400
+    assert [r["ok"] for r in response.json["context"]["results"]] == [True, False]
+    mock_mqtt.publish.assert_not_awaited()
+    assert await api_queue.queue == queue
+
+    response = await api_queue.batch({"op": "nonsense"})
+    assert response.status == 400
+
+
 @pytest.mark.asyncio
 async def test_queue_command(api_queue: APIQueue, mock_mqtt):
     # populate tracks
@@ -286,7 +502,7 @@ async def test_queue_command(api_queue: APIQueue, mock_mqtt):
     # play
     response = await api_queue.command("play")
     assert response.status == 200
-    mock_mqtt.publish.assert_awaited_once()
+    assert len(published(mock_mqtt, "room/test/queue")) == 1
 
     queue = await api_queue.queue
     assert all(queue_item["start_time"] for queue_item in queue), "all tracks should have a start time"
@@ -334,3 +550,27 @@ async def test_queue_updated_actions__end_datetime(api_queue: APIQueue):
 
     response = await api_queue.post(track_id="KAT_TUN_Your_side_Instrumental", performer_name="test_name")
     assert response.status == 200
+
+
+@pytest.mark.asyncio
+async def test_analytics(app: App):
+    request, response = await app.asgi_client.post("/api/misc/analytics.json", data=json.dumps({"event": "test"}))
+    assert response.json is True
+    await app.ctx.analytics_writer.flush()
+    with open(app.config.PATH_ANALYTICS) as filehandle:
+        events = [json.loads(line) for line in filehandle]
+    assert {"event": "test"}.items() <= events[-1].items()
+
+
+@pytest.mark.asyncio
+async def test_metrics(app: App):
+    request, response = await app.asgi_client.get("/api/misc/metrics")
+    assert response.status == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE api_queue_request_seconds histogram" in response.text
+    assert "api_queue_lock_waits_total 0" in response.text.splitlines()
+    # The request itself is observed once its response is sent
+    assert (
+        'api_queue_request_seconds_count{route="karakara_queue.misc.metrics",method="GET",status="200"} 1'
+        in app.ctx.metrics.render(rooms=()).splitlines()
+    )
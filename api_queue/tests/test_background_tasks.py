@@ -1,12 +1,14 @@
 import os
 import json
-from unittest.mock import AsyncMock
+import asyncio
+from unittest.mock import AsyncMock, Mock, PropertyMock
 from pathlib import Path
 
 import pytest
 
 from api_queue.api_types import App
-from api_queue.background_tasks import _background_tracks_update_event
+from api_queue.background_tasks import _background_queue_compact, _background_tracks_update_event
+from api_queue.leader_lock import LeaderLock
 
 
 @pytest.mark.asyncio
@@ -32,3 +34,56 @@ async def test_background_tracks_update_event(app: App, mock_mqtt: AsyncMock) ->
     payload = json.loads(payload)
     assert channel == "global/tracks-updated"
     assert payload["tracks_json_mtime"] == tracks_json_mtime
+
+
+@pytest.mark.asyncio
+async def test_background_tracks_update_event_not_leader(app: App, mock_mqtt: AsyncMock) -> None:
+    await app.asgi_client.get("/")
+
+    # Another worker is the leader
+    leader = LeaderLock(app.ctx.tracks_updated_leader.path)
+    assert leader.is_leader
+
+    tracks_json: Path = app.ctx.track_manager.path
+    tracks_json_mtime: float = tracks_json.stat().st_mtime - 1
+    os.utime(tracks_json, times=(tracks_json_mtime, tracks_json_mtime))
+
+    await _background_tracks_update_event(app)
+    assert app.ctx.track_manager.mtime == tracks_json_mtime  # every worker reloads
+    mock_mqtt.publish.assert_not_awaited()  # only the leader publishes
+
+    # The leader exits, and this worker takes over
+    leader.release()
+    os.utime(tracks_json, times=(tracks_json_mtime - 1, tracks_json_mtime - 1))
+    await _background_tracks_update_event(app)
+    assert mock_mqtt.publish.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_tracks_wait_for_change_timeout(app: App) -> None:
+    await app.asgi_client.get("/")
+    await asyncio.wait_for(app.ctx.track_manager.wait_for_change(timeout=0.01), timeout=2)
+
+
+@pytest.mark.asyncio
+async def test_background_queue_compact_room_failure(app: App) -> None:
+    await app.asgi_client.get("/")
+    app.ctx.queue_manager = Mock(
+        rooms_to_archive=["room1", "room2"],
+        rooms_to_compact=["room1", "room2"],
+        async_archive=AsyncMock(side_effect=[OSError("disk full"), 1]),
+        async_compact=AsyncMock(side_effect=[OSError("disk full"), None]),
+    )
+    await _background_queue_compact(app)
+    assert [call.args for call in app.ctx.queue_manager.async_archive.await_args_list] == [("room1",), ("room2",)]
+    assert [call.args for call in app.ctx.queue_manager.async_compact.await_args_list] == [("room1",), ("room2",)]
+
+
+@pytest.mark.asyncio
+async def test_background_queue_compact_list_failure(app: App) -> None:
+    await app.asgi_client.get("/")
+    queue_manager = Mock(rooms_to_compact=["room1"], async_compact=AsyncMock())
+    type(queue_manager).rooms_to_archive = PropertyMock(side_effect=RuntimeError("dictionary changed size"))
+    app.ctx.queue_manager = queue_manager
+    await _background_queue_compact(app)
+    queue_manager.async_compact.assert_awaited_once_with("room1")
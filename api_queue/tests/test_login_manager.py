@@ -1,6 +1,9 @@
+import json
 from pathlib import Path
 
-from api_queue.login_manager import LoginManager
+import pytest
+
+from api_queue.login_manager import LoginManager, RoomAccounts
 
 
 def test_login_manager(tmp_path: Path):
@@ -29,3 +32,29 @@ def test_login_manager(tmp_path: Path):
     # further request from the same session are no longer admin
     user = lm.load("test_room", "my_session_id")
     assert user.is_admin is False
+
+
+def test_login_manager_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    lm = LoginManager(tmp_path)
+    lm.login("test_room", "my_session_id", "test_room")
+
+    reads = 0
+    model_validate_json = RoomAccounts.model_validate_json
+
+    def _model_validate_json(*args):
+        nonlocal reads
+        reads += 1
+        return model_validate_json(*args)
+
+    monkeypatch.setattr(RoomAccounts, "model_validate_json", _model_validate_json)
+    assert lm.load("test_room", "my_session_id").is_admin is True
+    assert lm.load("test_room", "my_session_id").is_admin is True
+    assert lm.load("test_room", "other_session_id").is_admin is False
+    assert reads == 1, "accounts are read once and cached"
+
+    # Another process writes the accounts file
+    path = tmp_path.joinpath("test_room_accounts.json")
+    path.write_text(json.dumps({"admin_sessions": ["other_session_id", "and_another_session_id"]}))
+    assert lm.load("test_room", "other_session_id").is_admin is True
+    assert lm.load("test_room", "my_session_id").is_admin is False
+    assert reads == 2
@@ -0,0 +1,109 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from api_queue.mqtt_publisher import MqttPublisher
+
+
+@pytest.mark.asyncio
+async def test_mqtt_publisher_coalesce(mock_mqtt: AsyncMock):
+    publisher = MqttPublisher(mock_mqtt, debounce=0.05)
+    publisher.start()
+    await publisher.publish("room/test/queue", "1")
+    await publisher.publish("room/test/queue", "2")
+    await publisher.publish("room/test/settings", "a")
+    await publisher.publish("room/test/queue", "3")
+    mock_mqtt.publish.assert_not_awaited()
+
+    await asyncio.sleep(0.1)
+    assert mock_mqtt.publish.await_count == 2
+    assert [c.args for c in mock_mqtt.publish.await_args_list] == [("room/test/queue", "3"), ("room/test/settings", "a")]
+    assert publisher.published == 2
+    assert publisher.coalesced == 2
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_mqtt_publisher_flush(mock_mqtt: AsyncMock):
+    publisher = MqttPublisher(mock_mqtt, debounce=60)
+    await publisher.publish("room/test/queue", "1")
+    mock_mqtt.publish.assert_not_awaited()
+    await publisher.flush()
+    mock_mqtt.publish.assert_awaited_once_with("room/test/queue", "1", retain=True)
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_mqtt_publisher_unchanged(mock_mqtt: AsyncMock):
+    publisher = MqttPublisher(mock_mqtt)
+    for payload in ("1", "1", b"1"):
+        await publisher.publish("room/test/queue", payload)
+        await publisher.flush()
+    mock_mqtt.publish.assert_awaited_once()
+    assert publisher.unchanged == 2
+    await publisher.publish("room/test/queue", "2")
+    await publisher.flush()
+    assert mock_mqtt.publish.await_count == 2
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_mqtt_publisher_does_not_wait_for_broker(mock_mqtt: AsyncMock):
+    broker = asyncio.Event()
+
+    async def slow_publish(*args, **kwargs):
+        await broker.wait()
+
+    mock_mqtt.publish.side_effect = slow_publish
+    publisher = MqttPublisher(mock_mqtt)
+    publisher.start()
+    await asyncio.wait_for(publisher.publish("room/test/queue", "1"), timeout=0.1)
+    await asyncio.sleep(0)
+    assert publisher.published == 0
+    broker.set()
+    await publisher.flush()
+    assert publisher.published == 1
+    assert publisher.queue_depth == 0
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_mqtt_publisher_retry(mock_mqtt: AsyncMock):
+    mock_mqtt.publish.side_effect = [Exception("broker gone"), None]
+    reconnect = AsyncMock()
+    publisher = MqttPublisher(mock_mqtt, reconnect=reconnect)
+    publisher.start()
+    await publisher.publish("room/test/queue", "1")
+    await publisher.flush()
+    assert mock_mqtt.publish.await_count == 2
+    reconnect.assert_awaited_once()
+    assert publisher.errors == 1
+    assert publisher.published == 1
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_mqtt_publisher_backpressure(mock_mqtt: AsyncMock):
+    publisher = MqttPublisher(mock_mqtt, maxsize=2, put_timeout=0.01)  # not started - nothing drains the queue
+    await publisher.publish("room/test1/queue", "1")
+    await publisher.publish("room/test2/queue", "1")
+    await publisher.publish("room/test1/queue", "2")  # coalesced with the queued update
+    assert publisher.queue_depth == 2
+    await publisher.publish("room/test3/queue", "1")
+    assert publisher.dropped == 1
+    await publisher.flush()
+    assert [c.args for c in mock_mqtt.publish.await_args_list] == [("room/test1/queue", "2"), ("room/test2/queue", "1")]
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_mqtt_publisher_events(mock_mqtt: AsyncMock):
+    publisher = MqttPublisher(mock_mqtt, debounce=60)
+    for payload in ("1", "1", "2"):
+        await publisher.publish("room/test/queue-patch", payload, retain=False)
+    await publisher.flush()
+    assert [c.args for c in mock_mqtt.publish.await_args_list] == [("room/test/queue-patch", p) for p in ("1", "1", "2")]
+    assert all(c.kwargs == dict(retain=False) for c in mock_mqtt.publish.await_args_list)
+    assert publisher.coalesced == publisher.unchanged == 0
+    await publisher.close()
@@ -1,26 +1,391 @@
+import asyncio
 import datetime
+import gzip
+import json
 from pathlib import Path
 
+import brotli
+import pytest
+
 from api_queue.settings_manager import SettingsManager
 from api_queue.queue_model import QueueItem
-from api_queue.queue_manager import QueueManager
+from api_queue.queue_manager import QueueManager, QueuePayload
 
 
 # TODO: more queue_manager tests needed
 
 
+def qi(track_id: str) -> QueueItem:
+    return QueueItem(
+        track_id=track_id,
+        track_duration=datetime.timedelta(seconds=60),
+        session_id="abcd-1234-ghjk-5787",
+        performer_name="test_name",
+        video_variant="Default",
+        subtitle_variant="Default",
+    )
+
+
 def test_queue_manager(tmp_path: Path):
     # TODO: finish
     manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path))
     with manager.queue_modify_context("test") as qu:
-        qu.add(
-            QueueItem(
-                track_id="Track6",
-                track_duration=datetime.timedelta(seconds=60),
-                session_id="abcd-1234-ghjk-5787",
-                performer_name="test_name",
-                video_variant="Default",
-                subtitle_variant="Default",
-            )
-        )
+        qu.add(qi("Track6"))
     assert manager.for_json("test")[0]["session_id"] == "abcd"
+
+
+def test_queue_manager_in_memory(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path))
+    assert manager.for_json("test") == []
+    assert "test" not in manager.queues, "reading an unknown room should not hold it in memory"
+
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track1"))
+    assert manager.path_csv("test").is_file(), "changes are persisted"
+
+    # The queue is not re-read from disk once loaded
+    manager.path_csv("test").write_text("")
+    assert [i["track_id"] for i in manager.for_json("test")] == ["Track1"]
+
+    # A fresh manager loads the persisted queue
+    manager.path_csv("test").unlink(missing_ok=True)
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track2"))
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path))
+    assert [i["track_id"] for i in manager.for_json("test")] == ["Track1", "Track2"]
+
+
+def test_queue_manager_exception_discards_changes(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path))
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track1"))
+    with pytest.raises(ValueError):
+        with manager.queue_modify_context("test") as qu:
+            qu.add(qi("Track2"))
+            raise ValueError()
+    assert [i["track_id"] for i in manager.for_json("test")] == ["Track1"]
+
+
+def _state(manager: QueueManager, name: str) -> list[tuple[str, float | None]]:
+    return [(i["track_id"], i["start_time"]) for i in manager.for_json(name)]
+
+
+def test_queue_manager_journal(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    for track_id in ("Track1", "Track2", "Track3", "Track4"):
+        with manager.queue_modify_context("test") as qu:
+            qu.add(qi(track_id))
+    with manager.queue_modify_context("test") as qu:
+        qu.play()
+    with manager.queue_modify_context("test") as qu:
+        qu.move(qu.items[3].id, qu.items[1].id)
+    with manager.queue_modify_context("test") as qu:
+        qu.seek_forwards(5)
+    with manager.queue_modify_context("test") as qu:
+        qu.delete(qu.items[2].id)
+    state = _state(manager, "test")
+    assert [track_id for track_id, _ in state] == ["Track1", "Track4", "Track3"]
+
+    # changes are appended to the journal, the snapshot is not written
+    assert not manager.path_csv("test").is_file()
+    assert manager.journal_lengths["test"] == 8
+    assert len(manager.path_journal("test").read_text().splitlines()) == 1 + 8
+
+    # replaying the journal reproduces the same queue
+    assert _state(QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True), "test") == state
+
+    # compaction folds the journal into the snapshot
+    manager.compact("test")
+    assert manager.journal_lengths["test"] == 0
+    assert len(manager.path_journal("test").read_text().splitlines()) == 1
+    assert _state(QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True), "test") == state
+    assert _state(QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path)), "test") == state
+
+
+def test_queue_manager_journal_torn_record(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track1"))
+    with manager.path_journal("test").open("a") as filehandle:
+        filehandle.write('{"op": "add", "args": [{"track_')
+    journal = manager.path_journal("test").read_bytes()
+
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    assert [track_id for track_id, _ in _state(manager, "test")] == ["Track1"]
+    assert manager.path_journal("test").read_bytes() == journal, "loading (under a shared lock) never writes"
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track2"))
+
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    assert [track_id for track_id, _ in _state(manager, "test")] == ["Track1", "Track2"]
+
+
+def test_queue_manager_journal_load_is_read_only(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    assert manager.for_json("test") == []
+    with manager.queue_modify_context("test"):
+        pass
+    assert not manager.path_journal("test").exists(), "the journal is only created by a change"
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track1"))
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    assert [track_id for track_id, _ in _state(manager, "test")] == ["Track1"]
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_queue_manager_journal_bad_records(tmp_path: Path):
+    """
+    An unreadable record is skipped, and replay stops at a record that fails to apply,
+    keeping the changes before it rather than failing to load the room
+    """
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track1"))
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track2"))
+    *_, add = manager.path_journal("test").read_text().splitlines()
+    with manager.path_journal("test").open("a") as filehandle:
+        filehandle.write("not json\n")
+        filehandle.write(add.replace("Track2", "Track3") + "\n")
+        filehandle.write(json.dumps({**json.loads(add), "op": "move", "args": ["unknown", "unknown"]}) + "\n")
+        filehandle.write(add.replace("Track2", "Track4") + "\n")
+
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    assert [track_id for track_id, _ in _state(manager, "test")] == ["Track1", "Track2", "Track3"]
+    assert "test" in manager.rooms_to_compact
+
+    # The next change writes a snapshot instead of appending after the bad records
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track5"))
+    assert len(manager.path_journal("test").read_text().splitlines()) == 1
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    assert [track_id for track_id, _ in _state(manager, "test")] == ["Track1", "Track2", "Track3", "Track5"]
+    assert not manager.rooms_to_compact
+
+
+@pytest.mark.parametrize("journal", (False, True))
+def test_queue_manager_write_failure_discards_changes(tmp_path: Path, journal: bool):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=journal)
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track1"))
+    assert manager.payload("test").seq == 1
+
+    manager.path_journal("test").unlink(missing_ok=True)
+    manager.path_journal("test").mkdir()  # neither the journal append nor the snapshot can be written
+    manager.path_csv("test").unlink(missing_ok=True)
+    manager.path_csv("test").mkdir()
+    with pytest.raises(OSError):
+        with manager.queue_modify_context("test") as qu:
+            qu.add(qi("Track2"))
+    assert "test" not in manager.queues, "the unpersisted change is not kept in memory"
+    assert manager.seqs.get("test", 0) == 1, "seq only advances once the change is written"
+
+
+def test_queue_manager_journal_already_compacted(tmp_path: Path):
+    """
+    Simulate a crash after the snapshot was written but before the journal was reset
+    """
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track1"))
+    journal = manager.path_journal("test").read_bytes()
+    manager.compact("test")
+    manager.path_journal("test").write_bytes(journal)
+
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    assert [track_id for track_id, _ in _state(manager, "test")] == ["Track1"]
+
+
+def test_queue_manager_payload(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path))
+    assert manager.payload("test").data == b"[]"
+
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track1"))
+    payload = manager.payload("test")
+    assert manager.payload("test") is payload, "payload is serialized once and reused"
+    assert json.loads(payload.data) == manager.for_json("test")
+
+    with manager.queue_modify_context("test") as qu:
+        pass
+    assert manager.payload("test") is payload, "unmodified queue keeps the same payload"
+
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track2"))
+    assert manager.payload("test").etag != payload.etag
+
+
+def test_queue_manager_history(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), history=1)
+    for track_id in ("Track1", "Track2", "Track3", "Track4"):
+        with manager.queue_modify_context("test") as qu:
+            qu.add(qi(track_id))
+    assert len(manager.for_json("test")) == 4, "nothing played yet"
+    with manager.queue_modify_context("test") as qu:
+        qu.play()
+        qu._now = qu.items[2].start_time
+    assert [i["track_id"] for i in manager.for_json("test")] == ["Track2", "Track3", "Track4"]
+    assert [i["track_id"] for i in json.loads(manager.payload("test").data)] == ["Track2", "Track3", "Track4"]
+
+    total, items = manager.history_json("test", offset=0, limit=2)
+    assert total == 4
+    assert [i["track_id"] for i in items] == ["Track1", "Track2"]
+    assert manager.history_json("test", offset=4) == (4, [])
+    assert manager.history_json("unknown") == (0, [])
+
+
+def test_queue_manager_archive(tmp_path: Path):
+    manager = QueueManager(
+        path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True, archive_after=datetime.timedelta(hours=1)
+    )
+    start = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+    with manager.queue_modify_context("test") as qu:
+        qu._now = start
+        for track_id in ("Track1", "Track2", "Track3"):
+            qu.add(qi(track_id))
+        qu.play()
+    with manager.queue_modify_context("test") as qu:
+        qu._now = start + datetime.timedelta(hours=2)
+        qu.add(qi("Track4"))
+
+    # played items are kept for `RANK_PERFORMER_HOURS`, even though `archive_after` has passed
+    assert manager.rooms_to_archive == ()
+    assert manager.archive("test") == 0
+
+    manager.queues["test"]._now = start + datetime.timedelta(hours=4)
+    assert manager.rooms_to_archive == ("test",)
+    assert manager.archive("test") == 3
+    assert [i["track_id"] for i in manager.for_json("test")] == ["Track4"]
+    assert len(manager.path_archive("test").read_text().splitlines()) == 3
+    assert manager.payload("test").seq == 3, "archiving changes the payload"
+
+    all_tracks = ["Track1", "Track2", "Track3", "Track4"]
+    total, items = manager.history_json("test")
+    assert (total, [i["track_id"] for i in items]) == (4, all_tracks)
+    total, items = manager.history_json("test", offset=2, limit=1)
+    assert (total, [i["track_id"] for i in items]) == (4, ["Track3"])
+
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    assert [i["track_id"] for i in manager.for_json("test")] == ["Track4"]
+    assert [i["track_id"] for i in manager.history_json("test")[1]] == all_tracks
+
+    # An item archived, but not yet removed from the snapshot (crash), is only listed once
+    with manager.path_archive("test").open("a") as filehandle:
+        filehandle.write(json.dumps(manager.get("test").items[0].to_row()) + "\n")
+    assert [i["track_id"] for i in manager.history_json("test")[1]] == all_tracks
+
+
+def test_queue_manager_archive_disabled(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path))
+    with manager.queue_modify_context("test") as qu:
+        qu._now = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+        qu.add(qi("Track1"))
+        qu.play()
+    assert manager.rooms_to_archive == ()
+    assert manager.archive("test") == 0
+    assert [i["track_id"] for i in manager.for_json("test")] == ["Track1"]
+
+
+def test_queue_manager_static(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), static_path=tmp_path / "static")
+    path = tmp_path / "static" / "test" / "queue.json"
+    assert manager.path_static("test") == path
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track1"))
+    assert path.read_bytes() == manager.payload("test").data
+    assert gzip.decompress(path.with_name("queue.json.gz").read_bytes()) == path.read_bytes()
+    assert brotli.decompress(path.with_name("queue.json.br").read_bytes()) == path.read_bytes()
+
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track2"))
+    assert [i["track_id"] for i in json.loads(path.read_text())] == ["Track1", "Track2"]
+    assert not list(path.parent.glob("*.tmp"))
+    assert path.stat().st_mode & 0o777 == 0o644, "readable by the static file server"
+
+
+def test_queue_manager_seq(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    assert manager.payload("test").seq == 0
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track1"))
+    with manager.queue_modify_context("test") as qu:
+        pass
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track2"))
+    assert manager.payload("test").seq == 2, "only modifications increment seq"
+
+    # seq is persisted in the journal, and survives compaction
+    assert QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True).payload("test").seq == 2
+    manager.compact("test")
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    assert manager.payload("test").seq == 2
+    with manager.queue_modify_context("test") as qu:
+        qu.add(qi("Track3"))
+    assert QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True).payload("test").seq == 3
+
+
+@pytest.mark.parametrize("journal", (False, True))
+async def test_queue_manager_file_lock_workers(tmp_path: Path, journal: bool):
+    # Two QueueManagers sharing a path behave like two sanic worker processes
+    worker1, worker2 = (
+        QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=journal, file_lock=True)
+        for _ in range(2)
+    )
+
+    async def add(manager: QueueManager, track_id: str) -> None:
+        async with manager.async_queue_modify_context("test") as qu:
+            await asyncio.sleep(0)  # let the other worker try to interleave its read-modify-write
+            qu.add(qi(track_id))
+
+    assert worker2.payload("test").data == b"[]"
+    await asyncio.gather(*(add(worker, f"Track{i}_{n}") for i in range(5) for n, worker in enumerate((worker1, worker2))))
+
+    expected = sorted(f"Track{i}_{n}" for i in range(5) for n in range(2))
+    for manager in (worker1, worker2):
+        assert sorted(i.track_id for i in manager.get("test").items) == expected, "no adds lost"
+        assert sorted(i["track_id"] for i in json.loads(manager.payload("test").data)) == expected
+    assert worker1.lock_waits == 5
+    assert worker1.lock_wait_seconds_max >= 0
+
+
+async def test_queue_manager_file_lock_wait(tmp_path: Path):
+    worker1, worker2 = (
+        QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), file_lock=True) for _ in range(2)
+    )
+    async with worker1.async_queue_modify_context("test") as qu:
+        task = asyncio.create_task(worker2.async_compact("test"))
+        await asyncio.sleep(0.05)
+        assert not task.done(), "worker2 waits for worker1 to release the room"
+        qu.add(qi("Track1"))
+    await task
+    assert worker2.lock_wait_seconds_max >= 0.05
+
+
+async def test_queue_manager_modify_payloads(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path))
+
+    async def _add(track_id: str) -> list[QueuePayload]:
+        payloads: list[QueuePayload] = []
+        async with manager.async_queue_modify_context("test", payloads=payloads) as qu:
+            await asyncio.sleep(0.01)
+            qu.add(qi(track_id))
+        return payloads
+
+    pairs = sorted(await asyncio.gather(*(_add(f"Track{n}") for n in range(3))), key=lambda pair: pair[0].seq)
+    assert [(old.seq, new.seq) for old, new in pairs] == [(0, 1), (1, 2), (2, 3)], "each pair is consecutive"
+    assert [new.etag for _, new in pairs[:-1]] == [old.etag for old, _ in pairs[1:]]
+
+
+async def test_queue_manager_metrics(tmp_path: Path):
+    manager = QueueManager(path=tmp_path, settings=SettingsManager(path=tmp_path), journal=True)
+    async with manager.async_queue_modify_context("test") as qu:
+        qu.add(qi("Track1"))
+    await manager.async_payload("test")
+    lines = manager.metrics.render(rooms=manager.queues).splitlines()
+    assert 'api_queue_lock_wait_seconds_count{room="test"} 1' in lines
+    assert 'api_queue_storage_seconds_count{room="test",op="load"} 1' in lines
+    assert 'api_queue_storage_seconds_count{room="test",op="journal"} 1' in lines
+    assert 'api_queue_serialize_seconds_count{room="test"} 1' in lines
+
+    # Rooms that are no longer held in memory are dropped
+    assert not any('room="test"' in line for line in manager.metrics.render(rooms=()).splitlines())
@@ -2,7 +2,7 @@ import pytest
 
 import datetime
 
-from api_queue.queue_model import Queue, QueueItem
+from api_queue.queue_model import Queue, QueueEntry, QueueItem
 
 from api_queue.settings_manager import QueueSettings
 
@@ -259,14 +259,10 @@ def test_queue_get(qu: Queue):
 
 def test_queue_move(qu: Queue):
     assert qu._now
-    t1 = qi("Track11", ONE_MINUTE, "TestSession11", "test_name")
-    t2 = qi("Track12", ONE_MINUTE, "TestSession12", "test_name")
-    t3 = qi("Track13", ONE_MINUTE, "TestSession13", "test_name")
-    t4 = qi("Track14", ONE_MINUTE, "TestSession14", "test_name")
-    qu.add(t1)
-    qu.add(t2)
-    qu.add(t3)
-    qu.add(t4)
+    t1 = qu.add(qi("Track11", ONE_MINUTE, "TestSession11", "test_name"))
+    t2 = qu.add(qi("Track12", ONE_MINUTE, "TestSession12", "test_name"))
+    t3 = qu.add(qi("Track13", ONE_MINUTE, "TestSession13", "test_name"))
+    t4 = qu.add(qi("Track14", ONE_MINUTE, "TestSession14", "test_name"))
     assert qu.items == [t1, t2, t3, t4]
 
     qu.move(t3.id, t1.id)
@@ -282,3 +278,180 @@ def test_queue_move(qu: Queue):
     qu._now += datetime.timedelta(seconds=60 * 5)
     with pytest.raises(AssertionError) as exc_info:
         qu.move(t4.id, t3.id)
+
+
+def test_queue_move_onto_playing(qu: Queue):
+    assert qu._now
+    t1, t2, t3 = (qu.add(qi(f"Track{n}", ONE_MINUTE, f"TestSession{n}", "test_name")) for n in range(1, 4))
+    qu.play(immediate=True)
+    qu._now += datetime.timedelta(seconds=30)
+    assert qu.playing == t1
+    start_time = t1.start_time
+
+    qu.move(t3.id, t1.id)
+    assert qu.items == [t1, t3, t2], "the moved item plays next"
+    assert qu.playing == t1
+    assert t1.start_time == start_time, "the playing item is not rescheduled"
+    assert t1.end_time and t3.end_time
+    assert t3.start_time == t1.end_time + qu.track_space
+    assert t2.start_time == t3.end_time + qu.track_space
+
+
+def test_queue_get_index_follows_changes(qu: Queue):
+    t1, t2, t3, t4 = (qu.add(qi(f"Track{n}", ONE_MINUTE, f"TestSession{n}", "test_name")) for n in range(1, 5))
+    assert qu.get(t4.id) == (3, t4)
+    qu.move(t4.id, t1.id)
+    assert qu.get(t4.id) == (0, t4)
+    assert qu.get(t1.id) == (1, t1)
+    qu.delete(t2.id)
+    assert qu.get(t2.id) == (None, None)
+    assert qu.get(t3.id) == (2, t3)
+
+
+def test_queue_cursor_matches_full_scan(qu: Queue):
+    """
+    `current`/`playing`/`future` use a cursor - they should agree with a scan of every item
+    """
+    assert qu._now
+
+    def _scan() -> tuple[QueueEntry | None, QueueEntry | None, list[QueueEntry]]:
+        now = qu.now
+        playing = next(
+            (i for i in qu.items if i.start_time and i.start_time <= now and i.end_time and i.end_time > now), None
+        )
+        future = [i for i in qu.items if not i.start_time or i.start_time >= now]
+        return playing, playing or next(iter(future), None), future
+
+    for n in range(6):
+        qu.add(qi(f"Track{n}", ONE_MINUTE, f"TestSession{n}", "test_name"))
+    qu.play(immediate=True)
+    for seconds in (0, 30, 65, 75, 140, 10, 200, 60 * 7, 60 * 10):
+        qu._now += datetime.timedelta(seconds=seconds)
+        assert (qu.playing, qu.current, list(qu.future)) == _scan()
+        if seconds == 140:
+            qu.stop()
+            assert (qu.playing, qu.current, list(qu.future)) == _scan()
+            qu.play(immediate=True)
+    qu._now -= datetime.timedelta(hours=1)  # time going backwards resets the cursor
+    assert (qu.playing, qu.current, list(qu.future)) == _scan()
+
+
+def test_queue_now_frozen_within_operation(qu: Queue):
+    qu._now = None
+    with qu.frozen_now():
+        now = qu.now
+        assert qu.now is now
+    assert qu.now is not now
+
+
+class _ReferenceQueue:
+    """
+    The scheduling rules `Queue` had before start times were recalculated incrementally:
+    every change rescheduled all of `current_future`, with `playing` found by scanning every item.
+    Items are `[id, start_time, track_duration]`.
+
+    The one intended difference: moving onto the playing item queues the item to play next. Before, it was
+    inserted before the playing item in `items`, so a second move onto it queued behind the first.
+    """
+
+    def __init__(self, qu: Queue) -> None:
+        self.qu = qu  # for `now` and `track_space`
+        self.items: list[list] = []
+
+    def _end(self, i: list) -> datetime.datetime | None:
+        return i[1] + i[2] if i[1] else None
+
+    @property
+    def playing(self) -> list | None:
+        now = self.qu.now
+        return next((i for i in self.items if i[1] and i[1] <= now and (end := self._end(i)) and end > now), None)
+
+    @property
+    def current_future(self) -> list[list]:
+        now = self.qu.now
+        future = [i for i in self.items if not i[1] or i[1] >= now]
+        current = self.playing or next(iter(future), None)
+        if current and future and future[0] is not current:
+            future.insert(0, current)
+        return future
+
+    def _recalculate_start_times(self) -> None:
+        current_future = self.current_future
+        for i_prev, i_next in zip(current_future, current_future[1:]):
+            end = self._end(i_prev)
+            i_next[1] = end + self.qu.track_space if end else None
+
+    def add(self, entry: QueueEntry) -> None:
+        self.items.append([entry.id, None, entry.track_duration])
+        self._recalculate_start_times()
+
+    def play(self) -> None:
+        self.current_future[0][1] = self.qu.now
+        self._recalculate_start_times()
+
+    def move(self, id1: int, id2: int) -> None:
+        (item,) = (i for i in self.items if i[0] == id1)
+        self.items.remove(item)
+        index2 = next(index for index, i in enumerate(self.items) if i[0] == id2) if id2 != -1 else len(self.items)
+        if (playing := self.playing) and playing[0] == id2:
+            index2 += 1
+        item[1] = None
+        self.items.insert(index2, item)
+        self._recalculate_start_times()
+
+    def delete(self, id: int) -> None:
+        current_future = self.current_future
+        if current_future and current_future[0][0] == id and current_future[0][1]:
+            current_future[0][1] = None
+            self._recalculate_start_times()
+        now = self.qu.now
+        self.items[:] = [i for i in self.items if (i[1] and i[1] < now) or i[0] != id]
+        self._recalculate_start_times()
+
+    @property
+    def start_times(self) -> dict[int, datetime.datetime | None]:
+        return {i[0]: i[1] for i in self.items}
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_queue_incremental_start_times_match_reference(qu: Queue, seed: int):
+    import random
+
+    rand = random.Random(seed)
+    assert qu._now
+    reference = _ReferenceQueue(qu)
+
+    def _add() -> None:
+        n = len(reference.items)
+        entry = qu.add(qi(f"Track{n}", datetime.timedelta(seconds=rand.randint(30, 300)), f"TestSession{n}", "test"))
+        reference.add(entry)
+
+    for _ in range(20):
+        _add()
+    qu.play(immediate=True)
+    reference.play()
+    # Start times are whole seconds from here - keep `now` between them, as the reference counts an item
+    # starting exactly at `now` as both playing and future (and reschedules it)
+    qu._now += datetime.timedelta(seconds=0.5)
+    for _ in range(60):
+        future_ids = [i.id for i in qu.current_future]
+        playing_ids = [qu.playing.id] if qu.playing else []
+        match rand.choice(("add", "delete", "move", "move_onto_playing", "time")):
+            case "add":
+                _add()
+            case "delete" if future_ids:
+                id = rand.choice(future_ids)
+                qu.delete(id)
+                reference.delete(id)
+            case "move" if len(future_ids) > 1:
+                source, target = rand.sample(future_ids, 2)
+                target = rand.choice((target, -1))
+                qu.move(source, target)
+                reference.move(source, target)
+            case "move_onto_playing" if playing_ids and len(future_ids) > 1:
+                source = rand.choice(future_ids[1:])
+                qu.move(source, playing_ids[0])
+                reference.move(source, playing_ids[0])
+            case _:
+                qu._now += datetime.timedelta(seconds=rand.randint(0, 200))
+        assert {i.id: i.start_time for i in qu.items} == reference.start_times
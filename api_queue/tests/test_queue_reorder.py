@@ -1,8 +1,10 @@
 import pytest
 import datetime
+import random
+from functools import partial
 
-from api_queue.queue_model import Queue, QueueItem
-from api_queue.queue_updated_actions import reorder
+from api_queue.queue_model import Queue, QueueEntry, QueueItem
+from api_queue.queue_updated_actions import reorder, _rank, _rank_key
 
 ONE_MINUTE = datetime.timedelta(seconds=60)
 
@@ -100,3 +102,47 @@ def test_reorder_multiple_items_in_queue(qu: Queue):
     qu.items[0].start_time = _mins_ago(5)
     reorder(qu)
     assert [i.track_id for i in qu.future] == ["Track2", "Track3", "Track4", "Track5", "Track6", "Track11"]
+
+
+def test_reorder_when_track_starts_now(qu: Queue):
+    """
+    Reordering at the instant a track starts - its performer's newest item has `start == now`
+    """
+    qu._now = datetime.datetime(2022, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+    qu.add(qi("Track1", ONE_MINUTE, "TestSession1", "test_name1", added_time=qu.now - 60 * ONE_MINUTE))
+    for n in range(2, 7):
+        qu.add(qi(f"Track{n}", ONE_MINUTE, f"TestSession{n}", f"test_name{n}", added_time=qu.now - (60 - n) * ONE_MINUTE))
+    qu.play(immediate=True)
+    assert qu.items[0].start_time == qu.now
+    reorder(qu)
+    assert [i.track_id for i in qu.items] == ["Track1", "Track2", "Track3", "Track4", "Track5", "Track6"]
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_rank_key_equivalent_to_rank(qu: Queue, seed: int):
+    """
+    Property: for randomly generated queues, `_rank_key` ranks (and so orders) every item the same as `_rank`
+    """
+    rand = random.Random(seed)
+    qu._now = datetime.datetime(2022, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+    performers = [f"test_name{n}" for n in range(rand.randint(1, 8))]
+    for n in range(rand.randint(0, 60)):
+        start_time = None
+        if rand.random() < 0.3:  # sung (or scheduled) - avoid start_time == now, which _rank can't score
+            start_time = qu.now + datetime.timedelta(minutes=rand.choice((-1, 1)) * rand.uniform(1, 300))
+        qu.items.append(
+            QueueEntry.from_item(
+                qi(
+                    f"Track{n}",
+                    datetime.timedelta(seconds=rand.randint(60, 300)),
+                    f"TestSession{n}",
+                    rand.choice(performers),
+                    added_time=qu.now - datetime.timedelta(minutes=rand.choice((rand.uniform(0, 300), 30, 60, 180))),
+                    start_time=start_time,
+                )
+            )
+        )
+    rank_key = _rank_key(qu)
+    for i in qu.items:
+        assert rank_key(i) == pytest.approx(_rank(qu, i), rel=1e-12, abs=1e-9)
+    assert sorted(qu.items, key=rank_key) == sorted(qu.items, key=partial(_rank, qu))
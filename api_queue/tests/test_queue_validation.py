@@ -3,7 +3,7 @@ import pytest
 import datetime
 
 from api_queue.queue_model import Queue, QueueItem
-from api_queue.queue_updated_actions import validate_queue, QueueValidationError
+from api_queue.queue_updated_actions import validate_queue, QueueValidationError, _recent
 
 
 ONE_MINUTE = datetime.timedelta(seconds=60)
@@ -45,15 +45,79 @@ def test_end_time(qu: Queue):
         validate_queue(qu)
 
 
-@pytest.mark.xfail(raises=NotImplementedError)
 def test_duplicate_performer(qu: Queue):
     qu.add(qi("Track1", ONE_MINUTE, "TestSession1", "test_name1"))
     qu.add(qi("Track2", ONE_MINUTE, "TestSession1", "test_name1"))
-    validate_queue(qu)
+    with pytest.raises(QueueValidationError, match="Duplicated performer"):
+        validate_queue(qu)
 
 
-@pytest.mark.xfail(raises=NotImplementedError)
 def test_duplicate_track(qu: Queue):
     qu.add(qi("Track1", ONE_MINUTE, "TestSession1", "test_name1"))
     qu.add(qi("Track1", ONE_MINUTE, "TestSession1", "test_name2"))
+    with pytest.raises(QueueValidationError, match="Duplicated track"):
+        validate_queue(qu)
+
+
+def test_duplicate_outside_timedelta(qu: Queue):
+    start_time = qu.now - datetime.timedelta(minutes=10)
+    qu.add(qi("Track1", ONE_MINUTE, "TestSession1", "test_name1", start_time=start_time))
+    qu.add(qi("Track1", ONE_MINUTE, "TestSession1", "test_name1"))
+    validate_queue(qu)
+
+
+def test_duplicate_disabled(qu: Queue):
+    qu.settings.validation_duplicate_performer_timedelta = None
+    qu.settings.validation_duplicate_track_timedelta = None
+    qu.add(qi("Track1", ONE_MINUTE, "TestSession1", "test_name1"))
+    qu.add(qi("Track1", ONE_MINUTE, "TestSession1", "test_name1"))
     validate_queue(qu)
+
+
+def test_duplicate_deleted(qu: Queue):
+    qu.add(qi("Track1", ONE_MINUTE, "TestSession1", "test_name1"))
+    qu.delete(qu.items[0].id)
+    assert not qu.items_by_performer("test_name1")
+    qu.add(qi("Track1", ONE_MINUTE, "TestSession1", "test_name1"))
+    validate_queue(qu)
+    qu.add(qi("Track1", ONE_MINUTE, "TestSession1", "test_name1"))
+    with pytest.raises(QueueValidationError, match="Duplicated performer"):
+        validate_queue(qu)
+    qu.delete(qu.items[0].id)
+    validate_queue(qu)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_recent_matches_scan(qu: Queue, seed: int):
+    """
+    `_recent` bisects the performer/track indexes - it should agree with a scan of every item, whatever the
+    queue has been through
+    """
+    import random
+
+    rand = random.Random(seed)
+    qu._now = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+    for _ in range(80):
+        future_ids = [i.id for i in qu.current_future]
+        match rand.choice(("add", "add", "delete", "move", "reorder", "play", "stop", "time")):
+            case "delete" if future_ids:
+                qu.delete(rand.choice(future_ids))
+            case "move" if len(future_ids) > 1:
+                qu.move(*rand.sample(future_ids, 2))
+            case "reorder" if future_ids:
+                qu.reorder(rand.sample(future_ids, len(future_ids)))
+            case "play":
+                qu.play(immediate=True)
+            case "stop":
+                qu.stop()
+            case "time":
+                qu._now += datetime.timedelta(seconds=rand.randint(0, 600))
+            case _:
+                n = rand.randint(1, 5)
+                qu.add(qi(f"Track{n}", ONE_MINUTE * rand.randint(1, 5), "TestSession1", f"test_name{n}"))
+        epoch = qu.now_timestamp - rand.randint(0, 3600)
+        for n in range(1, 6):
+            for items in (qu.items_by_performer(f"test_name{n}"), qu.items_by_track(f"Track{n}")):
+                for queue_item in items:
+                    expected = any(i is not queue_item and (i.start is None or i.start > epoch) for i in items)
+                    assert _recent(items, queue_item, epoch) == expected
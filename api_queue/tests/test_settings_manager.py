@@ -1,5 +1,9 @@
 from pathlib import Path
 import datetime
+import gzip
+import json
+
+import brotli
 
 from api_queue.settings_manager import SettingsManager, QueueSettings
 
@@ -119,3 +123,48 @@ def test_settings_invalid():
         assert False, "Expected ValueError for coming_soon_track_count <= 0"
     except ValueError:
         pass
+
+
+def test_settings_manager_cache(tmp_path: Path):
+    sm = SettingsManager(tmp_path)
+    sm.set("test_room", QueueSettings(title="My Room"))
+
+    assert sm.get("test_room").title == "My Room"
+    assert (sm.hits, sm.misses) == (1, 0), "set writes through to the cache"
+
+    # changing the returned settings doesn't change the cache
+    settings = sm.get("test_room")
+    settings.title = "Changed"
+    assert sm.get("test_room").title == "My Room"
+    assert (sm.hits, sm.misses) == (3, 0)
+
+    # edit from another process
+    tmp_path.joinpath("test_room_settings.json").write_text(QueueSettings(title="Edited Room").model_dump_json())
+    assert sm.get("test_room").title == "Edited Room"
+    assert sm.get("test_room").title == "Edited Room"
+    assert (sm.hits, sm.misses) == (4, 1)
+
+
+def test_settings_manager_static(tmp_path: Path):
+    sm = SettingsManager(tmp_path, static_path=tmp_path / "static")
+    assert sm.path_static("test_room") == tmp_path / "static" / "test_room" / "settings.json"
+    sm.get("test_room")
+    assert not (tmp_path / "static" / "test_room").exists(), "default settings are not written"
+
+    settings = sm.get("test_room")
+    settings.title = "My Room"
+    sm.set("test_room", settings)
+    path = tmp_path / "static" / "test_room" / "settings.json"
+    assert json.loads(path.read_text())["title"] == "My Room"
+    assert gzip.decompress(path.with_name("settings.json.gz").read_bytes()) == path.read_bytes()
+    assert brotli.decompress(path.with_name("settings.json.br").read_bytes()) == path.read_bytes()
+
+    # reads don't write the static copy
+    sm._path("test_room").write_text(settings.model_copy(update={"title": "Edited"}).model_dump_json() + " ")
+    assert sm.get("test_room").title == "Edited"
+    assert json.loads(path.read_text())["title"] == "My Room"
+
+    # unless it is missing (a room saved before snapshots were enabled)
+    path.unlink()
+    assert SettingsManager(tmp_path, static_path=tmp_path / "static").get("test_room").title == "Edited"
+    assert json.loads(path.read_text())["title"] == "Edited"
@@ -0,0 +1,43 @@
+import json
+import shutil
+import datetime
+from pathlib import Path
+
+import pytest
+
+from api_queue.track_manager import TrackManager
+
+
+@pytest.fixture
+def path_tracks(tmp_path: Path) -> Path:
+    path = tmp_path.joinpath("tracks.json")
+    shutil.copy(Path(__file__).parent.joinpath("tracks.json"), path)
+    return path
+
+
+def expected_durations(path: Path) -> dict[str, datetime.timedelta]:
+    return {k: datetime.timedelta(seconds=v["duration"]) for k, v in json.loads(path.read_text()).items()}
+
+
+def write_durations(path: Path, durations: dict[str, float], tracks_json_mtime_ns: int) -> None:
+    path.with_name("tracks_durations.json").write_text(
+        json.dumps({"tracks_json_mtime_ns": tracks_json_mtime_ns, "durations": durations})
+    )
+
+
+def test_load_tracks_json(path_tracks: Path):
+    track_manager = TrackManager(path_tracks)
+    assert track_manager.track_durations == expected_durations(path_tracks)
+    assert track_manager.mtime == path_tracks.stat().st_mtime
+
+
+def test_load_durations(path_tracks: Path):
+    write_durations(path_tracks, {"Track1": 60.5}, path_tracks.stat().st_mtime_ns)
+    track_manager = TrackManager(path_tracks)
+    assert track_manager.track_durations == {"Track1": datetime.timedelta(seconds=60.5)}
+
+
+def test_load_durations_stale(path_tracks: Path):
+    write_durations(path_tracks, {"Track1": 60.5}, path_tracks.stat().st_mtime_ns - 1)
+    track_manager = TrackManager(path_tracks)
+    assert track_manager.track_durations == expected_durations(path_tracks)
@@ -176,6 +176,152 @@ export const QueueItemSchema = {
   }
 } as const;
 
+export const QueueBatchAddSchema = {
+  "type": "object",
+  "required": [
+    "op",
+    "track_id",
+    "performer_name",
+    "video_variant",
+    "subtitle_variant"
+  ],
+  "properties": {
+    "op": {
+      "type": "string",
+      "const": "add"
+    },
+    "track_id": {
+      "type": "string",
+      "description": "ID of the track to add to the queue"
+    },
+    "performer_name": {
+      "type": "string",
+      "description": "Name of the performer"
+    },
+    "video_variant": {
+      "type": "string",
+      "description": "Selected video variant"
+    },
+    "subtitle_variant": {
+      "type": "string",
+      "description": "Selected subtitle variant"
+    }
+  }
+} as const;
+
+export const QueueBatchMoveSchema = {
+  "type": "object",
+  "required": [
+    "op",
+    "source",
+    "target"
+  ],
+  "properties": {
+    "op": {
+      "type": "string",
+      "const": "move"
+    },
+    "source": {
+      "type": "integer",
+      "description": "Source position (queue item ID)"
+    },
+    "target": {
+      "type": "integer",
+      "description": "Target position (queue item ID)"
+    }
+  }
+} as const;
+
+export const QueueBatchDeleteSchema = {
+  "type": "object",
+  "required": [
+    "op",
+    "id"
+  ],
+  "properties": {
+    "op": {
+      "type": "string",
+      "const": "delete"
+    },
+    "id": {
+      "type": "integer",
+      "description": "ID of the queue item to delete"
+    }
+  }
+} as const;
+
+export const QueueBatchSchema = {
+  "type": "object",
+  "required": [
+    "operations"
+  ],
+  "properties": {
+    "operations": {
+      "type": "array",
+      "description": "Operations to apply in order - if any fails, none are applied",
+      "items": {
+        "oneOf": [
+          {
+            "$ref": "#/components/schemas/QueueBatchAdd"
+          },
+          {
+            "$ref": "#/components/schemas/QueueBatchMove"
+          },
+          {
+            "$ref": "#/components/schemas/QueueBatchDelete"
+          }
+        ],
+        "discriminator": {
+          "propertyName": "op",
+          "mapping": {
+            "add": "#/components/schemas/QueueBatchAdd",
+            "move": "#/components/schemas/QueueBatchMove",
+            "delete": "#/components/schemas/QueueBatchDelete"
+          }
+        }
+      }
+    }
+  }
+} as const;
+
+export const QueueBatchResultSchema = {
+  "type": "object",
+  "required": [
+    "ok"
+  ],
+  "properties": {
+    "ok": {
+      "type": "boolean",
+      "description": "Whether the operation succeeded"
+    },
+    "result": {
+      "type": "object",
+      "additionalProperties": true,
+      "description": "The added or deleted queue item (empty for a move)"
+    },
+    "error": {
+      "type": "string",
+      "description": "Why the operation failed"
+    }
+  }
+} as const;
+
+export const QueueBatchResponseSchema = {
+  "type": "object",
+  "required": [
+    "results"
+  ],
+  "properties": {
+    "results": {
+      "type": "array",
+      "items": {
+        "$ref": "#/components/schemas/QueueBatchResult"
+      },
+      "description": "The result of each operation, in order"
+    }
+  }
+} as const;
+
 export const SettingsSchema = {
   "type": "object",
   "required": [
@@ -187,6 +333,8 @@ export const SettingsSchema = {
     "coming_soon_track_count",
     "validation_event_start_datetime",
     "validation_event_end_datetime",
+    "validation_duplicate_performer_timedelta",
+    "validation_duplicate_track_timedelta",
     "auto_reorder_queue"
   ],
   "properties": {
@@ -263,6 +411,28 @@ export const SettingsSchema = {
       "format": "date-time",
       "default": null
     },
+    "validation_duplicate_performer_timedelta": {
+      "title": "Duplicate performer window (seconds)",
+      "description": "Prevent users from adding a track for a performer who has sung, or is queued, within this time",
+      "type": [
+        "number",
+        "null"
+      ],
+      "format": "float",
+      "default": null,
+      "minimum": 0
+    },
+    "validation_duplicate_track_timedelta": {
+      "title": "Duplicate track window (seconds)",
+      "description": "Prevent users from adding a track that has been sung, or is queued, within this time",
+      "type": [
+        "number",
+        "null"
+      ],
+      "format": "float",
+      "default": null,
+      "minimum": 0
+    },
     "auto_reorder_queue": {
       "title": "Auto-Reorder Queue",
       "description": "Balance the queue by giving priority to first-time singers",
@@ -316,6 +486,12 @@ export const schemas = {
   Attachment: AttachmentSchema,
   Subtitle: SubtitleSchema,
   QueueItem: QueueItemSchema,
+  QueueBatchAdd: QueueBatchAddSchema,
+  QueueBatchMove: QueueBatchMoveSchema,
+  QueueBatchDelete: QueueBatchDeleteSchema,
+  QueueBatch: QueueBatchSchema,
+  QueueBatchResult: QueueBatchResultSchema,
+  QueueBatchResponse: QueueBatchResponseSchema,
   Settings: SettingsSchema,
   LintError: LintErrorSchema,
   User: UserSchema,
@@ -78,6 +78,50 @@ export interface components {
             /** @description Selected subtitle variant */
             subtitle_variant: string;
         };
+        QueueBatchAdd: {
+            /** @constant */
+            op: "add";
+            /** @description ID of the track to add to the queue */
+            track_id: string;
+            /** @description Name of the performer */
+            performer_name: string;
+            /** @description Selected video variant */
+            video_variant: string;
+            /** @description Selected subtitle variant */
+            subtitle_variant: string;
+        };
+        QueueBatchMove: {
+            /** @constant */
+            op: "move";
+            /** @description Source position (queue item ID) */
+            source: number;
+            /** @description Target position (queue item ID) */
+            target: number;
+        };
+        QueueBatchDelete: {
+            /** @constant */
+            op: "delete";
+            /** @description ID of the queue item to delete */
+            id: number;
+        };
+        QueueBatch: {
+            /** @description Operations to apply in order - if any fails, none are applied */
+            operations: (components["schemas"]["QueueBatchAdd"] | components["schemas"]["QueueBatchMove"] | components["schemas"]["QueueBatchDelete"])[];
+        };
+        QueueBatchResult: {
+            /** @description Whether the operation succeeded */
+            ok: boolean;
+            /** @description The added or deleted queue item (empty for a move) */
+            result?: {
+                [key: string]: unknown;
+            };
+            /** @description Why the operation failed */
+            error?: string;
+        };
+        QueueBatchResponse: {
+            /** @description The result of each operation, in order */
+            results: components["schemas"]["QueueBatchResult"][];
+        };
         Settings: {
             /**
              * Room title
@@ -131,6 +175,20 @@ export interface components {
              * @default null
              */
             validation_event_end_datetime: string | null;
+            /**
+             * Duplicate performer window (seconds)
+             * Format: float
+             * @description Prevent users from adding a track for a performer who has sung, or is queued, within this time
+             * @default null
+             */
+            validation_duplicate_performer_timedelta: number | null;
+            /**
+             * Duplicate track window (seconds)
+             * Format: float
+             * @description Prevent users from adding a track that has been sung, or is queued, within this time
+             * @default null
+             */
+            validation_duplicate_track_timedelta: number | null;
             /**
              * Auto-Reorder Queue
              * @description Balance the queue by giving priority to first-time singers
@@ -164,6 +222,12 @@ export type Track = components['schemas']['Track'];
 export type Attachment = components['schemas']['Attachment'];
 export type Subtitle = components['schemas']['Subtitle'];
 export type QueueItem = components['schemas']['QueueItem'];
+export type QueueBatchAdd = components['schemas']['QueueBatchAdd'];
+export type QueueBatchMove = components['schemas']['QueueBatchMove'];
+export type QueueBatchDelete = components['schemas']['QueueBatchDelete'];
+export type QueueBatch = components['schemas']['QueueBatch'];
+export type QueueBatchResult = components['schemas']['QueueBatchResult'];
+export type QueueBatchResponse = components['schemas']['QueueBatchResponse'];
 export type Settings = components['schemas']['Settings'];
 export type LintError = components['schemas']['LintError'];
 export type User = components['schemas']['User'];
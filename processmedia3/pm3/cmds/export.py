@@ -55,13 +55,19 @@ def export(
 
     # Only write if changed - turns a tiny-but-24/7 amount of
     # disk I/O into zero disk I/O
-    if old_tracklist != json_dict:
+    if old_tracklist != json_dict or not (processed_dir / "tracks_durations.json").exists():
         # Write to temp file then rename, so if the disk fills up then
         # we don't end up with a half-written tracks.json
         data = json.dumps(json_dict, default=tuple).encode("utf8")
 
         path = processed_dir / "tracks.json"
         path.with_suffix(".tmp").write_bytes(data)
+
+        # api_queue only needs the durations - write them before tracks.json is replaced, so they are
+        # ready when api_queue sees the new tracks.json. The rename keeps the mtime of the temp file,
+        # which lets api_queue check the durations belong to this tracks.json
+        export_durations(processed_dir, json_dict, path.with_suffix(".tmp").stat().st_mtime_ns)
+
         path.with_suffix(".tmp").rename(path)
 
         path = processed_dir / "tracks.json.gz"
@@ -75,6 +81,22 @@ def export(
         announce(old_tracklist, json_dict)
 
 
+def export_durations(processed_dir: Path, json_dict: dict[str, TrackDict], tracks_json_mtime_ns: int) -> None:
+    """
+    Write `tracks_durations.json` - a compact `{track_id: duration}` index of `tracks.json`
+    """
+    data = json.dumps(
+        {
+            "tracks_json_mtime_ns": tracks_json_mtime_ns,
+            "durations": {track_id: track["duration"] for track_id, track in json_dict.items()},
+        },
+        separators=(",", ":"),
+    ).encode("utf8")
+    path = processed_dir / "tracks_durations.json"
+    path.with_suffix(".tmp").write_bytes(data)
+    path.with_suffix(".tmp").rename(path)
+
+
 def announce(
     old_tracklist: dict[str, TrackDict],
     new_tracklist: dict[str, TrackDict],
@@ -39,6 +39,7 @@ SCAN_IGNORE = [
     "tracks.json",
     "tracks.json.br",
     "tracks.json.gz",
+    "tracks_durations.json",
     "readme.txt",
     "WorkInProgress",
 ]
@@ -1,7 +1,7 @@
 # generated by datamodel-codegen:
 #   filename:  components.yaml
 
-from typing import NotRequired, TypedDict
+from typing import Any, Literal, NotRequired, TypedDict
 
 
 class Attachment(TypedDict):
@@ -28,6 +28,39 @@ class QueueItem(TypedDict):
     subtitle_variant: str
 
 
+class QueueBatchAdd(TypedDict):
+    op: Literal["add"]
+    track_id: str
+    performer_name: str
+    video_variant: str
+    subtitle_variant: str
+
+
+class QueueBatchMove(TypedDict):
+    op: Literal["move"]
+    source: int
+    target: int
+
+
+class QueueBatchDelete(TypedDict):
+    op: Literal["delete"]
+    id: int
+
+
+class QueueBatch(TypedDict):
+    operations: list[QueueBatchAdd | QueueBatchMove | QueueBatchDelete]
+
+
+class QueueBatchResult(TypedDict):
+    ok: bool
+    result: NotRequired[dict[str, Any]]
+    error: NotRequired[str]
+
+
+class QueueBatchResponse(TypedDict):
+    results: list[QueueBatchResult]
+
+
 class Settings(TypedDict):
     title: str
     track_space: float
@@ -37,6 +70,8 @@ class Settings(TypedDict):
     coming_soon_track_count: int
     validation_event_start_datetime: str | None
     validation_event_end_datetime: str | None
+    validation_duplicate_performer_timedelta: float | None
+    validation_duplicate_track_timedelta: float | None
     auto_reorder_queue: bool
 
 
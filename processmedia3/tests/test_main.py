@@ -57,6 +57,11 @@ class TestE2E(unittest.TestCase):
             tracks_json = json.loads((processed / "tracks.json").read_text())
             self.assertEqual(2, len(tracks_json))
 
+            # ... and the durations index used by api_queue
+            tracks_durations = json.loads((processed / "tracks_durations.json").read_text())
+            self.assertEqual((processed / "tracks.json").stat().st_mtime_ns, tracks_durations["tracks_json_mtime_ns"])
+            self.assertEqual({k: v["duration"] for k, v in tracks_json.items()}, tracks_durations["durations"])
+
             for k, v in {
                 "attachments": {
                     "image": [